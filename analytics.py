@@ -0,0 +1,358 @@
+#
+# analytics.py
+#
+# Compensation analytics over the whole database at once. The
+# Compensation and LobbyistYears tables are loaded once into columnar
+# NumPy arrays, and every analysis (top-N of every year, per-year
+# percentiles, per-client totals, year-over-year changes) is then a
+# handful of array operations instead of one SQL aggregation per
+# year. Requires numpy (pip install numpy); the rest of the
+# application does not.
+#
+# Like the rollup behind get_top_N_lobbyists, a filing counts towards
+# a year only if it starts and ends in that year; filings that span
+# years count towards the per-client totals only.
+#
+# Usage: python analytics.py [--top N] [--percentiles 50,90,99] [database]
+#
+import argparse
+import logging
+import sqlite3
+import time
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+logger = logging.getLogger(__name__)
+
+
+##################################################################
+#
+# CompensationArrays:
+#
+# One array per column, all of the same length; entry i of every
+# array describes filing i (or registration i). NULL ids and years
+# are loaded as 0, NULL amounts as 0.0.
+#
+# Constructor(...)
+# Properties:
+#   Lobbyist_ID: int64 array, the filing's lobbyist
+#   Client_ID: int64 array, the filing's client
+#   Amount: float64 array, the compensation filed
+#   Start_Year: int64 array
+#   End_Year: int64 array
+#   Registered_Lobbyist_ID: int64 array, from LobbyistYears
+#   Registered_Year: int64 array, from LobbyistYears
+#
+class CompensationArrays:
+  def __init__(self, Lobbyist_ID, Client_ID, Amount, Start_Year, End_Year, Registered_Lobbyist_ID, Registered_Year):
+    self._Lobbyist_ID = Lobbyist_ID
+    self._Client_ID = Client_ID
+    self._Amount = Amount
+    self._Start_Year = Start_Year
+    self._End_Year = End_Year
+    self._Registered_Lobbyist_ID = Registered_Lobbyist_ID
+    self._Registered_Year = Registered_Year
+
+  @property
+  def Lobbyist_ID(self):
+    return self._Lobbyist_ID
+
+  @property
+  def Client_ID(self):
+    return self._Client_ID
+
+  @property
+  def Amount(self):
+    return self._Amount
+
+  @property
+  def Start_Year(self):
+    return self._Start_Year
+
+  @property
+  def End_Year(self):
+    return self._End_Year
+
+  @property
+  def Registered_Lobbyist_ID(self):
+    return self._Registered_Lobbyist_ID
+
+  @property
+  def Registered_Year(self):
+    return self._Registered_Year
+
+
+##################################################################
+#
+# _fetch_columns:
+#
+# Runs the query and reads its rows straight into a structured
+# array with np.fromiter, so the rows are never held as a list of
+# Python tuples.
+#
+def _fetch_columns(dbConn, sql, dtype):
+  dbCursor = dbConn.cursor()
+  try:
+    dbCursor.execute(sql)
+    return np.fromiter(dbCursor, dtype=dtype)
+  finally:
+    dbCursor.close()
+
+
+##################################################################
+#
+# load_compensation:
+#
+# Loads every compensation filing and every registration into
+# columnar arrays. The database must have been brought up to date
+# with schema.upgrade() first (the Start_Year / End_Year columns).
+#
+# Returns: a CompensationArrays object; None if numpy is not
+#          installed or an internal error occurred (in which case
+#          an error msg is already output).
+#
+def load_compensation(dbConn):
+  if np is None:
+    logger.error("load_compensation failed: numpy is not installed")
+    return None
+
+  try:
+    filings = _fetch_columns(dbConn, """
+        SELECT COALESCE(Lobbyist_ID, 0), COALESCE(Client_ID, 0),
+               COALESCE(Compensation_Amount, 0.0),
+               COALESCE(Start_Year, 0), COALESCE(End_Year, 0)
+        FROM Compensation
+    """, [("lobbyist", np.int64), ("client", np.int64), ("amount", np.float64),
+          ("start", np.int64), ("end", np.int64)])
+    registrations = _fetch_columns(dbConn, """
+        SELECT DISTINCT COALESCE(Lobbyist_ID, 0), COALESCE(CAST(Year AS INTEGER), 0)
+        FROM LobbyistYears
+    """, [("lobbyist", np.int64), ("year", np.int64)])
+  except Exception as err:
+    logger.error("load_compensation failed: %s", err)
+    return None
+
+  return CompensationArrays(filings["lobbyist"], filings["client"], filings["amount"],
+                            filings["start"], filings["end"],
+                            registrations["lobbyist"], registrations["year"])
+
+
+#
+# (lobbyist, year) pairs are packed into one int64 key, lobbyist
+# first, so sorting the keys sorts by lobbyist and then year
+#
+_YEAR_SPAN = 10000
+
+
+def _pair_key(lobbyist_ids, years):
+  return lobbyist_ids * _YEAR_SPAN + years
+
+
+##################################################################
+#
+# lobbyist_year_totals:
+#
+# Totals the single-year filings per (lobbyist, year), the same
+# figures LobbyistYearTotals holds for years other than 0.
+#
+# Returns: (lobbyist_ids, years, totals), three arrays sorted by
+#          lobbyist and then year.
+#
+def lobbyist_year_totals(comp):
+  single_year = comp.Start_Year == comp.End_Year
+  lobbyists = comp.Lobbyist_ID[single_year]
+  years = comp.Start_Year[single_year]
+
+  keys, inverse = np.unique(_pair_key(lobbyists, years), return_inverse=True)
+  totals = np.bincount(inverse.ravel(), weights=comp.Amount[single_year], minlength=len(keys))
+  return keys // _YEAR_SPAN, keys % _YEAR_SPAN, totals
+
+
+##################################################################
+#
+# _group_starts:
+#
+# Given a sorted array, returns the index at which each run of equal
+# values starts, the length of each run, and each element's position
+# within its run (all empty for an empty array).
+#
+def _group_starts(sorted_values):
+  if len(sorted_values) == 0:
+    empty = np.zeros(0, dtype=np.int64)
+    return empty, empty, empty
+  starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+  lengths = np.diff(np.r_[starts, len(sorted_values)])
+  positions = np.arange(len(sorted_values)) - np.repeat(starts, lengths)
+  return starts, lengths, positions
+
+
+##################################################################
+#
+# top_n_by_year:
+#
+# The top N lobbyists of every year at once, by total compensation
+# in that year. As in get_top_N_lobbyists only lobbyists registered
+# for the year are ranked; ties are broken by lobbyist ID (the names
+# are not loaded).
+#
+# Returns: a dict mapping each year to a list of up to N
+#          (lobbyist_id, total) pairs, highest total first.
+#
+def top_n_by_year(comp, N):
+  lobbyists, years, totals = lobbyist_year_totals(comp)
+
+  registered = np.isin(_pair_key(lobbyists, years),
+                       _pair_key(comp.Registered_Lobbyist_ID, comp.Registered_Year))
+  registered &= years > 0
+  lobbyists, years, totals = lobbyists[registered], years[registered], totals[registered]
+
+  order = np.lexsort((lobbyists, -totals, years))
+  lobbyists, years, totals = lobbyists[order], years[order], totals[order]
+  starts, _, positions = _group_starts(years)
+
+  keep = positions < N
+  top = {int(year): [] for year in years[starts]}
+  for lobbyist_id, year, total in zip(lobbyists[keep].tolist(), years[keep].tolist(), totals[keep].tolist()):
+    top[year].append((lobbyist_id, total))
+  return top
+
+
+##################################################################
+#
+# percentiles_by_year:
+#
+# Percentiles of the lobbyists' yearly totals, for every year at
+# once, interpolated linearly as np.percentile does by default.
+#
+# Returns: (years, values): the years in ascending order, and a
+#          len(years) x len(percentiles) array of the percentiles.
+#
+def percentiles_by_year(comp, percentiles=(50, 90, 99)):
+  _, years, totals = lobbyist_year_totals(comp)
+  dated = years > 0
+  years, totals = years[dated], totals[dated]
+
+  order = np.lexsort((totals, years))
+  years, totals = years[order], totals[order]
+  starts, lengths, _ = _group_starts(years)
+
+  # rank of each percentile within each year's sorted totals
+  ranks = (lengths[:, None] - 1) * (np.asarray(percentiles, dtype=np.float64)[None, :] / 100.0)
+  below = np.floor(ranks).astype(np.int64)
+  above = np.minimum(below + 1, lengths[:, None] - 1)
+  fraction = ranks - below
+  low = totals[starts[:, None] + below]
+  high = totals[starts[:, None] + above]
+  return years[starts], low + (high - low) * fraction
+
+
+##################################################################
+#
+# client_totals:
+#
+# Total compensation per client over all filings, including those
+# that span years.
+#
+# Returns: (client_ids, totals), highest total first.
+#
+def client_totals(comp):
+  clients, inverse = np.unique(comp.Client_ID, return_inverse=True)
+  totals = np.bincount(inverse.ravel(), weights=comp.Amount, minlength=len(clients))
+  order = np.argsort(-totals, kind="stable")
+  return clients[order], totals[order]
+
+
+##################################################################
+#
+# year_over_year:
+#
+# Change in every lobbyist's yearly total from the previous calendar
+# year (a lobbyist with no filings the year before is compared with
+# 0, i.e. the delta is the whole total).
+#
+# Returns: (lobbyist_ids, years, totals, deltas), sorted by lobbyist
+#          and then year.
+#
+def year_over_year(comp):
+  lobbyists, years, totals = lobbyist_year_totals(comp)
+  dated = years > 0
+  lobbyists, years, totals = lobbyists[dated], years[dated], totals[dated]
+
+  previous = np.zeros_like(totals)
+  follows = (lobbyists[1:] == lobbyists[:-1]) & (years[1:] == years[:-1] + 1)
+  previous[1:][follows] = totals[:-1][follows]
+  return lobbyists, years, totals, totals - previous
+
+
+##################################################################
+#
+# yearly_totals:
+#
+# Returns: (years, totals, deltas): total compensation of each year
+#          in ascending order, and its change from the year before
+#          (the first year's delta is its total).
+#
+def yearly_totals(comp):
+  single_year = (comp.Start_Year == comp.End_Year) & (comp.Start_Year > 0)
+  years, inverse = np.unique(comp.Start_Year[single_year], return_inverse=True)
+  totals = np.bincount(inverse.ravel(), weights=comp.Amount[single_year], minlength=len(years))
+  return years, totals, np.diff(totals, prepend=0.0)
+
+
+def timed(label, fn, *args):
+  start = time.perf_counter()
+  result = fn(*args)
+  print("%-32s %9.2f ms" % (label, (time.perf_counter() - start) * 1000.0))
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compensation analytics over a lobbyist database.")
+  parser.add_argument("db", nargs="?", default="Chicago_Lobbyists.db", help="database to analyse")
+  parser.add_argument("--top", type=int, default=5, help="lobbyists per year in the leaderboards")
+  parser.add_argument("--percentiles", default="50,90,99", help="comma-separated percentiles of yearly totals")
+  args = parser.parse_args()
+
+  if np is None:
+    parser.error("numpy is required: pip install numpy")
+  percentiles = [float(p) for p in args.percentiles.split(",")]
+
+  dbConn = sqlite3.connect(args.db)
+  try:
+    comp = timed("load", load_compensation, dbConn)
+  finally:
+    dbConn.close()
+  if comp is None:
+    return
+
+  print("%d filings, %d registrations" % (len(comp.Amount), len(comp.Registered_Year)))
+  top = timed("top %d of every year" % args.top, top_n_by_year, comp, args.top)
+  years, values = timed("percentiles of every year", percentiles_by_year, comp, percentiles)
+  clients, client_sums = timed("per-client totals", client_totals, comp)
+  timed("per-lobbyist year-over-year", year_over_year, comp)
+  totals_years, totals, deltas = timed("yearly totals", yearly_totals, comp)
+
+  print()
+  print("Year  %18s %18s  %s" % ("Total", "Change", "  ".join("p%g" % p for p in percentiles)))
+  percentile_rows = {int(year): row for year, row in zip(years, values)}
+  for year, total, delta in zip(totals_years.tolist(), totals.tolist(), deltas.tolist()):
+    row = percentile_rows.get(year, [])
+    print("%4d  %18s %18s  %s" % (year, "${:,.2f}".format(total), "${:+,.2f}".format(delta),
+                                  "  ".join("${:,.0f}".format(value) for value in row)))
+
+  print()
+  for year in sorted(top):
+    print("%d: %s" % (year, ", ".join("%d (${:,.2f})".format(total) % lobbyist_id
+                                      for lobbyist_id, total in top[year])))
+
+  print()
+  print("Top clients: %s" % ", ".join("%d (${:,.2f})".format(total) % client_id
+                                      for client_id, total in zip(clients[:args.top].tolist(),
+                                                                  client_sums[:args.top].tolist())))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,361 @@
+#
+# benchmark.py
+#
+# Times every objecttier function, reads and writes, against
+# synthetic databases built by synthdb at one or more scales (or
+# against a copy of an existing database), and reports p50 / p95
+# latency and peak Python memory per case. Results can be saved as
+# JSON and compared with an earlier run, e.g. one from another commit.
+#
+# Usage: python benchmark.py [--scale 1x,10x,100x] [--seed n] [--db path]
+#                            [--repeat n] [--records n]
+#                            [--json out.json] [--compare old.json]
+#
+import argparse
+import json
+import operator
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import objecttier
+import schema
+import synthdb
+
+
+##################################################################
+#
+# measure:
+#
+# Calls fn() repeat times (after one untimed warm-up call) and
+# returns its p50 and p95 latency in ms, plus the peak Python memory
+# allocated during one further call, traced by tracemalloc (memory
+# SQLite allocates for itself is not included).
+#
+def measure(fn, repeat):
+  fn()
+  latencies = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    latencies.append((time.perf_counter() - start) * 1000.0)
+
+  tracemalloc.start()
+  fn()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  if len(latencies) > 1:
+    p95 = statistics.quantiles(latencies, n=20, method="inclusive")[18]
+  else:
+    p95 = latencies[0]
+  return {"p50_ms": statistics.median(latencies), "p95_ms": p95, "peak_kb": peak / 1024.0}
+
+
+def report(label, result):
+  print("  %-52s p50 %9.2f ms   p95 %9.2f ms   peak %9.1f KB" %
+        (label, result["p50_ms"], result["p95_ms"], result["peak_kb"]))
+
+
+##################################################################
+#
+# read_cases:
+#
+# The read benchmarks: every objecttier read function, the searches
+# with selective and broad patterns, and the details lookups for the
+# long-tenured lobbyists and for typical ones.
+#
+# Returns: a list of (label, fn) pairs.
+#
+def read_cases(dbConn, year):
+  heavy = [row[0] for row in dbConn.execute(
+    "SELECT Lobbyist_ID FROM LobbyistYearTotals GROUP BY Lobbyist_ID ORDER BY SUM(Total_Compensation) DESC LIMIT 10")]
+  typical = [row[0] for row in dbConn.execute(
+    "SELECT Lobbyist_ID FROM LobbyistInfo ORDER BY Lobbyist_ID DESC LIMIT 100")]
+  years = [row[0] for row in dbConn.execute("SELECT Year FROM YearStats WHERE Year > 0 ORDER BY Year")]
+
+  def details(ids):
+    return lambda: [objecttier.get_lobbyist_details(dbConn, lobbyist_id) for lobbyist_id in ids]
+
+  cases = [
+    ("num_lobbyists", lambda: objecttier.num_lobbyists(dbConn)),
+    ("num_employers", lambda: objecttier.num_employers(dbConn)),
+    ("num_clients", lambda: objecttier.num_clients(dbConn)),
+    ("get_stats", lambda: objecttier.get_stats(dbConn)),
+  ]
+  for pattern in ("Lopez12%", "%ez123%", "%1234", "J_hn%", "%a%"):
+    cases.append(("get_lobbyists %r" % pattern, lambda pattern=pattern: objecttier.get_lobbyists(dbConn, pattern)))
+  cases += [
+    ("iter_lobbyists '%' (full scan)", lambda: sum(1 for _ in objecttier.iter_lobbyists(dbConn, "%"))),
+    ("get_lobbyists_page '%a%' x1000", lambda: objecttier.get_lobbyists_page(dbConn, "%a%", 0, 1000)),
+    ("count_lobbyists '%a%' limit 10000", lambda: objecttier.count_lobbyists(dbConn, "%a%", 10000)),
+    ("get_lobbyist_details x10 long-tenured", details(heavy)),
+    ("get_lobbyist_details x100 typical", details(typical)),
+    ("get_lobbyist_details_many x100 typical", lambda: objecttier.get_lobbyist_details_many(dbConn, typical)),
+  ]
+  for n in (10, 100, 1000):
+    cases.append(("get_top_N_lobbyists N=%d year %s" % (n, year),
+                  lambda n=n: objecttier.get_top_N_lobbyists(dbConn, n, year)))
+  cases += [
+    ("iter_top_N_lobbyists N=100 year %s" % year,
+     lambda: sum(1 for _ in objecttier.iter_top_N_lobbyists(dbConn, 100, year))),
+    ("get_top_N_lobbyists_for_years N=10 x%d years" % len(years),
+     lambda: objecttier.get_top_N_lobbyists_for_years(dbConn, 10, years)),
+  ]
+  return cases
+
+
+##################################################################
+#
+# write_cases:
+#
+# The write benchmarks. Every call writes new data (a year no
+# lobbyist is registered for yet, a new salutation), so each timed
+# call does the full insert or update and its trigger work.
+#
+# Returns: a list of (label, fn) pairs.
+#
+def write_cases(dbConn):
+  num_lobbyists = dbConn.execute("SELECT MAX(Lobbyist_ID) FROM LobbyistInfo").fetchone()[0]
+  calls = [0]
+
+  def next_call():
+    calls[0] += 1
+    return calls[0]
+
+  def add_year():
+    call = next_call()
+    objecttier.add_lobbyist_year(dbConn, call % num_lobbyists + 1, 3000 + call)
+    dbConn.commit()
+
+  def set_salutation():
+    call = next_call()
+    objecttier.set_salutation(dbConn, call % num_lobbyists + 1, "Dr. %d" % call)
+    dbConn.commit()
+
+  def add_years():
+    call = next_call()
+    objecttier.add_lobbyist_years(dbConn, [(i % num_lobbyists + 1, 3000 + call) for i in range(1000)])
+
+  def set_salutations():
+    call = next_call()
+    objecttier.set_salutations(dbConn, [(i % num_lobbyists + 1, "Mx. %d" % call) for i in range(1000)])
+
+  return [
+    ("add_lobbyist_year", add_year),
+    ("set_salutation", set_salutation),
+    ("add_lobbyist_years x1000", add_years),
+    ("set_salutations x1000", set_salutations),
+  ]
+
+
+##################################################################
+#
+# run_cases:
+#
+# Measures every read and write case on dbConn, with the result
+# cache off so each call reaches the database.
+#
+# Returns: a dict mapping each case's label to its measurements.
+#
+def run_cases(dbConn, year, repeat):
+  results = {}
+  enabled, objecttier.cache.enabled = objecttier.cache.enabled, False
+  try:
+    for label, fn in read_cases(dbConn, year) + write_cases(dbConn):
+      results[label] = measure(fn, repeat)
+      report(label, results[label])
+  finally:
+    objecttier.cache.enabled = enabled
+  return results
+
+
+def table_sizes(dbConn):
+  return {table: dbConn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+          for table in ("LobbyistInfo", "EmployerInfo", "ClientInfo",
+                        "LobbyistAndEmployer", "LobbyistYears", "Compensation")}
+
+
+##################################################################
+#
+# _dict_backed:
+#
+# Returns: a class with the dict-backed layout the result classes
+#          used to have (underscore attributes behind properties) and
+#          the fields of record_class, kept as the baseline for
+#          bench_records.
+#
+def _dict_backed(record_class):
+  fields = record_class._fields
+
+  def __init__(self, *values):
+    for field, value in zip(fields, values):
+      setattr(self, "_" + field, value)
+
+  namespace = {"__init__": __init__}
+  for field in fields:
+    namespace[field] = property(operator.attrgetter("_" + field))
+  return type("_Dict" + record_class.__name__, (), namespace)
+
+
+#
+# the result classes bench_records measures
+#
+RECORD_CLASSES = [objecttier.Lobbyist, objecttier.LobbyistDetails, objecttier.LobbyistClients]
+
+
+##################################################################
+#
+# bench_records:
+#
+# Construction time and memory of num_rows records of each of
+# RECORD_CLASSES built from a cursor: as plain tuples (the floor), as
+# the old dict-backed class, through the record's constructor, and
+# by its row_factory. Memory is the traced peak per record, row
+# fields included. The rows hold one short value per field (list
+# fields too, as text), the same in every layout, so the differences
+# are the records' own overhead.
+#
+# Returns: a dict mapping each class name to a dict mapping each
+#          case's label to its measurements.
+#
+def bench_records(num_rows, repeat):
+  results = {}
+  for record_class in RECORD_CLASSES:
+    name = record_class.__name__
+    fields = record_class._fields
+    dbConn = sqlite3.connect(":memory:")
+    dbConn.execute("CREATE TABLE Rows (%s)" % ", ".join(fields))
+    dbConn.executemany("INSERT INTO Rows VALUES (%s)" % ", ".join("?" * len(fields)),
+                       ((i,) + tuple("%s%d" % (field[:4], i) for field in fields[1:])
+                        for i in range(1, num_rows + 1)))
+    sql = "SELECT %s FROM Rows" % ", ".join(fields)
+    dict_backed = _dict_backed(record_class)
+
+    def build(row_factory, make):
+      dbCursor = dbConn.cursor()
+      dbCursor.row_factory = row_factory
+      records = make(dbCursor.execute(sql))
+      dbCursor.close()
+      return records
+
+    cases = [
+      ("plain tuples", None, list),
+      ("dict-backed class (old layout)", None, lambda rows: [dict_backed(*row) for row in rows]),
+      ("%s(...) constructor" % name, None, lambda rows: [record_class(*row) for row in rows]),
+      ("%s.row_factory" % name, record_class.row_factory, list),
+    ]
+
+    print("%s record construction (%d rows, %d fields):" % (name, num_rows, len(fields)))
+    results[name] = {}
+    for label, row_factory, make in cases:
+      result = measure(lambda: build(row_factory, make), repeat)
+      result["bytes_per_record"] = result["peak_kb"] * 1024.0 / num_rows
+      results[name][label] = result
+      report("%s, %.0f B/record" % (label, result["bytes_per_record"]), result)
+    dbConn.close()
+  return results
+
+
+##################################################################
+#
+# compare:
+#
+# Prints the p50 of every case both runs measured, old and new side
+# by side, with the ratio new / old (below 1 is faster).
+#
+def compare(old, new):
+  print("comparison with %s:" % (old.get("commit") or "the earlier run"))
+  compared = 0
+  for scale, measured in new["scales"].items():
+    old_cases = old.get("scales", {}).get(scale, {}).get("cases", {})
+    for label, result in measured["cases"].items():
+      if label in old_cases:
+        compared += 1
+        print("  %-6s %-52s %9.2f -> %9.2f ms  x%.2f" %
+              (scale, label, old_cases[label]["p50_ms"], result["p50_ms"],
+               result["p50_ms"] / max(old_cases[label]["p50_ms"], 1e-9)))
+  if compared == 0:
+    print("  no cases in common (were they run at the same scales?)")
+
+
+def git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+  except OSError:
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark objecttier functions.")
+  parser.add_argument("--scale", default="1x",
+                      help="comma-separated synthetic scales to run (%s)" % ", ".join(synthdb.SCALES))
+  parser.add_argument("--seed", type=int, default=341, help="seed of the synthetic databases")
+  parser.add_argument("--db", help="benchmark a copy of this database instead of synthetic ones")
+  parser.add_argument("--year", default="2020", help="year used by the Top-N benchmarks")
+  parser.add_argument("--repeat", type=int, default=20, help="timed runs per case")
+  parser.add_argument("--records", type=int, default=200000, help="rows used by the record construction benchmark")
+  parser.add_argument("--json", help="save the results to this JSON file")
+  parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+  args = parser.parse_args()
+
+  scales = [scale.strip() for scale in args.scale.split(",")]
+  for scale in scales:
+    if scale not in synthdb.SCALES:
+      parser.error("unknown scale %r" % scale)
+
+  results = {
+    "commit": git_commit(),
+    "python": platform.python_version(),
+    "sqlite": sqlite3.sqlite_version,
+    "seed": args.seed,
+    "repeat": args.repeat,
+    "scales": {},
+  }
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    # the write cases change the database, so an existing one is
+    # benchmarked on a copy
+    targets = [(os.path.basename(args.db), args.db)] if args.db else [(scale, None) for scale in scales]
+    for name, source in targets:
+      path = os.path.join(tmpdir, "%s.db" % name)
+      start = time.perf_counter()
+      if source:
+        print("Copying %s..." % source)
+        sourceConn = sqlite3.connect(source)
+        dbConn = sqlite3.connect(path)
+        sourceConn.backup(dbConn)
+        sourceConn.close()
+        schema.upgrade(dbConn)
+      else:
+        print("Building %s synthetic database (seed %d)..." % (name, args.seed))
+        dbConn = synthdb.build_scale(path, name, args.seed)
+      build_s = time.perf_counter() - start
+
+      sizes = table_sizes(dbConn)
+      print("%s: %s lobbyists, %s filings, ready in %.1f s" %
+            (name, "{:,}".format(sizes["LobbyistInfo"]), "{:,}".format(sizes["Compensation"]), build_s))
+      cases = run_cases(dbConn, args.year, args.repeat)
+      dbConn.close()
+      results["scales"][name] = {"build_s": build_s, "rows": sizes, "cases": cases}
+
+  results["records"] = bench_records(args.records, min(args.repeat, 5))
+
+  if args.json:
+    with open(args.json, "w") as output:
+      json.dump(results, output, indent=2)
+    print("results saved to %s" % args.json)
+
+  if args.compare:
+    with open(args.compare) as earlier:
+      compare(json.load(earlier), results)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,12 +1,261 @@
 #
 # datatier.py
 #
-# Executes SQL queries against the given database.
+# Executes SQL queries against the given database, and hands out
+# tuned per-thread connections to it (ConnectionManager). Optional
+# instrumentation (enable_instrumentation) records per-statement
+# latency histograms and logs slow queries with their plans.
 #
-import sqlite3
+import bisect
+import collections
+import functools
 import logging
+import pathlib
+import re
+import sqlite3
+import threading
+import time
 
 logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger(__name__ + ".slow")
+
+
+##################################################################
+#
+# QueryStats:
+#
+# Instrumentation for the functions below: per normalized SQL
+# statement (whitespace collapsed, literals replaced by ?), the
+# number of executions, errors and rows, total and maximum latency,
+# and a latency histogram. Statements slower than slow_ms are also
+# written to the "datatier.slow" logger at WARNING level and kept
+# in a list of the most recent ones, together with their EXPLAIN
+# QUERY PLAN (captured once per statement) if explain is True.
+# Created and installed by enable_instrumentation(); while none is
+# installed the query functions only test a global for None. (A
+# statement run through perform_many gets no plan, since no single
+# parameter list stands for the batch.)
+#
+# Constructor(slow_ms=100.0, explain=True, max_slow=100, log_slow=True)
+#   log_slow: False keeps slow statements out of the log (they are
+#             still recorded)
+# Methods:
+#   record(dbConn, sql, parameters, elapsed_ms, rows, failed=False)
+#   snapshot(): the statistics as a dict (see get_query_stats)
+#   reset(): clears every statistic
+#
+HISTOGRAM_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+  return _WHITESPACE.sub(" ", _LITERALS.sub("?", sql)).strip()
+
+
+class QueryStats:
+  def __init__(self, slow_ms=100.0, explain=True, max_slow=100, log_slow=True):
+    self._slow_ms = slow_ms
+    self._explain = explain
+    self._log_slow = log_slow
+    self._lock = threading.Lock()
+    self._statements = {}
+    self._plans = {}
+    self._slow = collections.deque(maxlen=max_slow)
+
+  def record(self, dbConn, sql, parameters, elapsed_ms, rows, failed=False):
+    statement = normalize_sql(sql)
+    with self._lock:
+      stats = self._statements.get(statement)
+      if stats is None:
+        stats = self._statements[statement] = {
+          "count": 0, "errors": 0, "rows": 0, "total_ms": 0.0, "max_ms": 0.0,
+          "histogram": [0] * (len(HISTOGRAM_BOUNDS_MS) + 1),
+        }
+      stats["count"] += 1
+      stats["errors"] += failed
+      stats["rows"] += rows
+      stats["total_ms"] += elapsed_ms
+      stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+      stats["histogram"][bisect.bisect_left(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+      is_slow = elapsed_ms >= self._slow_ms
+      needs_plan = (is_slow and self._explain and parameters is not None
+                    and statement not in self._plans)
+
+    if not is_slow:
+      return
+
+    if needs_plan:
+      plan = self._explain_plan(dbConn, sql, parameters)
+      with self._lock:
+        self._plans[statement] = plan
+    plan = self._plans.get(statement)
+
+    with self._lock:
+      self._slow.append({"sql": statement, "elapsed_ms": elapsed_ms, "rows": rows,
+                         "time": time.time(), "plan": plan})
+    if self._log_slow:
+      slow_logger.warning("slow query (%.1f ms, %d rows): %s%s", elapsed_ms, rows, statement,
+                          "".join("\n  " + step for step in plan or []))
+
+  # runs on its own cursor, so the caller's cursor and results are
+  # untouched; a plan that can't be produced is recorded as None
+  def _explain_plan(self, dbConn, sql, parameters):
+    try:
+      dbCursor = dbConn.cursor()
+      try:
+        return [row[3] for row in dbCursor.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+      finally:
+        dbCursor.close()
+    except Exception as err:
+      logger.error("EXPLAIN QUERY PLAN failed: %s", err)
+      return None
+
+  def snapshot(self):
+    with self._lock:
+      statements = {statement: dict(stats, histogram=list(stats["histogram"]),
+                                    plan=self._plans.get(statement))
+                    for statement, stats in self._statements.items()}
+      slow = list(self._slow)
+    return {"slow_ms": self._slow_ms, "histogram_bounds_ms": list(HISTOGRAM_BOUNDS_MS),
+            "statements": statements, "slow": slow}
+
+  def reset(self):
+    with self._lock:
+      self._statements.clear()
+      self._plans.clear()
+      self._slow.clear()
+
+
+#
+# the installed QueryStats, or None while instrumentation is off
+#
+_stats = None
+
+
+def _elapsed_ms(start):
+  return (time.perf_counter() - start) * 1000.0
+
+
+#
+# the number of statements that have failed on each thread so far
+#
+_failures = threading.local()
+
+
+def _count_failure():
+  _failures.count = getattr(_failures, "count", 0) + 1
+
+
+##################################################################
+#
+# failure_count:
+#
+# Returns: the number of statements run through this module that have
+#          failed on the calling thread so far. Comparing it before
+#          and after some work tells whether any statement of the
+#          work failed, including one whose error the caller only
+#          saw as an empty or partial result.
+#
+def failure_count():
+  return getattr(_failures, "count", 0)
+
+
+##################################################################
+#
+# install_query_stats:
+#
+# Makes the given QueryStats object (or None, to turn instrumentation
+# off) the one every statement is recorded in, e.g. to collect the
+# statistics of one piece of work separately and then put the
+# previous object back.
+#
+# Returns: the QueryStats object installed before, or None.
+#
+def install_query_stats(stats):
+  global _stats
+  previous, _stats = _stats, stats
+  return previous
+
+
+##################################################################
+#
+# enable_instrumentation:
+#
+# Starts recording statistics for every statement run through this
+# module, replacing any statistics recorded so far.
+#
+# Returns: the new QueryStats object.
+#
+def enable_instrumentation(slow_ms=100.0, explain=True, max_slow=100):
+  stats = QueryStats(slow_ms, explain, max_slow)
+  install_query_stats(stats)
+  return stats
+
+
+##################################################################
+#
+# disable_instrumentation:
+#
+# Stops recording; the statistics recorded so far are discarded.
+#
+def disable_instrumentation():
+  install_query_stats(None)
+
+
+##################################################################
+#
+# get_query_stats:
+#
+# Returns: None if instrumentation is off, otherwise a dict with
+#          "statements", mapping each normalized statement to its
+#          count, errors, rows, total_ms, max_ms, histogram (counts
+#          per bucket of histogram_bounds_ms, the last bucket being
+#          everything slower) and plan (if it was ever slow); and
+#          "slow", the most recent slow executions, oldest first.
+#
+def get_query_stats():
+  stats = _stats
+  return None if stats is None else stats.snapshot()
+
+
+##################################################################
+#
+# reset_query_stats:
+#
+# Clears the statistics recorded so far, leaving instrumentation on
+# (or off) as it is.
+#
+def reset_query_stats():
+  stats = _stats
+  if stats is not None:
+    stats.reset()
+
+
+##################################################################
+#
+# format_query_stats:
+#
+# Returns: the statistics as a human-readable report, slowest
+#          statements (by total time) first; "" if instrumentation
+#          is off.
+#
+def format_query_stats(limit=20):
+  snapshot = get_query_stats()
+  if snapshot is None:
+    return ""
+
+  lines = []
+  ranked = sorted(snapshot["statements"].items(), key=lambda item: item[1]["total_ms"], reverse=True)
+  for statement, stats in ranked[:limit]:
+    lines.append("%8.1f ms total  %6d calls  %8.2f ms avg  %8.2f ms max  %8d rows  %s" %
+                 (stats["total_ms"], stats["count"], stats["total_ms"] / stats["count"],
+                  stats["max_ms"], stats["rows"], statement[:200]))
+    for step in stats["plan"] or []:
+      lines.append("      plan: " + step)
+  return "\n".join(lines)
 
 
 ##################################################################
@@ -28,16 +277,25 @@ def select_one_row(dbConn, sql, parameters=None):
   if parameters is None:
       parameters = []
 
+  stats = _stats
+  if stats is not None:
+    start = time.perf_counter()
+
   dbCursor = dbConn.cursor()
 
   try:
       dbCursor.execute(sql, parameters)
       row = dbCursor.fetchone()
+      if stats is not None:
+        stats.record(dbConn, sql, parameters, _elapsed_ms(start), 0 if row is None else 1)
       if row is None:
           return ()
       return row
   except Exception as err:
     logger.error("select_one_row failed: %s", err)
+    _count_failure()
+    if stats is not None:
+      stats.record(dbConn, sql, parameters, _elapsed_ms(start), 0, failed=True)
     return ()
   finally:
       dbCursor.close()
@@ -54,31 +312,103 @@ def select_one_row(dbConn, sql, parameters=None):
 # retrieves no data, the empty list [] is returned.
 # The query can be parameterized, in which case pass 
 # the values as a list via parameters; this parameter 
-# is optional.
+# is optional. Pass a sqlite3 row factory via row_factory
+# to have each row built by it instead of as a tuple.
 #
 # Returns: a list of 0 or more rows retrieved by the 
 #          given query; if an error occurs a msg is 
 #          output and None is returned.
 #
-def select_n_rows(dbConn, sql, parameters = None):
+def select_n_rows(dbConn, sql, parameters = None, row_factory = None):
   if (parameters == None):
      parameters = []
 
+  stats = _stats
+  if stats is not None:
+    start = time.perf_counter()
+
   dbCursor = dbConn.cursor()
+  if row_factory is not None:
+    dbCursor.row_factory = row_factory
 
   try:
      dbCursor.execute(sql, parameters)
      rows = dbCursor.fetchall()
+     if stats is not None:
+       stats.record(dbConn, sql, parameters, _elapsed_ms(start), len(rows))
      if rows is None:
       return []
      return rows
   except Exception as err:
     logger.error("select_n_rows failed: %s", err)
+    _count_failure()
+    if stats is not None:
+      stats.record(dbConn, sql, parameters, _elapsed_ms(start), 0, failed=True)
     return None
   finally:
      dbCursor.close()
 
 
+##################################################################
+#
+# select_iter:
+#
+# Given a database connection and a SQL Select query,
+# executes this query against the database and yields the
+# rows it retrieves one at a time, fetching them from the
+# cursor batch_size rows at a time. Unlike select_n_rows
+# the result is never held in memory all at once, so a
+# full-table scan runs in memory bounded by batch_size.
+# The query can be parameterized, in which case pass the
+# values as a list via parameters; this parameter is
+# optional. As with select_n_rows, row_factory builds
+# each row if given.
+#
+# Yields: the rows retrieved by the given query; if an
+#         error occurs (e.g. the query is interrupted part
+#         way through) a msg is output and the error is
+#         raised, so a cut-short iteration is never mistaken
+#         for the whole result.
+#
+def select_iter(dbConn, sql, parameters=None, batch_size=1000, row_factory=None):
+  if parameters is None:
+    parameters = []
+
+  #when instrumented, only the time spent in SQLite counts, not the
+  #time the caller spends between batches
+  stats = _stats
+  elapsed = 0.0
+  num_rows = 0
+
+  dbCursor = dbConn.cursor()
+  if row_factory is not None:
+    dbCursor.row_factory = row_factory
+  try:
+    if stats is not None:
+      start = time.perf_counter()
+    dbCursor.execute(sql, parameters)
+    while True:
+      rows = dbCursor.fetchmany(batch_size)
+      if stats is not None:
+        elapsed += _elapsed_ms(start)
+        num_rows += len(rows)
+      if not rows:
+        if stats is not None:
+          stats.record(dbConn, sql, parameters, elapsed, num_rows)
+        return
+      yield from rows
+      if stats is not None:
+        start = time.perf_counter()
+  except Exception as err:
+    logger.error("select_iter failed: %s", err)
+    _count_failure()
+    if stats is not None:
+      stats.record(dbConn, sql, parameters, elapsed, num_rows, failed=True)
+    raise
+  finally:
+    dbCursor.close()
+
+
 ##################################################################
 #
 # perform_action: 
@@ -102,16 +432,165 @@ def perform_action(dbConn, sql, parameters=None):
   if parameters is None:
     parameters = []
 
+  stats = _stats
+  if stats is not None:
+    start = time.perf_counter()
+
   dbCursor = dbConn.cursor()
   try:
     dbCursor.execute(sql, parameters)
     num_rows = dbCursor.rowcount
+    if stats is not None:
+      stats.record(dbConn, sql, parameters, _elapsed_ms(start), num_rows)
     return num_rows
   except Exception as err:
     logger.error("perform_action failed: %s", err)
+    _count_failure()
+    if stats is not None:
+      stats.record(dbConn, sql, parameters, _elapsed_ms(start), 0, failed=True)
+    return -1
+  finally:
+    dbCursor.close()
+
+
+##################################################################
+#
+# perform_many:
+#
+# Given a database connection, a SQL action query and a
+# list of parameter lists, executes the query once per
+# parameter list with a single executemany call. Like
+# perform_action it runs in whatever transaction is open
+# on the connection; wrap the call in "with dbConn:" to
+# make the whole batch one transaction.
+#
+# Returns: the total # of rows modified; if an error 
+#          occurs a msg is output and -1 is returned.
+#
+def perform_many(dbConn, sql, parameter_lists):
+  stats = _stats
+  if stats is not None:
+    start = time.perf_counter()
+
+  dbCursor = dbConn.cursor()
+  try:
+    dbCursor.executemany(sql, parameter_lists)
+    num_rows = dbCursor.rowcount
+    if stats is not None:
+      stats.record(dbConn, sql, None, _elapsed_ms(start), num_rows)
+    return num_rows
+  except Exception as err:
+    logger.error("perform_many failed: %s", err)
+    _count_failure()
+    if stats is not None:
+      stats.record(dbConn, sql, None, _elapsed_ms(start), 0, failed=True)
     return -1
   finally:
     dbCursor.close()
 
 
-  
+##################################################################
+#
+# Connection:
+#
+# The sqlite3.Connection subclass ConnectionManager opens. Unlike a
+# plain sqlite3 connection it can be weakly referenced, so callers
+# can keep per-connection state (such as the object tier's cache
+# key of the connection) that goes away with the connection.
+#
+class Connection(sqlite3.Connection):
+  pass
+
+
+##################################################################
+#
+# ConnectionManager:
+#
+# Hands out one SQLite connection per thread for a database file,
+# opened on first use and then reused by that thread, so concurrent
+# readers never share (or wait on) a connection and each keeps its
+# page cache and prepared statements warm between queries.
+#
+# Constructor(path, read_only=False, pragmas=None,
+#             cached_statements=256, timeout=5.0)
+#   path: database file
+#   read_only: open with a mode=ro URI; writes then fail
+#   pragmas: dict of PRAGMA name -> value applied to every new
+#            connection; defaults to DEFAULT_PRAGMAS
+#   cached_statements: size of each connection's prepared-statement
+#                      cache (sqlite3's default is 128)
+#   timeout: seconds to wait on a locked database
+# Methods:
+#   connection(): the calling thread's connection, a Connection
+#   close_all(): closes every connection handed out so far
+#
+DEFAULT_PRAGMAS = {
+  "journal_mode": "WAL",       # readers don't block the writer or each other
+  "mmap_size": 268435456,      # read up to 256 MB through the OS page cache
+  "cache_size": -65536,        # 64 MB page cache per connection
+  "temp_store": "MEMORY",      # sorts and temp b-trees in memory
+}
+
+class ConnectionManager:
+  def __init__(self, path, read_only=False, pragmas=None, cached_statements=256, timeout=5.0):
+    self._path = path
+    self._read_only = read_only
+    self._pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+    self._cached_statements = cached_statements
+    self._timeout = timeout
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._connections = []
+
+  @property
+  def path(self):
+    return self._path
+
+  @property
+  def read_only(self):
+    return self._read_only
+
+  def connection(self):
+    dbConn = getattr(self._local, "dbConn", None)
+    if dbConn is None:
+      dbConn = self._open()
+      self._local.dbConn = dbConn
+      with self._lock:
+        self._connections.append(dbConn)
+    return dbConn
+
+  def close_all(self):
+    with self._lock:
+      connections, self._connections = self._connections, []
+    for dbConn in connections:
+      try:
+        dbConn.close()
+      except Exception as err:
+        logger.error("close failed: %s", err)
+    self._local = threading.local()
+
+  #
+  # check_same_thread is off only so close_all() can close every
+  # thread's connection; each connection is still used by one thread
+  #
+  def _open(self):
+    if self._read_only:
+      uri = pathlib.Path(self._path).resolve().as_uri() + "?mode=ro"
+      dbConn = sqlite3.connect(uri, uri=True, timeout=self._timeout,
+                               cached_statements=self._cached_statements,
+                               check_same_thread=False, factory=Connection)
+    else:
+      dbConn = sqlite3.connect(self._path, timeout=self._timeout,
+                               cached_statements=self._cached_statements,
+                               check_same_thread=False, factory=Connection)
+
+    for name, value in self._pragmas.items():
+      # the journal mode is a property of the file; a read-only
+      # connection can't change it
+      if self._read_only and name == "journal_mode":
+        continue
+      try:
+        dbConn.execute("PRAGMA %s = %s" % (name, value)).fetchall()
+      except Exception as err:
+        logger.error("PRAGMA %s = %s failed: %s", name, value, err)
+    return dbConn
@@ -0,0 +1,208 @@
+#
+# export.py
+#
+# Exports query results to CSV or JSON Lines files: the lobbyists
+# matching a name search, their details, the top N lobbyists of a
+# year, or a whole table. Rows are streamed from the cursor a batch
+# at a time and written as they arrive, so memory use stays the same
+# however many rows are exported. Used by the GUI's Export menu, and
+# from the command line without the GUI.
+#
+# In CSV files, list fields (years, employers, clients) are joined
+# with "; "; in JSON Lines files each row is an object keyed by field
+# name, and list fields are arrays.
+#
+# Usage: python export.py [--db database] [--format csv|jsonl] output
+#                         search PATTERN | details (ID... | --pattern P)
+#                         | top N YEAR | table TABLE
+#
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import datatier
+import objecttier
+import schema
+
+
+FORMATS = ["csv", "jsonl"]
+
+#
+# rows fetched from the cursor at a time
+#
+BATCH_ROWS = 1000
+
+#
+# tables that can be exported whole
+#
+EXPORT_TABLES = schema.HASHED_TABLES + ["LobbyistYearTotals"]
+
+
+##################################################################
+#
+# format_for:
+#
+# Returns: the export format implied by a file name's extension
+#          (.jsonl or .json for JSON Lines); CSV otherwise.
+#
+def format_for(path):
+  extension = os.path.splitext(path)[1].lower()
+  return "jsonl" if extension in (".jsonl", ".json") else "csv"
+
+
+def _csv_value(value):
+  if isinstance(value, list):
+    return "; ".join(map(str, value))
+  return value
+
+
+##################################################################
+#
+# write_rows:
+#
+# Writes a header (CSV only) and then each row, as it arrives, to an
+# open text file.
+#
+# Returns: the number of rows written.
+#
+def write_rows(out, fields, rows, fmt="csv"):
+  count = 0
+  if fmt == "jsonl":
+    for row in rows:
+      out.write(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+      out.write("\n")
+      count += 1
+  else:
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    for row in rows:
+      writer.writerow([_csv_value(value) for value in row])
+      count += 1
+  return count
+
+
+##################################################################
+#
+# export:
+#
+# Writes rows to path ("-" for standard output) in the given format
+# (by default the one implied by the extension). A file is written
+# under a temporary name and renamed into place once complete, so a
+# failed export never leaves a truncated file behind.
+#
+# Returns: the number of rows written. Raises on I/O errors, and on
+#          errors reading the rows (after removing the partial file).
+#
+def export(path, fields, rows, fmt=None):
+  fmt = fmt or format_for(path)
+  if path == "-":
+    return write_rows(sys.stdout, fields, rows, fmt)
+
+  partial = path + ".part"
+  try:
+    with open(partial, "w", newline="", encoding="utf-8") as out:
+      count = write_rows(out, fields, rows, fmt)
+    os.replace(partial, path)
+  except BaseException:
+    if os.path.exists(partial):
+      os.remove(partial)
+    raise
+  return count
+
+
+#
+# the sources below each return (fields, rows), where rows is an
+# iterator that reads from dbConn as it is consumed; errors reading
+# it are output as for the objecttier functions and raised
+#
+
+def search_rows(dbConn, pattern):
+  return objecttier.Lobbyist._fields, objecttier.iter_lobbyists(dbConn, pattern, BATCH_ROWS)
+
+
+##################################################################
+#
+# details_rows:
+#
+# The details of each of the given lobbyists (IDs that match no
+# lobbyist are skipped), or of every lobbyist matching pattern,
+# looked up BATCH_ROWS lobbyists per statement.
+#
+def details_rows(dbConn, lobbyist_ids=None, pattern=None):
+  if lobbyist_ids is None:
+    lobbyist_ids = (lobbyist.Lobbyist_ID for lobbyist in objecttier.iter_lobbyists(dbConn, pattern, BATCH_ROWS))
+  return objecttier.LobbyistDetails._fields, objecttier.iter_lobbyist_details_many(dbConn, lobbyist_ids, BATCH_ROWS)
+
+
+def top_rows(dbConn, N, year):
+  return objecttier.LobbyistClients._fields, objecttier.iter_top_N_lobbyists(dbConn, N, year, BATCH_ROWS)
+
+
+##################################################################
+#
+# table_rows:
+#
+# Every row of one of EXPORT_TABLES, with its stored columns (not
+# the generated ones).
+#
+def table_rows(dbConn, table):
+  if table not in EXPORT_TABLES:
+    raise ValueError("%s can't be exported (choose from %s)" % (table, ", ".join(EXPORT_TABLES)))
+
+  fields = tuple(row[1] for row in dbConn.execute("PRAGMA table_info(%s)" % table))
+  sql = "SELECT %s FROM %s ORDER BY rowid" % (", ".join(fields), table)
+  return fields, datatier.select_iter(dbConn, sql, None, BATCH_ROWS)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Export lobbyist query results to CSV or JSON Lines.")
+  parser.add_argument("--db", default="Chicago_Lobbyists.db", help="database to read")
+  parser.add_argument("--format", choices=FORMATS, default=None, help="output format (default: from the extension)")
+  parser.add_argument("output", help="file to write, or - for standard output")
+  sources = parser.add_subparsers(dest="source", required=True)
+  search = sources.add_parser("search", help="lobbyists matching a name pattern")
+  search.add_argument("pattern")
+  details = sources.add_parser("details", help="details of the given lobbyists")
+  details.add_argument("ids", nargs="*", type=int, help="lobbyist IDs")
+  details.add_argument("--pattern", help="every lobbyist matching this name pattern instead")
+  top = sources.add_parser("top", help="the top N lobbyists of a year")
+  top.add_argument("N", type=int)
+  top.add_argument("year")
+  table = sources.add_parser("table", help="a whole table")
+  table.add_argument("table", choices=EXPORT_TABLES)
+  args = parser.parse_args()
+
+  if args.source == "details" and not args.ids and args.pattern is None:
+    parser.error("details needs lobbyist IDs or --pattern")
+
+  dbConn = sqlite3.connect(args.db)
+  try:
+    schema.upgrade(dbConn)
+    if args.source == "search":
+      fields, rows = search_rows(dbConn, args.pattern)
+    elif args.source == "details":
+      fields, rows = details_rows(dbConn, args.ids or None, args.pattern)
+    elif args.source == "top":
+      fields, rows = top_rows(dbConn, args.N, args.year)
+    else:
+      fields, rows = table_rows(dbConn, args.table)
+
+    start = time.perf_counter()
+    try:
+      count = export(args.output, fields, rows, args.format)
+    except sqlite3.Error as err:
+      raise SystemExit("%s: export failed: %s" % (args.output, err))
+    elapsed = time.perf_counter() - start
+  finally:
+    dbConn.close()
+
+  if args.output != "-":
+    print("%s: %s rows in %.2f s" % (args.output, "{:,}".format(count), elapsed))
+
+
+if __name__ == '__main__':
+  main()
@@ -8,13 +8,201 @@ modal dialogs so the existing objecttier functions can be reused.
 
 Run this file to open the GUI.
 """
-import sqlite3
+import os
+import queue
 import sys
+import threading
+import time
 import tkinter as tk
 from tkinter import scrolledtext, simpledialog, messagebox, filedialog
 from tkinter import ttk
 import tkinter.font as tkfont
+import datatier
+import export
 import objecttier
+import schema
+
+# search results are shown this many lobbyists at a time
+SEARCH_PAGE_SIZE = 1000
+# matches are counted up to this many; beyond it the GUI shows "N+"
+SEARCH_COUNT_LIMIT = 10000
+# how often the Tk thread checks on the query worker
+POLL_INTERVAL_MS = 50
+# the output log keeps at most this many lines
+MAX_LOG_LINES = 5000
+# rows of the results table on screen at once
+RESULT_TABLE_ROWS = 12
+# (heading, width) of the results table columns for each command
+SEARCH_COLUMNS = [('ID', 80), ('First Name', 160), ('Last Name', 200), ('Phone', 160)]
+TOP_N_COLUMNS = [('Rank', 50), ('Name', 200), ('Phone', 130), ('Total Compensation', 150), ('Clients', 500)]
+YEAR_STATS_COLUMNS = [('Year', 80), ('Registered Lobbyists', 180), ('Total Compensation', 200)]
+
+
+class ResultTable(ttk.Frame):
+    """A ttk.Treeview that only materializes the rows in view.
+
+    show() keeps a reference to the full row list; the Treeview holds
+    just the RESULT_TABLE_ROWS rows at the current offset, and the
+    scrollbar and mouse wheel move that window. Showing or scrolling a
+    result costs the same whether it has ten rows or a million.
+    """
+
+    def __init__(self, parent, height=RESULT_TABLE_ROWS):
+        super().__init__(parent)
+        self.height = height
+        self.rows = []
+        self.offset = 0
+        self.tree = ttk.Treeview(self, show='headings', height=height, selectmode='browse')
+        self.scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scroll)
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.scroll.grid(row=0, column=1, sticky='ns')
+        self.grid_columnconfigure(0, weight=1)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self._on_wheel)
+        self.tree.bind('<Prior>', lambda e: self._scroll_to(self.offset - self.height))
+        self.tree.bind('<Next>', lambda e: self._scroll_to(self.offset + self.height))
+
+    # columns is a list of (heading, width) pairs; rows a list of
+    # tuples with one value per column
+    def show(self, columns, rows):
+        ids = [f'c{i}' for i in range(len(columns))]
+        self.tree.configure(columns=ids)
+        for column_id, (heading, width) in zip(ids, columns):
+            self.tree.heading(column_id, text=heading, anchor='w')
+            self.tree.column(column_id, width=width, stretch=True, anchor='w')
+        self.rows = rows
+        self.offset = 0
+        self._render()
+
+    def clear(self):
+        self.show([], [])
+
+    def _render(self):
+        self.tree.delete(*self.tree.get_children())
+        for row in self.rows[self.offset:self.offset + self.height]:
+            self.tree.insert('', tk.END, values=row)
+        if self.rows:
+            first = self.offset / len(self.rows)
+            last = min(self.offset + self.height, len(self.rows)) / len(self.rows)
+            self.scroll.set(first, last)
+        else:
+            self.scroll.set(0, 1)
+
+    def _scroll_to(self, offset):
+        offset = max(0, min(offset, len(self.rows) - self.height))
+        if offset != self.offset:
+            self.offset = offset
+            self._render()
+
+    def _on_scroll(self, action, amount, unit=None):
+        if action == tk.MOVETO:
+            self._scroll_to(int(float(amount) * len(self.rows)))
+        elif unit == tk.PAGES:
+            self._scroll_to(self.offset + int(amount) * self.height)
+        else:
+            self._scroll_to(self.offset + int(amount))
+
+    def _on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self._scroll_to(self.offset - 3)
+        else:
+            self._scroll_to(self.offset + 3)
+        return 'break'
+
+
+class QueryRunner:
+    """Runs database work on a single background thread.
+
+    Each job is a function taking the worker thread's own connection
+    (from the ConnectionManager), so SQL never runs on the Tk event
+    thread. Finished jobs are queued and handed back by deliver(),
+    which the GUI calls from root.after(). cancel() interrupts the
+    statement the worker is running via Connection.interrupt(). A job
+    counts as cancelled only if cancel() was called before it
+    returned; jobs submitted with cancellable=False (writes, whose
+    outcome must be reported as it was) can't be cancelled at all.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.description = None
+        self._started = 0.0
+        self._finished = 0.0
+        self._cancelled = False
+        self._cancellable = False
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._dbConn = None
+        self._thread = threading.Thread(target=self._work, name='query-worker', daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self):
+        return self.description is not None
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def cancellable(self):
+        return self.busy and self._cancellable
+
+    @property
+    def elapsed(self):
+        end = time.perf_counter() if self.busy else self._finished
+        return end - self._started
+
+    def submit(self, description, fn, done, cancellable=True):
+        self.description = description
+        self._cancelled = False
+        self._cancellable = cancellable
+        self._started = time.perf_counter()
+        self._jobs.put((fn, done))
+
+    def cancel(self):
+        if not self.cancellable or self._cancelled:
+            return False
+        self._cancelled = True
+        if self._dbConn is not None:
+            self._dbConn.interrupt()
+        return True
+
+    # Calls done(result, error, cancelled) for each finished job; must
+    # be called on the Tk thread
+    def deliver(self):
+        while True:
+            try:
+                done, result, error, cancelled = self._results.get_nowait()
+            except queue.Empty:
+                return
+            self._finished = time.perf_counter()
+            self.description = None
+            done(result, error, cancelled)
+
+    def stop(self):
+        self._jobs.put(None)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            fn, done = job
+            result, error = None, None
+            try:
+                if self._dbConn is None:
+                    self._dbConn = self.db.connection()
+                    # aborts every later statement of a cancelled job,
+                    # not just the one interrupt() caught
+                    self._dbConn.set_progress_handler(lambda: self._cancelled, 1000)
+                result = fn(self._dbConn)
+            except Exception as e:
+                error = e
+            # whether the job was cancelled is settled here, as it
+            # returns: a cancel() that comes later is too late to have
+            # stopped it, and its result is delivered as usual
+            self._results.put((done, result, error, self._cancelled))
 
 
 class GuiApp:
@@ -41,10 +229,34 @@ class GuiApp:
         content = ttk.Frame(root, padding=(6, 0, 6, 6))
         content.grid(row=1, column=0, sticky='nsew')
 
-        # Output area (replaces printed output)
-        self.output = scrolledtext.ScrolledText(content, wrap=tk.WORD, width=100, height=28, font=self.mono_font)
-        self.output.grid(row=0, column=0, columnspan=4, padx=0, pady=(0, 6), sticky="nsew")
+        # Results table for tabular output (search hits, top N)
+        self.results = ResultTable(content)
+        self.results.grid(row=0, column=0, columnspan=4, pady=(0, 6), sticky='nsew')
+
+        # Pager for search results (enabled while a search is shown)
+        pager = ttk.Frame(content)
+        pager.grid(row=1, column=0, columnspan=4, pady=(0, 6), sticky='ew')
+        self.btn_prev = ttk.Button(pager, text='< Previous', command=self.prev_page, state=tk.DISABLED)
+        self.btn_next = ttk.Button(pager, text='Next >', command=self.next_page, state=tk.DISABLED)
+        self.page_label = ttk.Label(pager, text='')
+        self.btn_prev.grid(row=0, column=0, padx=(0, 4))
+        self.btn_next.grid(row=0, column=1, padx=4)
+        self.page_label.grid(row=0, column=2, padx=4, sticky='w')
+
+        # Output area (replaces printed output). gui_print() buffers
+        # text and _flush_output() writes it once per event-loop tick
+        self.output = scrolledtext.ScrolledText(content, wrap=tk.WORD, width=100, height=16, font=self.mono_font)
+        self.output.grid(row=2, column=0, columnspan=4, padx=0, pady=(0, 6), sticky="nsew")
         self.output.configure(state=tk.DISABLED)
+        self._output_buffer = []
+        self._flush_id = None
+
+        # Current search: pattern, match count, and the after_id of
+        # every page shown so far (so Previous can step back)
+        self.search_pattern = None
+        self.search_count = 0
+        self.search_page_starts = []
+        self.search_next_after = None
 
         # Small writer to capture prints from other modules and send them to GUI
         class _GuiWriter:
@@ -65,18 +277,22 @@ class GuiApp:
         btn_cmd3 = ttk.Button(toolbar, text="3: Top N Lobbyists", command=self.command3)
         btn_cmd4 = ttk.Button(toolbar, text="4: Register Year", command=self.command4)
         btn_cmd5 = ttk.Button(toolbar, text="5: Set Salutation", command=self.command5)
+        self.btn_cancel = ttk.Button(toolbar, text="Cancel", command=self.cancel_query, state=tk.DISABLED)
         btn_clear = ttk.Button(toolbar, text="Clear Output", command=self.clear_output)
         btn_save = ttk.Button(toolbar, text="Save Output", command=self.save_output)
+        btn_export = ttk.Menubutton(toolbar, text="Export")
+        btn_export.configure(menu=self.export_menu(btn_export))
         btn_exit = ttk.Button(toolbar, text="Exit", command=self.on_exit)
 
         # Arrange toolbar buttons
-        for i, w in enumerate((btn_general, btn_cmd1, btn_cmd2, btn_cmd3, btn_cmd4, btn_cmd5, btn_clear, btn_save, btn_exit)):
+        for i, w in enumerate((btn_general, btn_cmd1, btn_cmd2, btn_cmd3, btn_cmd4, btn_cmd5, self.btn_cancel, btn_clear, btn_save, btn_export, btn_exit)):
             w.grid(row=0, column=i, padx=4)
 
         # Make grid expand
         root.grid_rowconfigure(1, weight=1)
         root.grid_columnconfigure(0, weight=1)
         content.grid_rowconfigure(0, weight=1)
+        content.grid_rowconfigure(2, weight=2)
         content.grid_columnconfigure(0, weight=1)
 
         # Status bar
@@ -87,6 +303,7 @@ class GuiApp:
         menubar = tk.Menu(root)
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label='Save Output', accelerator='Ctrl+S', command=self.save_output)
+        file_menu.add_cascade(label='Export', menu=self.export_menu(file_menu))
         file_menu.add_separator()
         file_menu.add_command(label='Exit', accelerator='Ctrl+Q', command=self.on_exit)
         menubar.add_cascade(label='File', menu=file_menu)
@@ -100,12 +317,21 @@ class GuiApp:
         root.bind_all('<Control-q>', lambda e: self.on_exit())
 
         # DB connection
+        self.db = datatier.ConnectionManager('Chicago_Lobbyists.db')
         try:
-            self.dbConn = sqlite3.connect('Chicago_Lobbyists.db')
+            self.dbConn = self.db.connection()
+            schema.upgrade(self.dbConn)
         except Exception as e:
             messagebox.showerror("DB Error", f"Unable to open database: {e}")
             root.quit()
 
+        # Background worker for all queries; _poll() collects its results
+        # (and output written from other threads) on the Tk thread
+        self.runner = QueryRunner(self.db)
+        self._main_thread = threading.current_thread()
+        self._pending_output = queue.Queue()
+        self._poll_id = self.root.after(POLL_INTERVAL_MS, self._poll)
+
         # Welcome message
         # Redirect global stdout/stderr to GUI so existing print() calls show up
         # in the GUI output area without changing other modules.
@@ -121,18 +347,39 @@ class GuiApp:
         # Restore stdout/stderr on close
         self.root.protocol('WM_DELETE_WINDOW', self.on_exit)
 
-    # utility to append text to GUI output
+    # utility to append text to GUI output; calls from other threads
+    # (e.g. errors logged by datatier on the query worker) are queued
+    # and written by _poll() on the Tk thread
     def gui_print(self, *args, sep=' ', end='\n'):
-        text = sep.join(map(str, args)) + end
+        if threading.current_thread() is not self._main_thread:
+            self._pending_output.put((args, sep, end))
+            return
+        self._output_buffer.append(sep.join(map(str, args)) + end)
+        if self._flush_id is None:
+            self._flush_id = self.root.after_idle(self._flush_output)
+
+    # writes everything gui_print() buffered since the last flush in
+    # one insert, then trims the log to MAX_LOG_LINES
+    def _flush_output(self):
+        self._flush_id = None
+        if not self._output_buffer:
+            return
+        text = ''.join(self._output_buffer)
+        self._output_buffer.clear()
         self.output.configure(state=tk.NORMAL)
         self.output.insert(tk.END, text)
+        lines = int(self.output.index('end-1c').split('.')[0])
+        if lines > MAX_LOG_LINES:
+            self.output.delete('1.0', f'{lines - MAX_LOG_LINES + 1}.0')
         self.output.see(tk.END)
         self.output.configure(state=tk.DISABLED)
 
     def clear_output(self):
+        self._output_buffer.clear()
         self.output.configure(state=tk.NORMAL)
         self.output.delete('1.0', tk.END)
         self.output.configure(state=tk.DISABLED)
+        self.results.clear()
         self.set_status('Output cleared')
 
     def save_output(self):
@@ -141,6 +388,7 @@ class GuiApp:
             path = filedialog.asksaveasfilename(defaultextension='.txt', initialfile=initial, filetypes=[('Text', '*.txt'), ('All files', '*.*')])
             if not path:
                 return
+            self._flush_output()
             text = self.output.get('1.0', tk.END)
             with open(path, 'w', encoding='utf-8') as f:
                 f.write(text)
@@ -149,6 +397,86 @@ class GuiApp:
             messagebox.showerror('Save Error', f'Unable to save file: {e}')
             self.set_status('Save failed')
 
+    # the Export menu (the toolbar and the File menu each get a copy)
+    def export_menu(self, parent):
+        menu = tk.Menu(parent, tearoff=0)
+        menu.add_command(label='Search Results...', command=self.export_search)
+        menu.add_command(label='Lobbyist Details...', command=self.export_details)
+        menu.add_command(label='Top N Lobbyists...', command=self.export_top_n)
+        menu.add_command(label='Full Table...', command=self.export_table)
+        return menu
+
+    def ask_export_path(self, initial):
+        return filedialog.asksaveasfilename(defaultextension='.csv', initialfile=initial,
+                                            filetypes=[('CSV', '*.csv'), ('JSON Lines', '*.jsonl'), ('All files', '*.*')])
+
+    # Streams source(dbConn)'s rows to path on the query worker; the
+    # rows go straight from the cursor to the file, not through the
+    # output log or the results table. A failed or cancelled export
+    # leaves no file behind.
+    def run_export(self, description, path, source):
+        def query(dbConn):
+            fields, rows = source(dbConn)
+            count = export.export(path, fields, rows)
+            if self.runner.cancelled:
+                os.remove(path)
+            return count
+
+        def show(count):
+            self.gui_print('')
+            self.gui_print('Exported {:,} rows to {}'.format(count, path))
+
+        self.run_query(description, query, show, f'Error during {description.lower()}; {path} was not written')
+
+    def export_search(self):
+        pattern = self.gui_input('Export the lobbyists matching (first or last name, wildcards _ and % supported):')
+        if pattern is None:
+            return
+        path = self.ask_export_path('lobbyists.csv')
+        if not path:
+            return
+        self.run_export('Export Search', path, lambda dbConn: export.search_rows(dbConn, pattern))
+
+    def export_details(self):
+        pattern = self.gui_input('Export the details of the lobbyists matching (first or last name, wildcards _ and % supported):')
+        if pattern is None:
+            return
+        path = self.ask_export_path('lobbyist_details.csv')
+        if not path:
+            return
+        self.run_export('Export Details', path, lambda dbConn: export.details_rows(dbConn, pattern=pattern))
+
+    def export_top_n(self):
+        n = self.gui_input('Enter the value of N:')
+        if n is None:
+            return
+        try:
+            if int(n) <= 0:
+                self.gui_print('Please enter a positive value for N...')
+                return
+        except Exception:
+            self.gui_print('Please enter a valid integer for N...')
+            return
+        year = self.gui_input('Enter the year:')
+        if year is None:
+            return
+        path = self.ask_export_path(f'top_{n}_{year}.csv')
+        if not path:
+            return
+        self.run_export('Export Top N', path, lambda dbConn: export.top_rows(dbConn, int(n), year))
+
+    def export_table(self):
+        table = self.gui_input('Enter the table to export ({}):'.format(', '.join(export.EXPORT_TABLES)))
+        if table is None:
+            return
+        if table not in export.EXPORT_TABLES:
+            self.gui_print('Please enter one of: ' + ', '.join(export.EXPORT_TABLES))
+            return
+        path = self.ask_export_path(f'{table}.csv')
+        if not path:
+            return
+        self.run_export('Export Table', path, lambda dbConn: export.table_rows(dbConn, table))
+
     def set_status(self, msg):
         try:
             self.status.config(text=msg)
@@ -159,45 +487,142 @@ class GuiApp:
     def gui_input(self, prompt, title="Input"):
         return simpledialog.askstring(title, prompt, parent=self.root)
 
+    # Runs fn(dbConn) on the query worker and hands its result to
+    # on_done(result) back on the Tk thread. Returns False (and does
+    # nothing) if another query is still running.
+    def run_query(self, description, fn, on_done, on_error=None, cancellable=True):
+        if self.runner.busy:
+            self.set_status('A query is already running; wait for it or press Cancel')
+            return False
+
+        def done(result, error, cancelled):
+            self.btn_cancel.config(state=tk.DISABLED)
+            if cancelled:
+                self.gui_print('Query cancelled.')
+                self.set_status(f'{description} cancelled')
+            elif error is not None:
+                self.gui_print('Error:', error)
+                self.set_status(on_error or f'Error: {description}')
+            else:
+                on_done(result)
+                self.set_status(f'{description} finished in {self.runner.elapsed:.2f} s')
+
+        self.runner.submit(description, fn, done, cancellable)
+        if cancellable:
+            self.btn_cancel.config(state=tk.NORMAL)
+        return True
+
+    def cancel_query(self):
+        if self.runner.cancel():
+            self.set_status('Cancelling...')
+
+    # Polls the worker once per tick: delivers finished queries,
+    # output written from other threads, and the running time
+    def _poll(self):
+        while True:
+            try:
+                args, sep, end = self._pending_output.get_nowait()
+            except queue.Empty:
+                break
+            self.gui_print(*args, sep=sep, end=end)
+        self.runner.deliver()
+        if self.runner.busy:
+            self.set_status(f'Running {self.runner.description}... {self.runner.elapsed:.1f} s')
+        self._poll_id = self.root.after(POLL_INTERVAL_MS, self._poll)
+
     # Command implementations (mirror behavior from main.py)
     def general_stats(self):
-        try:
+        def show(stats):
+            if stats is None:
+                self.gui_print('Error retrieving general stats')
+                return
             self.gui_print('General Statistics:')
-            self.gui_print('  Number of Lobbyists: {:,}'.format(objecttier.num_lobbyists(self.dbConn)))
-            self.gui_print('  Number of Employers: {:,}'.format(objecttier.num_employers(self.dbConn)))
-            self.gui_print('  Number of Clients: {:,}'.format(objecttier.num_clients(self.dbConn)))
+            self.gui_print('  Number of Lobbyists: {:,}'.format(stats.Num_Lobbyists))
+            self.gui_print('  Number of Employers: {:,}'.format(stats.Num_Employers))
+            self.gui_print('  Number of Clients: {:,}'.format(stats.Num_Clients))
+            self.gui_print('  Per-year statistics are shown in the results table.')
             self.gui_print('')
-        except Exception as e:
-            self.gui_print('Error retrieving general stats:', e)
+            self.page_label.config(text='')
+            self.btn_prev.config(state=tk.DISABLED)
+            self.btn_next.config(state=tk.DISABLED)
+            self.results.show(YEAR_STATS_COLUMNS, [
+                (y.Year, '{:,}'.format(y.Num_Lobbyists), '${:,.2f}'.format(y.Total_Compensation))
+                for y in stats.Years])
+
+        self.run_query('General Stats', objecttier.get_stats, show, 'Error retrieving general stats')
 
     def command1(self):
         lob_name = self.gui_input('Enter lobbyist name (first or last, wildcards _ and % supported):')
         if lob_name is None:
             return
-        self.gui_print('')
-        try:
-            lobbyists = objecttier.get_lobbyists(self.dbConn, lob_name)
-            if len(lobbyists) > 100:
-                self.gui_print('Number of Lobbyists found:', len(lobbyists))
-                self.gui_print('')
-                self.gui_print('There are too many lobbyists to display, please narrow your search and try again...')
+
+        def query(dbConn):
+            count = objecttier.count_lobbyists(dbConn, lob_name, limit=SEARCH_COUNT_LIMIT)
+            page = objecttier.get_lobbyists_page(dbConn, lob_name, 0, SEARCH_PAGE_SIZE + 1)
+            return count, page
+
+        def show(result):
+            self.search_pattern = lob_name
+            self.search_count, page = result
+            self.search_page_starts = [0]
+            self.gui_print('')
+            if self.search_count >= SEARCH_COUNT_LIMIT:
+                self.gui_print('Number of Lobbyists found: {:,}+'.format(SEARCH_COUNT_LIMIT))
             else:
-                self.gui_print('Number of Lobbyists found:', len(lobbyists))
-                if len(lobbyists) > 0:
-                    self.gui_print('')
-                    for l in lobbyists:
-                        self.gui_print(l.Lobbyist_ID, ':', l.First_Name, l.Last_Name, 'Phone:', l.Phone)
-        except Exception as e:
-            self.gui_print('Error:', e)
-            self.set_status('Error during search')
+                self.gui_print('Number of Lobbyists found:', self.search_count)
+            self.show_search_page(page)
+
+        self.run_query('Find Lobbyists', query, show, 'Error during search')
+
+    # shows one page of the current search; lobbyists holds the page
+    # plus one extra row, which tells us whether there is a next page
+    def show_search_page(self, lobbyists):
+        has_next = len(lobbyists) > SEARCH_PAGE_SIZE
+        lobbyists = lobbyists[:SEARCH_PAGE_SIZE]
+        self.search_next_after = lobbyists[-1].Lobbyist_ID if has_next else None
+
+        page = len(self.search_page_starts)
+        first = (page - 1) * SEARCH_PAGE_SIZE + 1
+        self.results.show(SEARCH_COLUMNS, [(l.Lobbyist_ID, l.First_Name, l.Last_Name, l.Phone) for l in lobbyists])
+        if len(lobbyists) > 0:
+            self.page_label.config(text='Page {} of search "{}" (lobbyists {:,}-{:,})'.format(
+                page, self.search_pattern, first, first + len(lobbyists) - 1))
+        else:
+            self.page_label.config(text='')
+        self.btn_prev.config(state=tk.NORMAL if page > 1 else tk.DISABLED)
+        self.btn_next.config(state=tk.NORMAL if has_next else tk.DISABLED)
+
+    # fetches and shows the page starting after page_starts[-1]
+    def load_search_page(self, page_starts):
+        pattern = self.search_pattern
+        after_id = page_starts[-1]
+
+        def query(dbConn):
+            return objecttier.get_lobbyists_page(dbConn, pattern, after_id, SEARCH_PAGE_SIZE + 1)
+
+        def show(lobbyists):
+            self.search_page_starts = page_starts
+            self.show_search_page(lobbyists)
+
+        self.run_query('Find Lobbyists', query, show, 'Error during search')
+
+    def next_page(self):
+        if self.search_next_after is None:
+            return
+        self.load_search_page(self.search_page_starts + [self.search_next_after])
+
+    def prev_page(self):
+        if len(self.search_page_starts) < 2:
+            return
+        self.load_search_page(self.search_page_starts[:-1])
 
     def command2(self):
         lob_id = self.gui_input('Enter Lobbyist ID:')
         if lob_id is None:
             return
-        self.gui_print('')
-        try:
-            ld = objecttier.get_lobbyist_details(self.dbConn, lob_id)
+
+        def show(ld):
+            self.gui_print('')
             if ld is None:
                 self.gui_print('No lobbyist with that ID was found.')
             else:
@@ -210,9 +635,9 @@ class GuiApp:
                 self.gui_print(' Years Registered:', ', '.join(map(str, ld.Years_Registered)))
                 self.gui_print(' Employers:', ', '.join(ld.Employers))
                 self.gui_print(' Total Compensation: ${:,.2f}'.format(ld.Total_Compensation))
-        except Exception as e:
-            self.gui_print('Error:', e)
-            self.set_status('Error retrieving details')
+
+        self.run_query('Lobbyist Details', lambda dbConn: objecttier.get_lobbyist_details(dbConn, lob_id),
+                       show, 'Error retrieving details')
 
     def command3(self):
         n = self.gui_input('Enter the value of N:')
@@ -228,22 +653,22 @@ class GuiApp:
         year = self.gui_input('Enter the year:')
         if year is None:
             return
-        try:
-            lobbyists = objecttier.get_top_N_lobbyists(self.dbConn, int(n), year)
+
+        def show(lobbyists):
             if lobbyists == []:
                 return
+            self.page_label.config(text='')
+            self.btn_prev.config(state=tk.DISABLED)
+            self.btn_next.config(state=tk.DISABLED)
+            self.results.show(TOP_N_COLUMNS, [
+                (idx + 1, f"{l.First_Name} {l.Last_Name}", l.Phone,
+                 '${:,.2f}'.format(l.Total_Compensation), ', '.join(l.Clients))
+                for idx, l in enumerate(lobbyists)])
             self.gui_print('')
-            for idx, l in enumerate(lobbyists):
-                self.gui_print(f"{idx + 1} . {l.First_Name} {l.Last_Name}")
-                self.gui_print(' Phone:', l.Phone)
-                self.gui_print(' Total Compensation: ${:,.2f}'.format(l.Total_Compensation))
-                self.gui_print(' Clients:', ', '.join(l.Clients), end='\n')
-                if idx < len(lobbyists) - 1:
-                    self.gui_print('')
-            self.gui_print('')
-        except Exception as e:
-            self.gui_print('Error:', e)
-            self.set_status('Error retrieving top N')
+            self.gui_print(f'Top {len(lobbyists)} lobbyists for {year} are shown in the results table.')
+
+        self.run_query('Top N Lobbyists', lambda dbConn: objecttier.get_top_N_lobbyists(dbConn, int(n), year),
+                       show, 'Error retrieving top N')
 
     def command4(self):
         year = self.gui_input('Enter year:')
@@ -252,16 +677,16 @@ class GuiApp:
         lob_id = self.gui_input('Enter the lobbyist ID:')
         if lob_id is None:
             return
-        try:
-            res = objecttier.add_lobbyist_year(self.dbConn, lob_id, year)
+
+        def show(res):
             self.gui_print('')
             if res > 0:
                 self.gui_print('Lobbyist successfully registered.')
             else:
                 self.gui_print('No lobbyist with that ID was found.')
-        except Exception as e:
-            self.gui_print('Error:', e)
-            self.set_status('Error registering year')
+
+        self.run_query('Register Year', lambda dbConn: objecttier.add_lobbyist_year(dbConn, lob_id, year),
+                       show, 'Error registering year', cancellable=False)
 
     def command5(self):
         lob_id = self.gui_input('Enter the lobbyist ID:')
@@ -270,16 +695,16 @@ class GuiApp:
         sal = self.gui_input('Enter the salutation:')
         if sal is None:
             return
-        self.gui_print('')
-        try:
-            res = objecttier.set_salutation(self.dbConn, lob_id, sal)
+
+        def show(res):
+            self.gui_print('')
             if res > 0:
                 self.gui_print('Salutation successfully set.')
             else:
                 self.gui_print('No lobbyist with that ID was found.')
-        except Exception as e:
-            self.gui_print('Error:', e)
-            self.set_status('Error setting salutation')
+
+        self.run_query('Set Salutation', lambda dbConn: objecttier.set_salutation(dbConn, lob_id, sal),
+                       show, 'Error setting salutation', cancellable=False)
 
     def show_about(self):
         messagebox.showinfo('About', 'Chicago Lobbyist Database GUI\nImproved UI')
@@ -292,8 +717,14 @@ class GuiApp:
         except Exception:
             pass
         try:
-            if hasattr(self, 'dbConn'):
-                self.dbConn.close()
+            self.root.after_cancel(self._poll_id)
+            self.runner.cancel()
+            self.runner.stop()
+        except Exception:
+            pass
+        try:
+            if hasattr(self, 'db'):
+                self.db.close_all()
         except Exception:
             pass
         self.root.quit()
@@ -0,0 +1,488 @@
+#
+# ingest.py
+#
+# Builds a Chicago_Lobbyists.db database from the City of Chicago
+# lobbyist CSV exports (lobbyists, employers, clients, lobbyist /
+# employer links, registration years and compensation filings). The
+# files are streamed row by row straight into executemany(), so
+# memory use does not grow with the size of the exports. The tables
+# are loaded with journaling and syncing off and no indexes or
+# triggers in place; schema.upgrade() then builds the indexes, the
+# rollups and the statistics in one pass over the loaded data.
+#
+# The database is built in a scratch file next to the target and
+# only moved into place once it is complete, so a failed load never
+# leaves a half-built database behind.
+#
+# With --sync, an existing database is brought in line with a new
+# snapshot of the exports instead: each row's content hash is kept
+# next to its table, and only rows that were added, changed or
+# removed since the last sync are written.
+#
+# Usage: python ingest.py [--lobbyists f] [--employers f] [--clients f]
+#                         [--lobbyist-employers f] [--lobbyist-years f]
+#                         [--compensation f] [--replace | --sync] database
+#
+import argparse
+import csv
+import hashlib
+import itertools
+import logging
+import operator
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import objecttier
+import schema
+
+logger = logging.getLogger(__name__)
+
+
+#
+# the exports, in load order: (source name, table)
+#
+SOURCES = [
+  ("lobbyists", "LobbyistInfo"),
+  ("employers", "EmployerInfo"),
+  ("clients", "ClientInfo"),
+  ("lobbyist_employers", "LobbyistAndEmployer"),
+  ("lobbyist_years", "LobbyistYears"),
+  ("compensation", "Compensation"),
+]
+
+#
+# CSV headers are matched to columns ignoring case, spaces and
+# underscores (LOBBYIST_ID, Lobbyist ID and LobbyistID all name
+# Lobbyist_ID); these are the export headers that differ from the
+# column names by more than that
+#
+HEADER_ALIASES = {
+  "STATE": "State_Initial",
+  "ZIP": "ZipCode",
+  "AMOUNT": "Compensation_Amount",
+  "COMPENSATION": "Compensation_Amount",
+}
+
+#
+# applied while loading: the scratch file is thrown away if the load
+# fails, so there is nothing for a journal or fsync to protect
+#
+LOAD_PRAGMAS = {
+  "journal_mode": "OFF",
+  "synchronous": "OFF",
+  "locking_mode": "EXCLUSIVE",
+  "cache_size": -262144,       # 256 MB page cache
+  "temp_store": "MEMORY",
+}
+
+#
+# rows per executemany() call; each call is one step of the load's
+# single transaction
+#
+BATCH_ROWS = 50000
+
+
+def _header_key(name):
+  return re.sub(r"[^0-9A-Z]", "", name.upper())
+
+
+#
+# converters from a CSV field to a column value: text is loaded as
+# is, empty numbers and dates become NULL, amounts lose their "$" and
+# thousands separators, and dates (exported as M/D/YYYY hh:mm:ss AM,
+# with or without zero padding, or as ISO 8601 timestamps) are stored
+# as YYYY-MM-DD, which is what the Start_Year / End_Year columns
+# parse; _date raises ValueError on anything else. Numbers are
+# otherwise left as text for the columns' type affinity to convert,
+# which SQLite does faster than int() / float()
+#
+def _text(value):
+  return value
+
+
+def _number(value):
+  return value or None
+
+
+def _amount(value):
+  return value.replace("$", "").replace(",", "") or None
+
+
+_SLASH_DATE = re.compile(r"(\d\d?)/(\d\d?)/(\d{4})(?!\d)")
+_ISO_DATE = re.compile(r"\d{4}-\d\d-\d\d(?!\d)")
+
+
+def _date(value):
+  match = _SLASH_DATE.match(value)
+  if match is not None:
+    month, day, year = match.groups()
+    if len(month) == 1:
+      month = "0" + month
+    if len(day) == 1:
+      day = "0" + day
+    if "01" <= month <= "12" and "01" <= day <= "31":
+      return year + "-" + month + "-" + day
+  elif _ISO_DATE.match(value) is not None:
+    return value[:10]
+  elif not value:
+    return None
+  raise ValueError("not a date: %r" % value)
+
+
+#
+# wraps a converter that raises ValueError on bad input, such as
+# _date: those values are loaded as NULL instead, and counted in
+# the wrapper's failed list, [count, first such value], so the load
+# can report them
+#
+def _checked(converter):
+  failed = [0, None]
+
+  def convert(value):
+    try:
+      return converter(value)
+    except ValueError:
+      if not failed[0]:
+        failed[1] = value
+      failed[0] += 1
+      return None
+  convert.failed = failed
+  return convert
+
+
+_CONVERTERS = {
+  "Compensation_Amount": _amount,
+  "Period_Start": _date,
+  "Period_End": _date,
+}
+
+
+def _convert(converter, value):
+  return converter(value)
+
+
+##################################################################
+#
+# _insert_statement:
+#
+# Matches a CSV header against a table's columns.
+#
+# Returns: (sql, indexes, converters): an INSERT statement for the
+#          table (or into, a table with the same columns), the CSV
+#          field positions that make up its
+#          parameters, in order, and the converter of each (dates
+#          through a fresh _checked). Columns the file does not have
+#          are loaded as NULL.
+#
+def _insert_statement(table, columns, header, into=None):
+  positions = {}
+  for index, name in enumerate(header):
+    key = _header_key(name)
+    positions.setdefault(_header_key(HEADER_ALIASES.get(key, key)), index)
+
+  indexes = []
+  converters = []
+  values = []
+  for column, declared_type in columns:
+    index = positions.get(_header_key(column))
+    if index is None:
+      values.append("NULL")
+    else:
+      indexes.append(index)
+      converter = _CONVERTERS.get(column, _number if declared_type in ("INTEGER", "REAL") else _text)
+      converters.append(_checked(converter) if converter is _date else converter)
+      values.append("?")
+
+  sql = "INSERT INTO %s (%s) VALUES (%s)" % (into or table, ", ".join(column for column, _ in columns),
+                                             ", ".join(values))
+  return sql, indexes, converters
+
+
+##################################################################
+#
+# load_table:
+#
+# Streams one CSV file into a table of dbConn, BATCH_ROWS rows per
+# executemany() call, inside the caller's transaction. Short lines
+# are padded with empty fields. With into, the rows go to that table
+# instead, which must have (at least) the table's columns. Dates
+# that can't be parsed are loaded as NULL, and a warning gives their
+# number per column.
+#
+# Returns: (rows loaded, seconds taken).
+#
+def load_table(dbConn, table, csv_path, encoding="utf-8-sig", into=None):
+  columns = [(row[1], row[2].upper()) for row in dbConn.execute("PRAGMA table_info(%s)" % table)]
+
+  start = time.perf_counter()
+  loaded = 0
+  with open(csv_path, newline="", encoding=encoding) as csv_file:
+    reader = csv.reader(csv_file)
+    header = next(reader, [])
+    sql, indexes, converters = _insert_statement(table, columns, header, into)
+    if len(indexes) < len(columns):
+      logger.warning("%s: %d of the %s columns missing, loaded as NULL",
+                     csv_path, len(columns) - len(indexes), table)
+    if not indexes:
+      return 0, time.perf_counter() - start
+
+    pick = operator.itemgetter(*indexes)
+    if len(indexes) == 1:
+      pick = lambda line, index=indexes[0]: (line[index],)
+    width = max(indexes) + 1
+    padding = [""] * width
+    rows = (tuple(map(_convert, converters, pick(line if len(line) >= width else line + padding)))
+            for line in reader)
+
+    while True:
+      batch = list(itertools.islice(rows, BATCH_ROWS))
+      if not batch:
+        break
+      dbConn.executemany(sql, batch)
+      loaded += len(batch)
+
+  for index, converter in zip(indexes, converters):
+    failed = getattr(converter, "failed", None)
+    if failed and failed[0]:
+      logger.warning("%s: %d %s values are not dates (e.g. %r), loaded as NULL",
+                     csv_path, failed[0], header[index], failed[1])
+  return loaded, time.perf_counter() - start
+
+
+##################################################################
+#
+# ingest:
+#
+# Builds a new database at path from the given CSV files (a dict
+# mapping source names from SOURCES to file paths; tables with no
+# file are left empty) and upgrades it to the latest schema. An
+# existing database at path is replaced only if replace is True.
+#
+# Returns: a list of (table, rows, seconds) tuples, one per file
+#          loaded, followed by ("indexes", rows, seconds) for
+#          the upgrade step. Raises on I/O and SQL errors, and if the
+#          upgrade fails (in which case path is left untouched).
+#
+def ingest(path, files, replace=False, encoding="utf-8-sig"):
+  if os.path.exists(path) and not replace:
+    raise FileExistsError("%s already exists" % path)
+
+  scratch = path + ".ingest"
+  if os.path.exists(scratch):
+    os.remove(scratch)
+
+  report = []
+  dbConn = sqlite3.connect(scratch, isolation_level=None)
+  try:
+    for name, value in LOAD_PRAGMAS.items():
+      dbConn.execute("PRAGMA %s = %s" % (name, value)).fetchall()
+    dbConn.executescript(schema.BASE_SCHEMA)
+
+    dbConn.execute("BEGIN")
+    for source, table in SOURCES:
+      if files.get(source):
+        loaded, seconds = load_table(dbConn, table, files[source], encoding)
+        report.append((table, loaded, seconds))
+    dbConn.execute("COMMIT")
+
+    start = time.perf_counter()
+    if schema.upgrade(dbConn) != schema.LATEST_VERSION:
+      raise RuntimeError("schema upgrade of %s failed" % scratch)
+    report.append(("indexes", sum(entry[1] for entry in report), time.perf_counter() - start))
+
+    dbConn.execute("PRAGMA journal_mode = DELETE").fetchall()
+    dbConn.close()
+    os.replace(scratch, path)
+  except BaseException:
+    dbConn.close()
+    os.remove(scratch)
+    raise
+
+  return report
+
+
+##################################################################
+#
+# row_hash:
+#
+# 64-bit hash of a row's column values as SQLite hands them back, so
+# a staged row and a stored row with the same content hash alike.
+# Registered as the SQL function row_hash() by sync().
+#
+def row_hash(*values):
+  digest = hashlib.blake2b(repr(values).encode("utf-8"), digest_size=8).digest()
+  return int.from_bytes(digest, "big", signed=True)
+
+
+#
+# hashes the rows of a table that have no row hash yet: every row on
+# the first sync, afterwards only those added or changed since
+#
+def _hash_new_rows(dbConn, table, names):
+  dbConn.execute("""
+      INSERT INTO %s_RowHashes (Row_ID, Row_Hash)
+      SELECT rowid, row_hash(%s) FROM %s
+      WHERE rowid NOT IN (SELECT Row_ID FROM %s_RowHashes)
+  """ % (table, names, table, table))
+
+
+##################################################################
+#
+# sync_table:
+#
+# Brings one table of dbConn in line with a CSV snapshot of it,
+# inside the caller's transaction. The snapshot is staged in a temp
+# table and hashed row by row; rows are then matched against the
+# stored row hashes, by ID for tables with an integer primary key
+# (whose snapshot must have the ID column) and by content for the
+# others. Only rows that were added or changed are written and only
+# rows that disappeared are deleted, so the table's triggers (the
+# rollups, the name index, the statistics) do work in proportion to
+# the change.
+#
+# Returns: (rows added, rows changed, rows deleted, seconds taken);
+#          for tables matched by content a changed row counts as one
+#          deleted and one added.
+#
+def sync_table(dbConn, table, csv_path, encoding="utf-8-sig"):
+  start = time.perf_counter()
+  columns = [(row[1], row[2]) for row in dbConn.execute("PRAGMA table_info(%s)" % table)]
+  keys = [row[1] for row in dbConn.execute("PRAGMA table_info(%s)" % table)
+          if row[5] == 1 and row[2].upper() == "INTEGER"]
+  names = ", ".join(name for name, _ in columns)
+
+  dbConn.execute("DROP TABLE IF EXISTS temp.Staged")
+  dbConn.execute("CREATE TEMP TABLE Staged (%s, Row_Hash INTEGER)" %
+                 ", ".join("%s %s" % column for column in columns))
+  load_table(dbConn, table, csv_path, encoding, into="temp.Staged")
+  dbConn.execute("UPDATE temp.Staged SET Row_Hash = row_hash(%s)" % names)
+  _hash_new_rows(dbConn, table, names)
+
+  if keys:
+    key = keys[0]
+    if dbConn.execute("SELECT 1 FROM temp.Staged WHERE %s IS NULL LIMIT 1" % key).fetchone():
+      raise ValueError("%s: every row needs a %s to be synced" % (csv_path, key))
+    dbConn.execute("CREATE INDEX temp.Staged_Key ON Staged (%s)" % key)
+
+    deleted = dbConn.execute("DELETE FROM %s WHERE %s NOT IN (SELECT %s FROM temp.Staged)"
+                             % (table, key, key)).rowcount
+    incoming = """
+        FROM temp.Staged LEFT JOIN %s_RowHashes AS Stored ON Stored.Row_ID = Staged.%s
+        WHERE Stored.Row_Hash IS NOT Staged.Row_Hash
+    """ % (table, key)
+    added, changed = dbConn.execute("SELECT COUNT(*) - COUNT(Stored.Row_ID), COUNT(Stored.Row_ID) " +
+                                    incoming).fetchone()
+    dbConn.execute("INSERT INTO %s (%s) SELECT %s %s ON CONFLICT (%s) DO UPDATE SET %s" %
+                   (table, names, ", ".join("Staged." + name for name, _ in columns), incoming, key,
+                    ", ".join("%s = excluded.%s" % (name, name) for name, _ in columns if name != key)))
+  else:
+    # a content hash that appears n times in the snapshot keeps n
+    # copies of its row: extra copies are deleted, missing ones added
+    dbConn.execute("CREATE INDEX temp.Staged_Hash ON Staged (Row_Hash)")
+    deleted = dbConn.execute("""
+        DELETE FROM %s WHERE rowid IN (
+            SELECT Row_ID FROM (
+                SELECT Row_ID, Row_Hash, ROW_NUMBER() OVER (PARTITION BY Row_Hash ORDER BY Row_ID) AS Copy
+                FROM %s_RowHashes) AS Stored
+            WHERE Copy > (SELECT COUNT(*) FROM temp.Staged WHERE Staged.Row_Hash = Stored.Row_Hash))
+    """ % (table, table)).rowcount
+    added = dbConn.execute("""
+        INSERT INTO %s (%s)
+        SELECT %s FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY Row_Hash) AS Copy
+            FROM temp.Staged) AS Incoming
+        WHERE Copy > (SELECT COUNT(*) FROM %s_RowHashes AS Stored WHERE Stored.Row_Hash = Incoming.Row_Hash)
+    """ % (table, names, names, table)).rowcount
+    changed = 0
+
+  _hash_new_rows(dbConn, table, names)
+  dbConn.execute("DROP TABLE temp.Staged")
+  return added, changed, deleted, time.perf_counter() - start
+
+
+##################################################################
+#
+# sync:
+#
+# Brings an existing database in line with a new snapshot of the
+# exports (a dict mapping source names from SOURCES to file paths;
+# tables with no file are left as they are), in one transaction:
+# either every table is synced or, on an error, none is. The
+# database is upgraded to the latest schema first.
+#
+# Returns: a list of (table, added, changed, deleted, seconds)
+#          tuples, one per file synced. Raises on I/O and SQL errors
+#          (after rolling back).
+#
+def sync(path, files, encoding="utf-8-sig"):
+  if not os.path.exists(path):
+    raise FileNotFoundError("%s does not exist" % path)
+
+  report = []
+  dbConn = sqlite3.connect(path, isolation_level=None)
+  try:
+    if schema.upgrade(dbConn) != schema.LATEST_VERSION:
+      raise RuntimeError("schema upgrade of %s failed" % path)
+    dbConn.create_function("row_hash", -1, row_hash, deterministic=True)
+    dbConn.execute("PRAGMA temp_store = MEMORY")
+
+    dbConn.execute("BEGIN")
+    try:
+      for source, table in SOURCES:
+        if files.get(source):
+          report.append((table,) + sync_table(dbConn, table, files[source], encoding))
+      dbConn.execute("COMMIT")
+    except BaseException:
+      dbConn.execute("ROLLBACK")
+      raise
+  finally:
+    dbConn.close()
+
+  objecttier.cache.clear()
+  return report
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Build or sync a lobbyist database from the City of Chicago CSV exports.")
+  parser.add_argument("db", help="database file to create (or to sync, with --sync)")
+  for source, table in SOURCES:
+    parser.add_argument("--" + source.replace("_", "-"), metavar="CSV", help="CSV export for %s" % table)
+  mode = parser.add_mutually_exclusive_group()
+  mode.add_argument("--replace", action="store_true", help="replace the database if it exists")
+  mode.add_argument("--sync", action="store_true", help="apply only the differences to an existing database")
+  parser.add_argument("--encoding", default="utf-8-sig", help="encoding of the CSV files")
+  args = parser.parse_args()
+
+  files = {source: getattr(args, source) for source, _ in SOURCES}
+  if not any(files.values()):
+    parser.error("no CSV files given")
+  if args.sync and not os.path.exists(args.db):
+    parser.error("%s does not exist" % args.db)
+  if os.path.exists(args.db) and not (args.replace or args.sync):
+    parser.error("%s already exists (use --replace or --sync)" % args.db)
+
+  logging.basicConfig(format="%(levelname)s: %(message)s")
+  start = time.perf_counter()
+  try:
+    report = sync(args.db, files, args.encoding) if args.sync else ingest(args.db, files, args.replace, args.encoding)
+  except Exception as err:
+    print("%s: %s failed: %s" % (args.db, "sync" if args.sync else "ingest", err), file=sys.stderr)
+    sys.exit(1)
+
+  if args.sync:
+    for table, added, changed, deleted, seconds in report:
+      print("  %-20s %10s added %10s changed %10s deleted %8.2f s" %
+            (table, "{:,}".format(added), "{:,}".format(changed), "{:,}".format(deleted), seconds))
+    print("%s: synced in %.1f s" % (args.db, time.perf_counter() - start))
+  else:
+    for table, rows, seconds in report:
+      print("  %-20s %12s rows %10.2f s %12s rows/s" %
+            (table, "{:,}".format(rows), seconds, "{:,.0f}".format(rows / seconds if seconds else 0.0)))
+    print("%s: built in %.1f s" % (args.db, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+  main()
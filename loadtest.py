@@ -0,0 +1,172 @@
+#
+# loadtest.py
+#
+# Load-tests a running server.py: a number of client threads, each
+# with its own keep-alive connection, send a mix of requests (details
+# lookups, name searches, Top-N, General Stats and optionally writes)
+# for a fixed time, and the run is summed up as requests per second
+# and p50 / p95 / p99 / max latency, overall and per kind of request.
+# Latency is measured from sending the request to reading the last
+# byte of the response. Writes register lobbyists for --write-year,
+# so point it at a copy of the database if you use --writes.
+#
+# Usage: python loadtest.py [--url u] [--clients n] [--seconds s]
+#                           [--writes fraction] [--seed n]
+#
+import argparse
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.parse
+
+
+#
+# relative weights of the read requests in the mix
+#
+READ_MIX = [("details", 60), ("search", 20), ("top", 15), ("stats", 5)]
+
+
+##################################################################
+#
+# percentiles:
+#
+# Returns: (p50, p95, p99, max) of a non-empty list of latencies.
+#
+def percentiles(latencies):
+  if len(latencies) < 2:
+    return (latencies[0],) * 4
+  cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+  return statistics.median(latencies), cuts[94], cuts[98], max(latencies)
+
+
+class _Client:
+  def __init__(self, url):
+    parts = urllib.parse.urlsplit(url)
+    self._conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+
+  def request(self, method, path, body=None):
+    headers = {}
+    if body is not None:
+      body = json.dumps(body).encode("utf-8")
+      headers["Content-Type"] = "application/json"
+    try:
+      self._conn.request(method, path, body, headers)
+      response = self._conn.getresponse()
+      data = response.read()
+    except (http.client.HTTPException, OSError):
+      self._conn.close()  # reconnects on the next request
+      raise
+    return response.status, data
+
+  def close(self):
+    self._conn.close()
+
+
+def _setup(url):
+  client = _Client(url)
+  try:
+    status, data = client.request("GET", "/stats")
+    if status != 200:
+      raise SystemExit("GET /stats failed (%d): %s" % (status, data.decode("utf-8", "replace")))
+    years = [year["Year"] for year in json.loads(data)["Years"]]
+
+    status, data = client.request("GET", "/lobbyists?format=jsonl")
+    lobbyists = [json.loads(line) for line in data.splitlines()]
+  finally:
+    client.close()
+  if not years or not lobbyists:
+    raise SystemExit("the database has no lobbyists to query")
+  return years, lobbyists
+
+
+def _requests(rng, years, lobbyists, writes, write_year):
+  kinds = [kind for kind, _ in READ_MIX]
+  weights = [weight for _, weight in READ_MIX]
+  while True:
+    lobbyist = rng.choice(lobbyists)
+    if rng.random() < writes:
+      yield "write", "POST", "/lobbyists/%d/years" % lobbyist["Lobbyist_ID"], {"year": write_year}
+      continue
+    kind = rng.choices(kinds, weights)[0]
+    if kind == "details":
+      yield kind, "GET", "/lobbyists/%d" % lobbyist["Lobbyist_ID"], None
+    elif kind == "search":
+      pattern = (lobbyist["Last_Name"] or "")[:3] + "%"
+      yield kind, "GET", "/lobbyists?pattern=" + urllib.parse.quote(pattern), None
+    elif kind == "top":
+      yield kind, "GET", "/top?n=10&year=%s" % rng.choice(years), None
+    else:
+      yield kind, "GET", "/stats", None
+
+
+def _run_client(url, seed, deadline, setup, writes, write_year, results):
+  rng = random.Random(seed)
+  client = _Client(url)
+  latencies = {}
+  errors = 0
+  try:
+    for kind, method, path, body in _requests(rng, *setup, writes, write_year):
+      if time.perf_counter() >= deadline:
+        break
+      start = time.perf_counter()
+      try:
+        status, _ = client.request(method, path, body)
+      except (http.client.HTTPException, OSError):
+        status = None
+      elapsed_ms = (time.perf_counter() - start) * 1000.0
+      if status == 200 or (status == 404 and kind == "details"):
+        latencies.setdefault(kind, []).append(elapsed_ms)
+      else:
+        errors += 1
+  finally:
+    client.close()
+  results.append((latencies, errors))
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Load-test a running lobbyist query server.")
+  parser.add_argument("--url", default="http://127.0.0.1:8080", help="server to test")
+  parser.add_argument("--clients", type=int, default=8, help="concurrent client connections")
+  parser.add_argument("--seconds", type=float, default=10.0, help="length of the run")
+  parser.add_argument("--writes", type=float, default=0.0, help="fraction of requests that are writes")
+  parser.add_argument("--write-year", type=int, default=2099, help="year the writes register lobbyists for")
+  parser.add_argument("--seed", type=int, default=1, help="seed of the request mix")
+  args = parser.parse_args()
+
+  setup = _setup(args.url)
+  results = []
+  deadline = time.perf_counter() + args.seconds
+  threads = [threading.Thread(target=_run_client,
+                              args=(args.url, args.seed + i, deadline, setup,
+                                    args.writes, args.write_year, results))
+             for i in range(args.clients)]
+  start = time.perf_counter()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.perf_counter() - start
+
+  by_kind = {}
+  errors = 0
+  for latencies, client_errors in results:
+    errors += client_errors
+    for kind, values in latencies.items():
+      by_kind.setdefault(kind, []).extend(values)
+  every = [value for values in by_kind.values() for value in values]
+  if not every:
+    raise SystemExit("no request succeeded (%d errors)" % errors)
+
+  print("%d clients, %.1f s: %d requests, %d errors, %.0f requests/s" %
+        (args.clients, elapsed, len(every), errors, len(every) / elapsed))
+  rows = sorted(by_kind.items()) + [("all", every)]
+  for kind, values in rows:
+    print("  %-8s %8d   p50 %8.2f ms   p95 %8.2f ms   p99 %8.2f ms   max %8.2f ms" %
+          ((kind, len(values)) + percentiles(values)))
+
+
+if __name__ == '__main__':
+  main()
@@ -2,12 +2,52 @@
 # objecttier
 #
 # Builds Lobbyist-related objects from data retrieved through 
-# the data tier.
+# the data tier. The database must have been brought up to date
+# with schema.upgrade() first.
 #
 
+import collections
+import functools
+import inspect
+import itertools
+import json
+import operator
+import re
+import sqlite3
+import threading
+import time
+import weakref
+
 import datatier
 
 
+##################################################################
+#
+# _Record:
+#
+# Base of the result classes below. Each result is a tuple of its
+# fields, read through named read-only properties, so an instance
+# has no per-instance __dict__ and costs little more than the row it
+# came from. A class can also be used directly as a sqlite3 row
+# factory (cursor.row_factory = Lobbyist.row_factory) when the query
+# selects exactly its fields, in order; the row is then turned into
+# the record without any per-field Python code. Each class lists its
+# field names, in order, in _fields (as a namedtuple does).
+#
+class _Record(tuple):
+  __slots__ = ()
+
+  @classmethod
+  def row_factory(cls, cursor, row):
+    return tuple.__new__(cls, row)
+
+  def __getnewargs__(self):
+    return tuple(self)
+
+  def __repr__(self):
+    return "%s(%s)" % (type(self).__name__, ", ".join(map(repr, self)))
+
+
 ##################################################################
 #
 # Lobbyist:
@@ -19,28 +59,18 @@ import datatier
 #   Last_Name: string
 #   Phone: string
 #
-class Lobbyist:
-  def __init__(self, Lobbyist_ID, First_Name, Last_Name, Phone):
-    self._Lobbyist_ID = Lobbyist_ID
-    self._First_Name = First_Name
-    self._Last_Name = Last_Name
-    self._Phone = Phone
+class Lobbyist(_Record):
+  __slots__ = ()
+  _fields = ("Lobbyist_ID", "First_Name", "Last_Name", "Phone")
 
-  @property
-  def Lobbyist_ID(self):
-      return self._Lobbyist_ID
+  def __new__(cls, Lobbyist_ID, First_Name, Last_Name, Phone):
+    return tuple.__new__(cls, (Lobbyist_ID, First_Name, Last_Name, Phone))
 
-  @property
-  def First_Name(self):
-      return self._First_Name
+  Lobbyist_ID = property(operator.itemgetter(0))
+  First_Name = property(operator.itemgetter(1))
+  Last_Name = property(operator.itemgetter(2))
+  Phone = property(operator.itemgetter(3))
 
-  @property
-  def Last_Name(self):
-      return self._Last_Name
-
-  @property
-  def Phone(self):
-      return self._Phone
 
 ##################################################################
 #
@@ -67,154 +97,395 @@ class Lobbyist:
 #   Employers: list of employer names
 #   Total_Compensation: float
 #
-class LobbyistDetails:
-  def __init__(self, Lobbyist_ID, Salutation, First_Name, Middle_Initial, Last_Name, Suffix, Address_1, Address_2, City, State_Initial, Zip_Code, Country, Email, Phone, Fax, Years_Registered, Employers, Total_Compensation):
-    self._Lobbyist_ID = Lobbyist_ID
-    self._Salutation = Salutation
-    self._First_Name = First_Name
-    self._Middle_Initial = Middle_Initial
-    self._Last_Name = Last_Name
-    self._Suffix = Suffix
-    self._Address_1 = Address_1
-    self._Address_2 = Address_2
-    self._City = City
-    self._State_Initial = State_Initial
-    self._Zip_Code = Zip_Code
-    self._Country = Country
-    self._Email = Email
-    self._Phone = Phone
-    self._Fax = Fax
-    self._Years_Registered = Years_Registered
-    self._Employers = Employers
-    self._Total_Compensation = Total_Compensation
+class LobbyistDetails(_Record):
+  __slots__ = ()
+  _fields = ("Lobbyist_ID", "Salutation", "First_Name", "Middle_Initial", "Last_Name", "Suffix", "Address_1", "Address_2", "City", "State_Initial", "Zip_Code", "Country", "Email", "Phone", "Fax", "Years_Registered", "Employers", "Total_Compensation")
 
-  @property
-  def Lobbyist_ID(self):
-    return self._Lobbyist_ID
+  def __new__(cls, Lobbyist_ID, Salutation, First_Name, Middle_Initial, Last_Name, Suffix, Address_1, Address_2, City, State_Initial, Zip_Code, Country, Email, Phone, Fax, Years_Registered, Employers, Total_Compensation):
+    return tuple.__new__(cls, (Lobbyist_ID, Salutation, First_Name, Middle_Initial, Last_Name, Suffix, Address_1, Address_2, City, State_Initial, Zip_Code, Country, Email, Phone, Fax, Years_Registered, Employers, Total_Compensation))
 
-  @property
-  def Salutation(self):
-    return self._Salutation
+  Lobbyist_ID = property(operator.itemgetter(0))
+  Salutation = property(operator.itemgetter(1))
+  First_Name = property(operator.itemgetter(2))
+  Middle_Initial = property(operator.itemgetter(3))
+  Last_Name = property(operator.itemgetter(4))
+  Suffix = property(operator.itemgetter(5))
+  Address_1 = property(operator.itemgetter(6))
+  Address_2 = property(operator.itemgetter(7))
+  City = property(operator.itemgetter(8))
+  State_Initial = property(operator.itemgetter(9))
+  Zip_Code = property(operator.itemgetter(10))
+  Country = property(operator.itemgetter(11))
+  Email = property(operator.itemgetter(12))
+  Phone = property(operator.itemgetter(13))
+  Fax = property(operator.itemgetter(14))
+  Years_Registered = property(operator.itemgetter(15))
+  Employers = property(operator.itemgetter(16))
+  Total_Compensation = property(operator.itemgetter(17))
 
-  @property
-  def First_Name(self):
-    return self._First_Name
 
-  @property
-  def Middle_Initial(self):
-    return self._Middle_Initial
+##################################################################
+#
+# LobbyistClients:
+#
+# Constructor(...)
+# Properties:
+#   Lobbyist_ID: int
+#   First_Name: string
+#   Last_Name: string
+#   Phone: string
+#   Total_Compensation: float
+#   Clients: list of clients
+#
+class LobbyistClients(_Record):
+  __slots__ = ()
+  _fields = ("Lobbyist_ID", "First_Name", "Last_Name", "Phone", "Total_Compensation", "Clients")
 
-  @property
-  def Last_Name(self):
-    return self._Last_Name
+  def __new__(cls, Lobbyist_ID, First_Name, Last_Name, Phone, Total_Compensation, Clients):
+    return tuple.__new__(cls, (Lobbyist_ID, First_Name, Last_Name, Phone, Total_Compensation, Clients))
 
-  @property
-  def Suffix(self):
-    return self._Suffix
+  Lobbyist_ID = property(operator.itemgetter(0))
+  First_Name = property(operator.itemgetter(1))
+  Last_Name = property(operator.itemgetter(2))
+  Phone = property(operator.itemgetter(3))
+  Total_Compensation = property(operator.itemgetter(4))
+  Clients = property(operator.itemgetter(5))
 
-  @property
-  def Address_1(self):
-    return self._Address_1
 
-  @property
-  def Address_2(self):
-    return self._Address_2
+##################################################################
+#
+# YearStats:
+#
+# Constructor(...)
+# Properties:
+#   Year: int
+#   Num_Lobbyists: int, lobbyists registered that year
+#   Total_Compensation: float, compensation filed for that year
+#
+class YearStats(_Record):
+  __slots__ = ()
+  _fields = ("Year", "Num_Lobbyists", "Total_Compensation")
 
-  @property
-  def City(self):
-    return self._City
+  def __new__(cls, Year, Num_Lobbyists, Total_Compensation):
+    return tuple.__new__(cls, (Year, Num_Lobbyists, Total_Compensation))
 
-  @property
-  def State_Initial(self):
-    return self._State_Initial
+  Year = property(operator.itemgetter(0))
+  Num_Lobbyists = property(operator.itemgetter(1))
+  Total_Compensation = property(operator.itemgetter(2))
 
-  @property
-  def Zip_Code(self):
-    return self._Zip_Code
 
-  @property
-  def Country(self):
-    return self._Country
+##################################################################
+#
+# Stats:
+#
+# Constructor(...)
+# Properties:
+#   Num_Lobbyists: int
+#   Num_Employers: int
+#   Num_Clients: int
+#   Years: list of YearStats objects, in ascending order by year
+#
+class Stats(_Record):
+  __slots__ = ()
+  _fields = ("Num_Lobbyists", "Num_Employers", "Num_Clients", "Years")
 
-  @property
-  def Email(self):
-    return self._Email
+  def __new__(cls, Num_Lobbyists, Num_Employers, Num_Clients, Years):
+    return tuple.__new__(cls, (Num_Lobbyists, Num_Employers, Num_Clients, Years))
 
-  @property
-  def Phone(self):
-    return self._Phone
+  Num_Lobbyists = property(operator.itemgetter(0))
+  Num_Employers = property(operator.itemgetter(1))
+  Num_Clients = property(operator.itemgetter(2))
+  Years = property(operator.itemgetter(3))
 
-  @property
-  def Fax(self):
-    return self._Fax
+
+##################################################################
+#
+# ResultCache:
+#
+# LRU cache of read results with a size limit and a time-to-live,
+# shared by every connection (entries are keyed by database file).
+# The object tier's read functions consult the module-level `cache`
+# instance below; its write functions invalidate exactly the entries
+# they make stale. Writes made outside this module (raw SQL, other
+# processes) are only picked up when entries expire, or after
+# clear(). Cached results are shared between callers, so treat them
+# as read-only.
+#
+# Each database has a generation, which every invalidation of its
+# entries (and every clear()) moves on. A reader takes the generation
+# before it reads and passes it to put(), which drops the result if
+# the generation has moved since: the read may have seen rows that an
+# invalidation running at the same time has just made stale.
+#
+# Constructor(maxsize=256, ttl=300.0)
+#   maxsize: most entries kept; the least recently used go first
+#   ttl: seconds an entry stays valid
+# Properties:
+#   enabled: bool, set to False to bypass the cache everywhere
+#   hits: int
+#   misses: int
+#   size: int, entries currently held
+# Methods:
+#   get(key) -> (found, value)
+#   generation(database) -> the database's current generation
+#   put(key, value, generation=None): stores value unless generation
+#     is given and the generation of key[0] (the database) has moved
+#     on from it
+#   invalidate(predicate, database=None): drops entries whose key
+#     satisfies it, moving database's generation on if given
+#   clear(): drops every entry and resets the counters
+#
+class ResultCache:
+  def __init__(self, maxsize=256, ttl=300.0):
+    self.enabled = True
+    self._maxsize = maxsize
+    self._ttl = ttl
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+    # a generation is _clears plus the database's own count of
+    # invalidations; both only grow, so it changes when either does
+    self._clears = 0
+    self._invalidations = collections.Counter()
 
   @property
-  def Years_Registered(self):
-    return self._Years_Registered
+  def hits(self):
+    return self._hits
 
   @property
-  def Employers(self):
-    return self._Employers
+  def misses(self):
+    return self._misses
 
   @property
-  def Total_Compensation(self):
-    return self._Total_Compensation
+  def size(self):
+    return len(self._entries)
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and entry[0] > time.monotonic():
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return True, entry[1]
+      if entry is not None:
+        del self._entries[key]
+      self._misses += 1
+      return False, None
+
+  def generation(self, database):
+    with self._lock:
+      return self._clears + self._invalidations[database]
+
+  def put(self, key, value, generation=None):
+    with self._lock:
+      if generation is not None and generation != self._clears + self._invalidations[key[0]]:
+        return
+      self._entries[key] = (time.monotonic() + self._ttl, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self._maxsize:
+        self._entries.popitem(last=False)
 
+  def invalidate(self, predicate, database=None):
+    with self._lock:
+      if database is not None:
+        self._invalidations[database] += 1
+      for key in [key for key in self._entries if predicate(key)]:
+        del self._entries[key]
+
+  def clear(self):
+    with self._lock:
+      self._clears += 1
+      self._entries.clear()
+      self._hits = 0
+      self._misses = 0
+
+
+cache = ResultCache()
 
 
 ##################################################################
 #
-# LobbyistClients:
+# _database_key:
 #
-# Constructor(...)
-# Properties:
-#   Lobbyist_ID: int
-#   First_Name: string
-#   Last_Name: string
-#   Phone: string
-#   Total_Compensation: float
-#   Clients: list of clients
+# The key is looked up once per datatier.Connection (as handed out by
+# ConnectionManager) and remembered for as long as the connection
+# lives; other connections are asked for it on every call.
 #
-class LobbyistClients:
-  def __init__(self, Lobbyist_ID, First_Name, Last_Name, Phone, Total_Compensation, Clients):
-    self._Lobbyist_ID = Lobbyist_ID
-    self._First_Name = First_Name
-    self._Last_Name = Last_Name
-    self._Phone = Phone
-    self._Total_Compensation = Total_Compensation
-    self._Clients = Clients
+# Returns: the file the connection is open on, so connections to the
+#          same database share cache entries (in-memory databases are
+#          private to their connection and keyed by it instead).
+#
+_database_keys = weakref.WeakKeyDictionary()
 
-  @property
-  def Lobbyist_ID(self):
-    return self._Lobbyist_ID
 
-  @property
-  def First_Name(self):
-    return self._First_Name
+def _database_key(dbConn):
+  memoize = isinstance(dbConn, datatier.Connection)
+  if memoize:
+    key = _database_keys.get(dbConn)
+    if key is not None:
+      return key
 
-  @property
-  def Last_Name(self):
-    return self._Last_Name
+  try:
+    path = dbConn.execute("PRAGMA database_list").fetchone()[2]
+  except sqlite3.Error:
+    return id(dbConn)
+  key = path if path else id(dbConn)
+  if memoize:
+    _database_keys[dbConn] = key
+  return key
 
-  @property
-  def Phone(self):
-    return self._Phone
 
-  @property
-  def Total_Compensation(self):
-    return self._Total_Compensation
+##################################################################
+#
+# _cache_arg:
+#
+# Normalizes an argument for use in a cache key: IDs and years arrive
+# as ints or as strings of digits (from the GUI), so both forms of
+# the same value must land on the same entry.
+#
+def _cache_arg(value):
+  if isinstance(value, str) and value.strip().isdigit():
+    return int(value)
+  return value
+
+
+##################################################################
+#
+# _cached:
+#
+# Decorator for the cached read functions. The wrapped function gets
+# a use_cache=True keyword argument; pass use_cache=False to go
+# straight to the database. Arguments passed by keyword are put in
+# positional order first, so the key is the same however a call
+# names them. A result is only cached if every statement behind it
+# succeeded (see datatier.failure_count), so a result cut short by an
+# error or by an interrupt is never served again, and if no
+# invalidation of its database ran while it was read (see
+# ResultCache); results that may signal an internal error (None, -1,
+# []) are never cached either.
+#
+def _cached(fn):
+  signature = inspect.signature(fn)
+
+  @functools.wraps(fn)
+  def wrapper(dbConn, *args, use_cache=True, **kwargs):
+    if kwargs:
+      bound = signature.bind(dbConn, *args, **kwargs)
+      bound.apply_defaults()
+      args = bound.args[1:]
+    if not use_cache or not cache.enabled:
+      return fn(dbConn, *args)
+
+    database = _database_key(dbConn)
+    key = (database, fn.__name__, tuple(_cache_arg(arg) for arg in args))
+    found, value = cache.get(key)
+    if found:
+      return value
+
+    generation = cache.generation(database)
+    failures = datatier.failure_count()
+    value = fn(dbConn, *args)
+    if datatier.failure_count() == failures and value is not None and value != -1 and value != []:
+      cache.put(key, value, generation)
+    return value
+  return wrapper
+
+
+def _drop_lobbyists(database, lobbyist_ids, years):
+  def is_stale(key):
+    if key[0] != database:
+      return False
+    if key[1] == "get_lobbyist_details":
+      return key[2][0] in lobbyist_ids
+    if key[1] == "get_top_N_lobbyists":
+      return key[2][1] in years
+    return False
+
+  cache.invalidate(is_stale, database)
+
+
+#
+# the invalidations each connection's uncommitted writes still need
+# once they are committed, keyed by id(dbConn): {database: (lobbyist
+# IDs, years)}. A reused id can at worst cause an extra invalidation.
+#
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+##################################################################
+#
+# _invalidate_lobbyists:
+#
+# Drops the cached details of the given lobbyists and, if years are
+# given, the cached top-N leaderboards of those years (registering a
+# lobbyist for a year can change that year's ranking). Until the
+# write is committed, other connections still read the old rows and
+# can cache them again, so the same entries are dropped once more by
+# commit() (or rollback()).
+#
+def _invalidate_lobbyists(dbConn, lobbyist_ids, years=()):
+  database = _database_key(dbConn)
+  lobbyist_ids = {_cache_arg(lobbyist_id) for lobbyist_id in lobbyist_ids}
+  years = {_cache_arg(year) for year in years}
+
+  _drop_lobbyists(database, lobbyist_ids, years)
+  with _pending_lock:
+    pending_ids, pending_years = _pending.setdefault(id(dbConn), {}).setdefault(database, (set(), set()))
+    pending_ids |= lobbyist_ids
+    pending_years |= years
+
+
+def _apply_pending(dbConn):
+  with _pending_lock:
+    pending = _pending.pop(id(dbConn), {})
+  for database, (lobbyist_ids, years) in pending.items():
+    _drop_lobbyists(database, lobbyist_ids, years)
+
+
+##################################################################
+#
+# commit:
+#
+# Commits dbConn's transaction and then drops again the cached
+# results its writes made stale, which other connections may have
+# cached between the write and the commit. The write functions below
+# don't commit; use this rather than dbConn.commit() when other
+# connections share the cache.
+#
+def commit(dbConn):
+  try:
+    dbConn.commit()
+  finally:
+    _apply_pending(dbConn)
+
+
+##################################################################
+#
+# rollback:
+#
+# Rolls back dbConn's transaction and drops the cached results its
+# writes touched, which may hold the rolled-back rows.
+#
+def rollback(dbConn):
+  try:
+    dbConn.rollback()
+  finally:
+    _apply_pending(dbConn)
 
-  @property
-  def Clients(self):
-    return self._Clients
 
 ##################################################################
 # 
 # num_lobbyists:
 #
+# The result is cached (see ResultCache); pass use_cache=False to
+# read the database directly.
+#
 # Returns: number of lobbyists in the database
 #           If an error occurs, the function returns -1
 #
+@_cached
 def num_lobbyists(dbConn):
   #counts the number of lobbyists in the database
   sql_query = "SELECT COUNT(*) FROM LobbyistInfo"
@@ -260,6 +531,94 @@ def num_clients(dbConn):
     return -1
   return result[0]
 
+##################################################################
+#
+# get_stats:
+#
+# gets the lobbyist, employer and client counts and the per-year
+# statistics in one call. They come from the trigger-maintained
+# TableCounts and YearStats tables, so this takes the same time
+# however large the database is. Years with no registered lobbyists
+# and no compensation are left out, as are filings that span years.
+#
+# Returns: a Stats object, or None if an internal error occurred (in
+#          which case an error msg is already output).
+#
+def get_stats(dbConn):
+  counts_sql = """
+      SELECT (SELECT Row_Count FROM TableCounts WHERE Table_Name = 'LobbyistInfo'),
+             (SELECT Row_Count FROM TableCounts WHERE Table_Name = 'EmployerInfo'),
+             (SELECT Row_Count FROM TableCounts WHERE Table_Name = 'ClientInfo')
+  """
+  counts = datatier.select_one_row(dbConn, counts_sql)
+  if counts is None or counts == ():
+    return None
+
+  years_sql = """
+      SELECT Year, Num_Lobbyists, Total_Compensation
+      FROM YearStats
+      WHERE Year > 0 AND (Num_Lobbyists > 0 OR Total_Compensation > 0.005)
+      ORDER BY Year
+  """
+  years = datatier.select_n_rows(dbConn, years_sql)
+  if years is None:
+    return None
+
+  return Stats(counts[0], counts[1], counts[2],
+               [YearStats(row[0], row[1], round(row[2], 2)) for row in years])
+
+
+##################################################################
+#
+# _uses_name_index:
+#
+# Returns: True if the LIKE pattern can be answered from the trigram
+#          name index, i.e. it contains a run of at least 3 literal
+#          (non-wildcard) characters. Shorter patterns such as 'J_'
+#          or '%a%' give the index nothing to look up.
+#
+def _uses_name_index(pattern):
+  return any(len(run) >= 3 for run in re.split(r"[%_]", pattern))
+
+
+##################################################################
+#
+# _name_filter:
+#
+# Returns: a (condition, parameters) pair selecting the LobbyistInfo
+#          rows whose first or last name is "like" the pattern. Prefix
+#          ('Smi%') and substring ('%mit%') patterns are looked up in
+#          the LobbyistNames trigram index; patterns it cannot express
+#          fall back to LIKE over LobbyistInfo.
+#
+def _name_filter(pattern):
+  if _uses_name_index(pattern):
+    condition = """
+        LobbyistInfo.Lobbyist_ID IN (SELECT rowid FROM LobbyistNames WHERE First_Name LIKE ?
+                                     UNION
+                                     SELECT rowid FROM LobbyistNames WHERE Last_Name LIKE ?)
+    """
+  else:
+    condition = "(LobbyistInfo.First_Name LIKE ? OR LobbyistInfo.Last_Name LIKE ?)"
+  return condition, (pattern, pattern)
+
+
+##################################################################
+#
+# _list_or_empty:
+#
+# Returns: the rows of an iterator built on datatier.select_iter as a
+#          list, or [] if reading them fails part way through (the
+#          error msg is already output), so a list-returning function
+#          never returns a cut-short result.
+#
+def _list_or_empty(rows):
+  try:
+    return list(rows)
+  except Exception:
+    return []
+
+
 ##################################################################
 #
 # get_lobbyists:
@@ -268,49 +627,100 @@ def num_clients(dbConn):
 # the pattern. Patterns are based on SQL, which allow the _ and % 
 # wildcards.
 #
+# The result is cached (see ResultCache); pass use_cache=False to
+# read the database directly.
+#
 # Returns: list of lobbyists in ascending order by ID; 
 #          an empty list means the query did not retrieve
 #          any data (or an internal error occurred, in
 #          which case an error msg is already output).
 #
+@_cached
 def get_lobbyists(dbConn, pattern):
-  #gets all lobbyists whose first or last name are "like" the pattern(first or last name))
-  sql_query = "SELECT Lobbyist_ID, First_Name, Last_Name, Phone FROM LobbyistInfo WHERE First_Name LIKE ? OR Last_Name LIKE ? ORDER BY Lobbyist_ID ASC"
-  parameters = (pattern, pattern)
+  return _list_or_empty(iter_lobbyists(dbConn, pattern))
+
+
+##################################################################
+#
+# iter_lobbyists:
+#
+# generator counterpart of get_lobbyists: yields the matching
+# lobbyists one at a time, built as rows arrive from the cursor
+# (batch_size rows per fetch), so scanning every lobbyist ('%')
+# never holds more than one batch in memory.
+#
+# Yields: lobbyists in ascending order by ID. If an internal error
+#         occurs, an error msg is output and the error is raised
+#         (see datatier.select_iter).
+#
+def iter_lobbyists(dbConn, pattern, batch_size=1000):
+  condition, parameters = _name_filter(pattern)
+  sql_query = "SELECT Lobbyist_ID, First_Name, Last_Name, Phone FROM LobbyistInfo WHERE " + condition + " ORDER BY Lobbyist_ID ASC"
+
+  yield from datatier.select_iter(dbConn, sql_query, parameters, batch_size, Lobbyist.row_factory)
+
+
+##################################################################
+#
+# get_lobbyists_page:
+#
+# gets and returns one page of the lobbyists matching the pattern
+# (same matching rules as get_lobbyists), using the lobbyist ID as
+# the key: the page holds the first page_size matches whose ID is
+# greater than after_id. Pass after_id=0 for the first page and the
+# last ID of a page to get the page after it. Only the rows on the
+# page are read, however many lobbyists match.
+#
+# Returns: list of 0 to page_size lobbyists in ascending order by ID;
+#          an empty list means there are no more matches (or an
+#          internal error occurred, in which case an error msg is
+#          already output).
+#
+def get_lobbyists_page(dbConn, pattern, after_id=0, page_size=50):
+  condition, parameters = _name_filter(pattern)
+  sql_query = "SELECT Lobbyist_ID, First_Name, Last_Name, Phone FROM LobbyistInfo WHERE LobbyistInfo.Lobbyist_ID > ? AND " + condition + " ORDER BY Lobbyist_ID ASC LIMIT ?"
   
-  results = datatier.select_n_rows(dbConn, sql_query, parameters)
+  results = datatier.select_n_rows(dbConn, sql_query, (after_id,) + parameters + (page_size,), Lobbyist.row_factory)
+  if results is None:
+    return []
 
-  #stores results in a list and returns it
-  lobbyists = []
-  for row in results:
-    lobbyist = Lobbyist(row[0], row[1], row[2], row[3])
-    lobbyists.append(lobbyist)
-  return lobbyists
+  return results
 
 
 ##################################################################
 #
-# get_lobbyist_details:
+# count_lobbyists:
 #
-# gets and returns details about the given lobbyist
-# the lobbyist id is passed as a parameter
+# counts the lobbyists matching the pattern (same matching rules as
+# get_lobbyists). If limit is given, counting stops once limit
+# matches have been seen, which bounds the cost of broad patterns;
+# a return value equal to limit then means "limit or more".
 #
-# Returns: if the search was successful, a LobbyistDetails object
-#          is returned. If the search did not find a matching
-#          lobbyist, None is returned; note that None is also 
-#          returned if an internal error occurred (in which
-#          case an error msg is already output).
+# Returns: number of matching lobbyists (at most limit, if given).
+#          If an error occurs, the function returns -1
 #
-def get_lobbyist_details(dbConn, lobbyist_id):
+def count_lobbyists(dbConn, pattern, limit=None):
+  condition, parameters = _name_filter(pattern)
+  if limit is None:
+    sql_query = "SELECT COUNT(*) FROM LobbyistInfo WHERE " + condition
+  else:
+    sql_query = "SELECT COUNT(*) FROM (SELECT 1 FROM LobbyistInfo WHERE " + condition + " LIMIT ?)"
+    parameters = parameters + (limit,)
 
-  #gets all the employers given lobbyist id
-  sql_query_employers = "SELECT DISTINCT EmployerInfo.Employer_Name FROM EmployerInfo LEFT JOIN LobbyistAndEmployer ON EmployerInfo.Employer_ID = LobbyistAndEmployer.Employer_ID JOIN LobbyistInfo ON LobbyistInfo.Lobbyist_ID = LobbyistAndEmployer.Lobbyist_ID WHERE LobbyistInfo.Lobbyist_ID = ? ORDER BY EmployerInfo.Employer_Name ASC"
-  parameters_e = (lobbyist_id,)
-  employer_results = datatier.select_n_rows(dbConn, sql_query_employers, parameters_e)
-  employers = [row[0] for row in employer_results] #puts employers in a list
+  result = datatier.select_one_row(dbConn, sql_query, parameters)
+  if result is None or result == ():
+    return -1
+  return result[0]
 
-  #gets lobbyists details given the lobbyist ids
-  sql_query = """
+
+#
+# the details of the lobbyists selected by a WHERE clause appended
+# to it, in one statement: years and employers come back as JSON
+# arrays built by correlated subqueries, and the total from the
+# compensation rollup, so nothing is joined to anything else and
+# there is no years x filings fan-out
+#
+_DETAILS_QUERY = """
       SELECT LobbyistInfo.Lobbyist_ID,
              LobbyistInfo.Salutation,
              LobbyistInfo.First_Name,
@@ -326,26 +736,113 @@ def get_lobbyist_details(dbConn, lobbyist_id):
              LobbyistInfo.Email,
              LobbyistInfo.Phone,
              LobbyistInfo.Fax,
-             LobbyistYears.Year AS Years_Registered,
-             COALESCE(SUM(Compensation.Compensation_Amount), 0) AS total_compensation
+             (SELECT json_group_array(Year)
+              FROM (SELECT DISTINCT LobbyistYears.Year
+                    FROM LobbyistYears
+                    WHERE LobbyistYears.Lobbyist_ID = LobbyistInfo.Lobbyist_ID
+                    ORDER BY LobbyistYears.Year ASC)) AS Years_Registered,
+             (SELECT json_group_array(Employer_Name)
+              FROM (SELECT DISTINCT EmployerInfo.Employer_Name
+                    FROM LobbyistAndEmployer
+                    JOIN EmployerInfo ON EmployerInfo.Employer_ID = LobbyistAndEmployer.Employer_ID
+                    WHERE LobbyistAndEmployer.Lobbyist_ID = LobbyistInfo.Lobbyist_ID
+                    ORDER BY EmployerInfo.Employer_Name ASC)) AS Employers,
+             (SELECT COALESCE(SUM(LobbyistYearTotals.Total_Compensation), 0)
+              FROM LobbyistYearTotals
+              WHERE LobbyistYearTotals.Lobbyist_ID = LobbyistInfo.Lobbyist_ID) AS total_compensation
       FROM LobbyistInfo
-      LEFT JOIN LobbyistYears ON LobbyistYears.Lobbyist_ID = LobbyistInfo.Lobbyist_ID
-      LEFT JOIN Compensation ON Compensation.Lobbyist_ID = LobbyistInfo.Lobbyist_ID
-      WHERE LobbyistInfo.Lobbyist_ID = ? 
-      GROUP BY LobbyistYears.Year ORDER BY LobbyistYears.Year ASC
+"""
+
+
+def _details_from_row(row):
+  return LobbyistDetails(*row[:15], json.loads(row[15]), json.loads(row[16]), row[17])
+
+
+##################################################################
+#
+# get_lobbyist_details:
+#
+# gets and returns details about the given lobbyist
+# the lobbyist id is passed as a parameter
+#
+# The result is cached (see ResultCache); pass use_cache=False to
+# read the database directly.
+#
+# Returns: if the search was successful, a LobbyistDetails object
+#          is returned. If the search did not find a matching
+#          lobbyist, None is returned; note that None is also 
+#          returned if an internal error occurred (in which
+#          case an error msg is already output).
+#
+@_cached
+def get_lobbyist_details(dbConn, lobbyist_id):
+  sql_query = _DETAILS_QUERY + """
+      WHERE LobbyistInfo.Lobbyist_ID = ?
   """
-  
+
   parameters = (lobbyist_id,)
-  result = datatier.select_n_rows(dbConn, sql_query, parameters)
-  if result == []:
+  result = datatier.select_one_row(dbConn, sql_query, parameters)
+  if result is None or result == ():
     return None
-  else:
-    years = [row[15] for row in result] #stores years in a list
-    lobby_details = LobbyistDetails(result[0][0], result[0][1], result[0][2], result[0][3], result[0][4], result[0][5], result[0][6], result[0][7], result[0][8], result[0][9], result[0][10],result[0][11], result[0][12], result[0][13], result[0][14], years, employers, result[0][16])
-    return lobby_details
-    
 
-         
+  return _details_from_row(result)
+
+
+##################################################################
+#
+# get_lobbyist_details_many:
+#
+# gets the details of many lobbyists at once, as
+# iter_lobbyist_details_many reads them. Bypasses the result cache.
+#
+# Returns: a dict mapping the ID of each lobbyist found to its
+#          LobbyistDetails object, in ascending order by ID within
+#          each chunk; IDs with no lobbyist are left out. If an internal
+#          error occurs, the lobbyists read so far are returned (and an
+#          error msg is already output).
+#
+def get_lobbyist_details_many(dbConn, lobbyist_ids, chunk_size=1000):
+  details = {}
+  try:
+    for lobbyist in iter_lobbyist_details_many(dbConn, lobbyist_ids, chunk_size):
+      details[lobbyist.Lobbyist_ID] = lobbyist
+  except Exception:
+    pass
+
+  return details
+
+
+##################################################################
+#
+# iter_lobbyist_details_many:
+#
+# generator counterpart of get_lobbyist_details_many: the IDs are
+# sent chunk_size at a time as one JSON array parameter, so each
+# chunk is a single statement (the same one get_lobbyist_details
+# runs, over every ID of the chunk) instead of one statement per ID,
+# and the details are yielded as rows arrive from the cursor.
+#
+# Yields: a LobbyistDetails object for each lobbyist found, in
+#         ascending order by ID within each chunk; IDs with no
+#         lobbyist are skipped. If an internal error occurs, an error
+#         msg is output and the error is raised (see
+#         datatier.select_iter).
+#
+def iter_lobbyist_details_many(dbConn, lobbyist_ids, chunk_size=1000):
+  sql_query = _DETAILS_QUERY + """
+      WHERE LobbyistInfo.Lobbyist_ID IN (SELECT value FROM json_each(?))
+      ORDER BY LobbyistInfo.Lobbyist_ID
+  """
+
+  lobbyist_ids = iter(lobbyist_ids)
+  while True:
+    chunk = list(itertools.islice(lobbyist_ids, chunk_size))
+    if not chunk:
+      return
+    for row in datatier.select_iter(dbConn, sql_query, (json.dumps(chunk),), chunk_size):
+      yield _details_from_row(row)
+
+
 
 ##################################################################
 #
@@ -354,75 +851,104 @@ def get_lobbyist_details(dbConn, lobbyist_id):
 # gets and returns the top N lobbyists based on their total 
 # compensation, given a particular year
 #
+# The result is cached (see ResultCache); pass use_cache=False to
+# read the database directly.
+#
 # Returns: returns a list of 0 or more LobbyistClients objects;
 #          the list could be empty if the year is invalid. 
 #          An empty list is also returned if an internal error 
 #          occurs (in which case an error msg is already output).
 #
+@_cached
 def get_top_N_lobbyists(dbConn, N, year):
-  #gets the id, name, and phone number, and compensation for client details
-  sql_query = """
+  return _list_or_empty(iter_top_N_lobbyists(dbConn, N, year))
+
+
+##################################################################
+#
+# iter_top_N_lobbyists:
+#
+# generator counterpart of get_top_N_lobbyists: yields each
+# LobbyistClients object, in rank order, batch_size lobbyists at a
+# time; the clients of each batch are read with one more statement.
+#
+# Yields: 0 or more LobbyistClients objects. If an internal error
+#         occurs, an error msg is output and the error is raised
+#         (see datatier.select_iter).
+#
+def iter_top_N_lobbyists(dbConn, N, year, batch_size=1000):
+  #ranks the lobbyists by their compensation rollup for the year
+  rank_query = """
       SELECT
           LobbyistInfo.Lobbyist_ID,
           LobbyistInfo.First_Name,
           LobbyistInfo.Last_Name,
           LobbyistInfo.Phone,
-          COALESCE(SUM(Compensation.Compensation_Amount), 0) AS total_compensation
+          LobbyistYearTotals.Total_Compensation
       FROM
-          LobbyistInfo
-          JOIN LobbyistYears ON LobbyistInfo.Lobbyist_ID = LobbyistYears.Lobbyist_ID
-          JOIN Compensation ON LobbyistInfo.Lobbyist_ID = Compensation.Lobbyist_ID
+          LobbyistYearTotals
+          JOIN LobbyistInfo ON LobbyistInfo.Lobbyist_ID = LobbyistYearTotals.Lobbyist_ID
       WHERE
-          LobbyistYears.Year = ?
-          AND strftime('%Y', Compensation.Period_Start) = ?
-          AND strftime('%Y', Compensation.Period_End) = ?
-      GROUP BY
-          LobbyistInfo.Lobbyist_ID,
-          LobbyistInfo.First_Name,
-          LobbyistInfo.Last_Name,
-          LobbyistInfo.Phone
+          LobbyistYearTotals.Year = ?
+          AND EXISTS (SELECT 1 FROM LobbyistYears
+                      WHERE LobbyistYears.Lobbyist_ID = LobbyistYearTotals.Lobbyist_ID
+                          AND LobbyistYears.Year = LobbyistYearTotals.Year)
       ORDER BY
-          total_compensation DESC,
+          LobbyistYearTotals.Total_Compensation DESC,
           LobbyistInfo.Last_Name ASC
       LIMIT ?
   """
 
-  # Execute main query to get top N lobbyists
-  parameters_main = (year, year, year, N)
-  result_main = datatier.select_n_rows(dbConn, sql_query, parameters_main)
-
-  lobbyists = []
-  for row in result_main:
-    lobbyist_id = row[0]
-    first_name = row[1]
-    last_name = row[2]
-    phone = row[3]
-    total_compensation = row[4]
-
-      # Fetch distinct client names for the current lobbyist
-    sql_query_clients = """
-        SELECT DISTINCT ClientInfo.Client_ID, ClientInfo.Client_Name
-        FROM Compensation
-        JOIN ClientInfo ON Compensation.Client_ID = ClientInfo.Client_ID
-        JOIN LobbyistInfo ON LobbyistInfo.Lobbyist_ID = Compensation.Lobbyist_ID
-        JOIN LobbyistYears ON LobbyistInfo.Lobbyist_ID = LobbyistYears.Lobbyist_ID
-        WHERE LobbyistInfo.Lobbyist_ID = ?
-            AND LobbyistYears.Year = ?
-            AND strftime('%Y', Compensation.Period_Start) = ?
-            AND strftime('%Y', Compensation.Period_End) = ?
-        ORDER BY ClientInfo.Client_Name
-    """
-    parameters_clients = (lobbyist_id, year, year, year)
-    clients_result = datatier.select_n_rows(dbConn, sql_query_clients, parameters_clients)
+  #the distinct clients of a batch of ranked lobbyists, whose IDs are
+  #passed as one JSON array. This is a separate statement on purpose:
+  #joined to the ranking in one statement, SQLite 3.40 puts a Bloom
+  #filter on the Compensation lookup once the tables have been
+  #ANALYZEd, and wrongly drops every client row
+  clients_query = """
+      SELECT DISTINCT Compensation.Lobbyist_ID, ClientInfo.Client_ID, ClientInfo.Client_Name
+      FROM json_each(?) AS Ranked
+      CROSS JOIN Compensation ON Compensation.Lobbyist_ID = Ranked.value
+      JOIN ClientInfo ON Compensation.Client_ID = ClientInfo.Client_ID
+      WHERE Compensation.Start_Year = ?
+          AND Compensation.End_Year = ?
+      ORDER BY Compensation.Lobbyist_ID, ClientInfo.Client_Name
+  """
+
+  ranked = datatier.select_iter(dbConn, rank_query, (year, N), batch_size)
+  while True:
+    batch = [LobbyistClients(row[0], row[1], row[2], row[3], row[4], [])
+             for row in itertools.islice(ranked, batch_size)]
+    if not batch:
+      return
+
+    clients = {lobbyist.Lobbyist_ID: lobbyist.Clients for lobbyist in batch}
+    parameters = (json.dumps(list(clients)), year, year)
+    for row in datatier.select_iter(dbConn, clients_query, parameters, batch_size):
+      clients[row[0]].append(row[2])
+
+    yield from batch
 
-    # Extract client names from the result set and puts in a list
-    clients = [row[1] for row in clients_result]
 
-    # Create LobbyistClients object and append to list
-    lobbyist = LobbyistClients(lobbyist_id, first_name, last_name, phone, total_compensation, clients)
-    lobbyists.append(lobbyist)
+##################################################################
+#
+# get_top_N_lobbyists_for_years:
+#
+# gets the top N lobbyists of each of the given years, as
+# iter_top_N_lobbyists does for one year (the result cache is not
+# used). The years are ranked one at a time: ranking is a short walk
+# down the leaderboard index, and nearly all the time goes into
+# reading the leaders' clients, which costs no less as one statement
+# over every year than as one per year.
+#
+# Returns: a dict mapping each of the given years to its list of 0 or
+#          more LobbyistClients objects, in rank order; a list is
+#          empty if that year is invalid, or if an internal error
+#          occurred reading it (in which case an error msg is already
+#          output).
+#
+def get_top_N_lobbyists_for_years(dbConn, N, years):
+  return {year: _list_or_empty(iter_top_N_lobbyists(dbConn, N, year)) for year in years}
 
-  return lobbyists
 
 ##################################################################
 #
@@ -451,6 +977,7 @@ def add_lobbyist_year(dbConn, lobbyist_id, year):
 
   #if successful return 1 else 0
   if rows_modified > 0:
+    _invalidate_lobbyists(dbConn, [lobbyist_id], [year])
     return 1
   else:
     return 0
@@ -486,6 +1013,130 @@ def set_salutation(dbConn, lobbyist_id, salutation):
 
   #return 1 if successful else 0
   if rows_modified > 0:
+    _invalidate_lobbyists(dbConn, [lobbyist_id])
     return 1
   else:
-    return 0
\ No newline at end of file
+    return 0
+
+##################################################################
+#
+# _lobbyists_exist:
+#
+# checks all the given lobbyist ids with one query, by passing them
+# in as a JSON array and joining it against LobbyistInfo.
+#
+# Returns: a list of booleans, one per id (in the same order), True
+#          if that lobbyist exists; None if an internal error
+#          occurred (in which case an error msg is already output).
+#
+def _lobbyists_exist(dbConn, lobbyist_ids):
+  sql_query = """
+      SELECT ids.key, LobbyistInfo.Lobbyist_ID IS NOT NULL
+      FROM json_each(?) AS ids
+      LEFT JOIN LobbyistInfo ON LobbyistInfo.Lobbyist_ID = ids.value
+      ORDER BY ids.key
+  """
+  result = datatier.select_n_rows(dbConn, sql_query, (json.dumps(list(lobbyist_ids)),))
+  if result is None:
+    return None
+  return [bool(row[1]) for row in result]
+
+
+##################################################################
+#
+# _perform_bulk:
+#
+# writes the items whose lobbyist exists (exists[i] is True) with a
+# single executemany, inside a savepoint of its own, so the batch is
+# written whole or not at all without touching anything else pending
+# on the connection. If the caller has a transaction open, the batch
+# becomes part of it and, as with the other write functions, the
+# caller commits; otherwise the batch is committed on its own.
+#
+# Returns: a list with one entry per item: 1 if the item was written,
+#          0 if not (the lobbyist does not exist, or the batch failed
+#          and was rolled back).
+#
+def _perform_bulk(dbConn, sql, parameter_lists, exists):
+  if exists is None:
+    return [0] * len(parameter_lists)
+
+  to_write = [params for params, found in zip(parameter_lists, exists) if found]
+  if to_write:
+    try:
+      dbConn.execute("SAVEPOINT bulk_write")
+    except sqlite3.Error:
+      return [0] * len(parameter_lists)
+
+    written = False
+    try:
+      written = datatier.perform_many(dbConn, sql, to_write) >= 0
+      if written:
+        dbConn.execute("RELEASE bulk_write")
+    except sqlite3.Error:
+      written = False
+    finally:
+      if not written:
+        dbConn.execute("ROLLBACK TO bulk_write")
+        dbConn.execute("RELEASE bulk_write")
+    if not written:
+      return [0] * len(parameter_lists)
+
+  return [1 if found else 0 for found in exists]
+
+
+##################################################################
+#
+# add_lobbyist_years:
+#
+# Bulk version of add_lobbyist_year. Given a list of (lobbyist_id,
+# year) pairs, checks every lobbyist with one query and inserts the
+# years of the lobbyists that exist with executemany, all in one
+# savepoint: either every such year is inserted or none is, and
+# anything else pending on the connection is left as it was (see
+# _perform_bulk).
+#
+# Returns: a list with one entry per pair, 1 if that year was added,
+#          0 if not (the lobbyist does not exist, or an internal error
+#          occurred and the whole batch was rolled back).
+#
+def add_lobbyist_years(dbConn, lobbyist_years):
+  lobbyist_years = [(lobbyist_id, year) for lobbyist_id, year in lobbyist_years]
+  exists = _lobbyists_exist(dbConn, [lobbyist_id for lobbyist_id, _ in lobbyist_years])
+
+  insert_sql = "INSERT INTO LobbyistYears (lobbyist_id, year) VALUES (?, ?)"
+  results = _perform_bulk(dbConn, insert_sql, lobbyist_years, exists)
+
+  written = [pair for pair, ok in zip(lobbyist_years, results) if ok]
+  if written:
+    _invalidate_lobbyists(dbConn, [lobbyist_id for lobbyist_id, _ in written],
+                          [year for _, year in written])
+  return results
+
+
+##################################################################
+#
+# set_salutations:
+#
+# Bulk version of set_salutation. Given a list of (lobbyist_id,
+# salutation) pairs, checks every lobbyist with one query and updates
+# the salutations of the lobbyists that exist with executemany, all
+# in one savepoint, as add_lobbyist_years does. As with
+# set_salutation, "" clears the salutation.
+#
+# Returns: a list with one entry per pair, 1 if that salutation was
+#          set, 0 if not (the lobbyist does not exist, or an internal
+#          error occurred and the whole batch was rolled back).
+#
+def set_salutations(dbConn, lobbyist_salutations):
+  lobbyist_salutations = [(lobbyist_id, salutation) for lobbyist_id, salutation in lobbyist_salutations]
+  exists = _lobbyists_exist(dbConn, [lobbyist_id for lobbyist_id, _ in lobbyist_salutations])
+
+  update_sql = "UPDATE LobbyistInfo SET salutation = ? WHERE Lobbyist_ID = ?"
+  parameter_lists = [(salutation, lobbyist_id) for lobbyist_id, salutation in lobbyist_salutations]
+  results = _perform_bulk(dbConn, update_sql, parameter_lists, exists)
+
+  written = [lobbyist_id for (lobbyist_id, _), ok in zip(lobbyist_salutations, results) if ok]
+  if written:
+    _invalidate_lobbyists(dbConn, written)
+  return results
@@ -0,0 +1,124 @@
+#
+# querypool.py
+#
+# Runs many independent objecttier read calls in parallel on a pool
+# of worker processes, e.g. the details of thousands of lobbyists or
+# the leaderboards of many years. Each worker opens its own read-only
+# connection to the database once and reuses it for every call it is
+# given; results come back in the order the calls were submitted.
+#
+# Usage: python querypool.py [--processes n] [--chunksize n] [database]
+#
+import argparse
+import multiprocessing
+import time
+
+import datatier
+import objecttier
+
+
+#
+# the worker process's connection, opened by _init_worker
+#
+_db = None
+
+
+def _init_worker(path, pragmas):
+  global _db
+  _db = datatier.ConnectionManager(path, read_only=True, pragmas=pragmas)
+
+
+def _run_call(call):
+  fn, args = call
+  return fn(_db.connection(), *args)
+
+
+##################################################################
+#
+# QueryPool:
+#
+# A pool of worker processes, each holding a read-only connection to
+# the same database. Calls are given as (function, args) pairs, where
+# the function is a module-level objecttier read function (functions
+# are sent to the workers by name) and args are the arguments that
+# follow dbConn; the results, which are sent back pickled, are
+# returned in input order. Calls are handed to the workers
+# chunksize at a time: larger chunks cost less in messaging, smaller
+# ones balance uneven calls better. Writes fail in the workers, since
+# their connections are read-only. Use as a context manager, or call
+# close() when done.
+#
+# Constructor(path="Chicago_Lobbyists.db", processes=None,
+#             chunksize=32, pragmas=None)
+#   processes: number of workers; defaults to the number of CPUs
+#   chunksize: default number of calls handed to a worker at a time
+#   pragmas: as for datatier.ConnectionManager
+# Properties:
+#   processes: int
+# Methods:
+#   run(calls, chunksize=None): list of results, one per call
+#   map(fn, arg_lists, chunksize=None): run() of fn over each tuple
+#                                       of arguments
+#   close(): shuts the workers down
+#
+class QueryPool:
+  def __init__(self, path="Chicago_Lobbyists.db", processes=None, chunksize=32, pragmas=None):
+    self._processes = processes or multiprocessing.cpu_count()
+    self._chunksize = chunksize
+    # spawn rather than fork: the parent may be running threads (the
+    # GUI's query worker) whose locks a forked child would inherit
+    context = multiprocessing.get_context("spawn")
+    self._pool = context.Pool(self._processes, _init_worker, (path, pragmas))
+
+  @property
+  def processes(self):
+    return self._processes
+
+  def run(self, calls, chunksize=None):
+    return self._pool.map(_run_call, list(calls), chunksize or self._chunksize)
+
+  def map(self, fn, arg_lists, chunksize=None):
+    return self.run(((fn, tuple(args)) for args in arg_lists), chunksize)
+
+  def close(self):
+    self._pool.close()
+    self._pool.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Time lobbyist details lookups serially and on a process pool.")
+  parser.add_argument("db", nargs="?", default="Chicago_Lobbyists.db", help="database to query")
+  parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+  parser.add_argument("--chunksize", type=int, default=32, help="calls handed to a worker at a time")
+  parser.add_argument("--limit", type=int, default=5000, help="number of lobbyists to look up")
+  args = parser.parse_args()
+
+  dbConn = datatier.ConnectionManager(args.db, read_only=True).connection()
+  ids = [row[0] for row in dbConn.execute("SELECT Lobbyist_ID FROM LobbyistInfo ORDER BY Lobbyist_ID LIMIT ?",
+                                          (args.limit,))]
+
+  start = time.perf_counter()
+  serial = [objecttier.get_lobbyist_details(dbConn, lobbyist_id, use_cache=False) for lobbyist_id in ids]
+  elapsed = time.perf_counter() - start
+  print("serial:    %d lookups in %8.2f ms (%8.0f/s)" % (len(ids), elapsed * 1000.0, len(ids) / elapsed))
+
+  with QueryPool(args.db, args.processes, args.chunksize) as pool:
+    pool.map(objecttier.num_lobbyists, [()] * pool.processes, chunksize=1)  # start the workers
+    start = time.perf_counter()
+    pooled = pool.map(objecttier.get_lobbyist_details, [(lobbyist_id,) for lobbyist_id in ids])
+    elapsed = time.perf_counter() - start
+    print("%2d workers: %d lookups in %8.2f ms (%8.0f/s)" %
+          (pool.processes, len(ids), elapsed * 1000.0, len(ids) / elapsed))
+
+  if pooled != serial:
+    print("warning: pooled results differ from serial results")
+
+
+if __name__ == '__main__':
+  main()
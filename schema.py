@@ -0,0 +1,735 @@
+#
+# schema.py
+#
+# Upgrades a Chicago_Lobbyists.db database in place with the derived
+# columns and indexes the object tier relies on. Each upgrade step
+# runs once, in its own transaction, and the version reached is
+# recorded in the database's PRAGMA user_version.
+#
+# Usage: python schema.py [--rebuild-rollups] [--rebuild-name-index]
+#                         [--rebuild-stats] [--analyze] [--verify] [database]
+#
+import argparse
+import logging
+import re
+import sqlite3
+import sys
+
+import datatier
+import objecttier
+
+logger = logging.getLogger(__name__)
+
+#
+# the tables of Chicago_Lobbyists.db as published, before any upgrade
+# step; synthdb and ingest create new databases from it
+#
+BASE_SCHEMA = """
+CREATE TABLE LobbyistInfo (
+    Lobbyist_ID INTEGER PRIMARY KEY,
+    Salutation TEXT, First_Name TEXT, Middle_Initial TEXT,
+    Last_Name TEXT, Suffix TEXT, Address_1 TEXT, Address_2 TEXT,
+    City TEXT, State_Initial TEXT, ZipCode TEXT, Country TEXT,
+    Email TEXT, Phone TEXT, Fax TEXT
+);
+CREATE TABLE EmployerInfo (
+    Employer_ID INTEGER PRIMARY KEY,
+    Employer_Name TEXT, Address_1 TEXT, Address_2 TEXT, City TEXT,
+    State_Initial TEXT, ZipCode TEXT, Country TEXT, Phone TEXT, Fax TEXT
+);
+CREATE TABLE ClientInfo (
+    Client_ID INTEGER PRIMARY KEY,
+    Client_Name TEXT, Address_1 TEXT, Address_2 TEXT, City TEXT,
+    State_Initial TEXT, ZipCode TEXT, Country TEXT, Phone TEXT, Fax TEXT
+);
+CREATE TABLE LobbyistAndEmployer (
+    Lobbyist_ID INTEGER, Employer_ID INTEGER, Year INTEGER
+);
+CREATE TABLE LobbyistYears (
+    Lobbyist_ID INTEGER, Year INTEGER
+);
+CREATE TABLE Compensation (
+    Compensation_ID INTEGER PRIMARY KEY,
+    Lobbyist_ID INTEGER, Compensation_Amount REAL,
+    Period_Start TEXT, Period_End TEXT, Client_ID INTEGER
+);
+"""
+
+
+##################################################################
+#
+# _add_compensation_years:
+#
+# Adds Start_Year and End_Year to Compensation as virtual generated
+# columns (derived from Period_Start / Period_End, so they can never
+# drift) and indexes them, so year filters become index range
+# lookups instead of a strftime() call on every row. LobbyistYears
+# gets the matching index on Year.
+#
+def _add_compensation_years(dbConn):
+  dbConn.execute("""
+      ALTER TABLE Compensation ADD COLUMN Start_Year INTEGER
+      GENERATED ALWAYS AS (CAST(strftime('%Y', Period_Start) AS INTEGER)) VIRTUAL
+  """)
+  dbConn.execute("""
+      ALTER TABLE Compensation ADD COLUMN End_Year INTEGER
+      GENERATED ALWAYS AS (CAST(strftime('%Y', Period_End) AS INTEGER)) VIRTUAL
+  """)
+  dbConn.execute("""
+      CREATE INDEX IF NOT EXISTS Compensation_Years
+      ON Compensation (Start_Year, End_Year, Lobbyist_ID, Client_ID, Compensation_Amount)
+  """)
+  dbConn.execute("""
+      CREATE INDEX IF NOT EXISTS LobbyistYears_Year
+      ON LobbyistYears (Year, Lobbyist_ID)
+  """)
+
+
+#
+# the year a compensation filing counts towards in the rollup: its
+# year if it starts and ends in the same year, otherwise 0 (filings
+# that span years, or are undated, only count towards lifetime totals)
+#
+_FILING_YEAR = "CASE WHEN {0}Start_Year = {0}End_Year THEN {0}Start_Year ELSE 0 END"
+
+#
+# recomputes one (lobbyist, year) bucket of LobbyistYearTotals from
+# Compensation; an emptied bucket is removed. A year's bucket is read
+# with Start_Year = End_Year = year, an index range lookup on
+# Compensation_Lobbyist that touches only that year's filings; only
+# the year 0 bucket has to test each of the lobbyist's filings. The
+# test of the bucket's year against 0 references no table, so SQLite
+# evaluates it once and skips the statement that doesn't apply.
+#
+_REFRESH_BUCKET = """
+    DELETE FROM LobbyistYearTotals
+    WHERE Lobbyist_ID = {row}.Lobbyist_ID AND Year = {year};
+    INSERT INTO LobbyistYearTotals (Lobbyist_ID, Year, Total_Compensation, Num_Clients)
+    SELECT Lobbyist_ID, {year}, COALESCE(SUM(Compensation_Amount), 0), COUNT(DISTINCT Client_ID)
+    FROM Compensation
+    WHERE {year} <> 0
+      AND Lobbyist_ID = {row}.Lobbyist_ID AND Start_Year = {year} AND End_Year = {year}
+    GROUP BY Lobbyist_ID;
+    INSERT INTO LobbyistYearTotals (Lobbyist_ID, Year, Total_Compensation, Num_Clients)
+    SELECT Lobbyist_ID, 0, COALESCE(SUM(Compensation_Amount), 0), COUNT(DISTINCT Client_ID)
+    FROM Compensation
+    WHERE {year} = 0
+      AND Lobbyist_ID = {row}.Lobbyist_ID AND {filing_year} = 0
+    GROUP BY Lobbyist_ID;
+"""
+
+
+def _refresh_bucket(row):
+  return _REFRESH_BUCKET.format(row=row,
+                                year=_FILING_YEAR.format(row + "."),
+                                filing_year=_FILING_YEAR.format(""))
+
+
+##################################################################
+#
+# rebuild_rollups:
+#
+# Recomputes LobbyistYearTotals from scratch. The triggers keep it
+# current, so this is only needed if it has drifted (e.g. the
+# triggers were dropped for a bulk load). Runs inside whatever
+# transaction the caller has open; call dbConn.commit() afterwards.
+#
+def rebuild_rollups(dbConn):
+  dbConn.execute("DELETE FROM LobbyistYearTotals")
+  dbConn.execute("""
+      INSERT INTO LobbyistYearTotals (Lobbyist_ID, Year, Total_Compensation, Num_Clients)
+      SELECT Lobbyist_ID, %s AS Year,
+             COALESCE(SUM(Compensation_Amount), 0), COUNT(DISTINCT Client_ID)
+      FROM Compensation
+      WHERE Lobbyist_ID IS NOT NULL
+      GROUP BY Lobbyist_ID, Year
+  """ % _FILING_YEAR.format(""))
+
+
+##################################################################
+#
+# _add_compensation_rollup:
+#
+# Adds LobbyistYearTotals, one row per (Lobbyist_ID, Year) with the
+# total compensation and number of distinct clients, kept current
+# by triggers on Compensation. The (Year, Total_Compensation) index
+# lets a leaderboard read the first N rows of a year in order, and
+# the covering Compensation_Lobbyist index keeps each trigger's
+# recompute to the one lobbyist's filings of the one year.
+#
+def _add_compensation_rollup(dbConn):
+  dbConn.execute("""
+      CREATE INDEX IF NOT EXISTS Compensation_Lobbyist
+      ON Compensation (Lobbyist_ID, Start_Year, End_Year, Client_ID, Compensation_Amount)
+  """)
+  dbConn.execute("""
+      CREATE TABLE LobbyistYearTotals (
+          Lobbyist_ID INTEGER NOT NULL,
+          Year INTEGER NOT NULL,
+          Total_Compensation REAL NOT NULL,
+          Num_Clients INTEGER NOT NULL,
+          PRIMARY KEY (Lobbyist_ID, Year)
+      ) WITHOUT ROWID
+  """)
+  dbConn.execute("""
+      CREATE INDEX LobbyistYearTotals_Leaderboard
+      ON LobbyistYearTotals (Year, Total_Compensation DESC)
+  """)
+  _create_rollup_triggers(dbConn)
+  rebuild_rollups(dbConn)
+
+
+def _create_rollup_triggers(dbConn):
+  dbConn.execute("""
+      CREATE TRIGGER Compensation_Rollup_Insert AFTER INSERT ON Compensation
+      BEGIN %s END
+  """ % _refresh_bucket("NEW"))
+  dbConn.execute("""
+      CREATE TRIGGER Compensation_Rollup_Delete AFTER DELETE ON Compensation
+      BEGIN %s END
+  """ % _refresh_bucket("OLD"))
+  dbConn.execute("""
+      CREATE TRIGGER Compensation_Rollup_Update
+      AFTER UPDATE OF Lobbyist_ID, Client_ID, Compensation_Amount, Period_Start, Period_End
+      ON Compensation
+      BEGIN %s %s END
+  """ % (_refresh_bucket("OLD"), _refresh_bucket("NEW")))
+
+
+##################################################################
+#
+# _add_lobbyist_lookup_indexes:
+#
+# Indexes LobbyistYears and LobbyistAndEmployer by lobbyist, so the
+# years and employers of one lobbyist are index lookups.
+#
+def _add_lobbyist_lookup_indexes(dbConn):
+  dbConn.execute("""
+      CREATE INDEX IF NOT EXISTS LobbyistYears_Lobbyist
+      ON LobbyistYears (Lobbyist_ID, Year)
+  """)
+  dbConn.execute("""
+      CREATE INDEX IF NOT EXISTS LobbyistAndEmployer_Lobbyist
+      ON LobbyistAndEmployer (Lobbyist_ID, Employer_ID)
+  """)
+
+
+##################################################################
+#
+# _add_lobbyist_name_index:
+#
+# Adds LobbyistNames, an FTS5 trigram index over the lobbyists'
+# first and last names (rowid = Lobbyist_ID), kept in sync with
+# LobbyistInfo by triggers. The trigram tokenizer answers LIKE
+# patterns containing a run of 3+ literal characters from the index.
+#
+def _add_lobbyist_name_index(dbConn):
+  dbConn.execute("""
+      CREATE VIRTUAL TABLE LobbyistNames
+      USING fts5(First_Name, Last_Name, tokenize = 'trigram')
+  """)
+  dbConn.execute("""
+      CREATE TRIGGER LobbyistNames_Insert AFTER INSERT ON LobbyistInfo
+      BEGIN
+          INSERT INTO LobbyistNames (rowid, First_Name, Last_Name)
+          VALUES (NEW.Lobbyist_ID, NEW.First_Name, NEW.Last_Name);
+      END
+  """)
+  dbConn.execute("""
+      CREATE TRIGGER LobbyistNames_Delete AFTER DELETE ON LobbyistInfo
+      BEGIN
+          DELETE FROM LobbyistNames WHERE rowid = OLD.Lobbyist_ID;
+      END
+  """)
+  dbConn.execute("""
+      CREATE TRIGGER LobbyistNames_Update
+      AFTER UPDATE OF Lobbyist_ID, First_Name, Last_Name ON LobbyistInfo
+      BEGIN
+          DELETE FROM LobbyistNames WHERE rowid = OLD.Lobbyist_ID;
+          INSERT INTO LobbyistNames (rowid, First_Name, Last_Name)
+          VALUES (NEW.Lobbyist_ID, NEW.First_Name, NEW.Last_Name);
+      END
+  """)
+  rebuild_name_index(dbConn)
+
+
+##################################################################
+#
+# rebuild_name_index:
+#
+# Repopulates LobbyistNames from LobbyistInfo. Like rebuild_rollups,
+# only needed if the index has drifted; call dbConn.commit() after.
+#
+def rebuild_name_index(dbConn):
+  dbConn.execute("DELETE FROM LobbyistNames")
+  dbConn.execute("""
+      INSERT INTO LobbyistNames (rowid, First_Name, Last_Name)
+      SELECT Lobbyist_ID, First_Name, Last_Name FROM LobbyistInfo
+  """)
+
+
+#
+# tables whose row counts TableCounts keeps
+#
+_COUNTED_TABLES = ["LobbyistInfo", "EmployerInfo", "ClientInfo"]
+
+
+##################################################################
+#
+# rebuild_stats:
+#
+# Recomputes TableCounts and YearStats from scratch. Like
+# rebuild_rollups, only needed if they have drifted; call
+# dbConn.commit() afterwards. The rollup must be current first, since
+# the per-year compensation totals are summed from it.
+#
+def rebuild_stats(dbConn):
+  dbConn.execute("DELETE FROM TableCounts")
+  for table in _COUNTED_TABLES:
+    dbConn.execute("INSERT INTO TableCounts (Table_Name, Row_Count) SELECT ?, COUNT(*) FROM %s" % table,
+                   (table,))
+  dbConn.execute("DELETE FROM YearStats")
+  dbConn.execute("""
+      INSERT INTO YearStats (Year, Num_Lobbyists, Total_Compensation)
+      SELECT Year, SUM(Num_Lobbyists), SUM(Total_Compensation)
+      FROM (SELECT Year, COUNT(DISTINCT Lobbyist_ID) AS Num_Lobbyists, 0 AS Total_Compensation
+            FROM LobbyistYears WHERE Year IS NOT NULL GROUP BY Year
+            UNION ALL
+            SELECT Year, 0, SUM(Total_Compensation)
+            FROM LobbyistYearTotals GROUP BY Year)
+      GROUP BY Year
+  """)
+
+
+##################################################################
+#
+# _add_stats_tables:
+#
+# Adds TableCounts (the row count of each of the lobbyist, employer
+# and client tables) and YearStats (per year: how many distinct
+# lobbyists are registered, and their total compensation), both kept
+# current by triggers, so the statistics are a few primary key reads
+# however large the tables grow. Registrations are counted once per
+# (lobbyist, year) even if LobbyistYears holds duplicates; the
+# compensation totals follow the LobbyistYearTotals rollup (year 0
+# holds the filings that span years).
+#
+def _add_stats_tables(dbConn):
+  dbConn.execute("""
+      CREATE TABLE TableCounts (
+          Table_Name TEXT PRIMARY KEY,
+          Row_Count INTEGER NOT NULL
+      ) WITHOUT ROWID
+  """)
+  dbConn.execute("""
+      CREATE TABLE YearStats (
+          Year INTEGER PRIMARY KEY,
+          Num_Lobbyists INTEGER NOT NULL,
+          Total_Compensation REAL NOT NULL
+      )
+  """)
+
+  for table in _COUNTED_TABLES:
+    dbConn.execute("""
+        CREATE TRIGGER %s_Count_Insert AFTER INSERT ON %s
+        BEGIN
+            UPDATE TableCounts SET Row_Count = Row_Count + 1 WHERE Table_Name = '%s';
+        END
+    """ % (table, table, table))
+    dbConn.execute("""
+        CREATE TRIGGER %s_Count_Delete AFTER DELETE ON %s
+        BEGIN
+            UPDATE TableCounts SET Row_Count = Row_Count - 1 WHERE Table_Name = '%s';
+        END
+    """ % (table, table, table))
+
+  # a registration counts when the first row for its (lobbyist, year)
+  # arrives, and stops counting when the last one goes
+  register = """
+      INSERT INTO YearStats (Year, Num_Lobbyists, Total_Compensation)
+      SELECT NEW.Year, 1, 0
+      WHERE NEW.Year IS NOT NULL
+        AND (SELECT COUNT(*) FROM LobbyistYears
+             WHERE Lobbyist_ID = NEW.Lobbyist_ID AND Year = NEW.Year) = 1
+      ON CONFLICT (Year) DO UPDATE SET Num_Lobbyists = Num_Lobbyists + 1;
+  """
+  unregister = """
+      UPDATE YearStats SET Num_Lobbyists = Num_Lobbyists - 1
+      WHERE Year = OLD.Year
+        AND NOT EXISTS (SELECT 1 FROM LobbyistYears
+                        WHERE Lobbyist_ID = OLD.Lobbyist_ID AND Year = OLD.Year);
+  """
+  dbConn.execute("CREATE TRIGGER LobbyistYears_Stats_Insert AFTER INSERT ON LobbyistYears BEGIN %s END"
+                 % register)
+  dbConn.execute("CREATE TRIGGER LobbyistYears_Stats_Delete AFTER DELETE ON LobbyistYears BEGIN %s END"
+                 % unregister)
+  dbConn.execute("""
+      CREATE TRIGGER LobbyistYears_Stats_Update AFTER UPDATE OF Lobbyist_ID, Year ON LobbyistYears
+      WHEN OLD.Lobbyist_ID IS NOT NEW.Lobbyist_ID OR OLD.Year IS NOT NEW.Year
+      BEGIN %s %s END
+  """ % (unregister, register))
+
+  # the rollup triggers replace a bucket by deleting and re-inserting
+  # it, so following its inserts and deletes keeps the year totals
+  dbConn.execute("""
+      CREATE TRIGGER LobbyistYearTotals_Stats_Insert AFTER INSERT ON LobbyistYearTotals
+      BEGIN
+          INSERT INTO YearStats (Year, Num_Lobbyists, Total_Compensation)
+          VALUES (NEW.Year, 0, NEW.Total_Compensation)
+          ON CONFLICT (Year) DO UPDATE SET Total_Compensation = Total_Compensation + excluded.Total_Compensation;
+      END
+  """)
+  dbConn.execute("""
+      CREATE TRIGGER LobbyistYearTotals_Stats_Delete AFTER DELETE ON LobbyistYearTotals
+      BEGIN
+          UPDATE YearStats SET Total_Compensation = Total_Compensation - OLD.Total_Compensation
+          WHERE Year = OLD.Year;
+      END
+  """)
+  rebuild_stats(dbConn)
+
+
+##################################################################
+#
+# _add_remaining_indexes:
+#
+# Indexes Compensation by client and LobbyistAndEmployer by employer
+# (the other directions are indexed by earlier steps), each covering
+# the columns a lookup in that direction reads, then runs ANALYZE so
+# the planner has statistics for every index.
+#
+def _add_remaining_indexes(dbConn):
+  dbConn.execute("""
+      CREATE INDEX IF NOT EXISTS Compensation_Client
+      ON Compensation (Client_ID, Lobbyist_ID, Start_Year, End_Year, Compensation_Amount)
+  """)
+  dbConn.execute("""
+      CREATE INDEX IF NOT EXISTS LobbyistAndEmployer_Employer
+      ON LobbyistAndEmployer (Employer_ID, Lobbyist_ID, Year)
+  """)
+  dbConn.execute("ANALYZE")
+
+
+#
+# the tables delta sync (ingest.py --sync) keeps row hashes for
+#
+HASHED_TABLES = ["LobbyistInfo", "EmployerInfo", "ClientInfo",
+                 "LobbyistAndEmployer", "LobbyistYears", "Compensation"]
+
+
+##################################################################
+#
+# _add_row_hashes:
+#
+# Adds a <table>_RowHashes table next to each of HASHED_TABLES,
+# mapping a row's rowid to the hash of its content as of the last
+# sync. The hashes themselves are computed by the sync (they need a
+# Python function), so the tables start out empty; the triggers only
+# forget the hash of a row that is updated or deleted by anything
+# else, which makes the next sync hash that row again.
+#
+def _add_row_hashes(dbConn):
+  for table in HASHED_TABLES:
+    dbConn.execute("""
+        CREATE TABLE %s_RowHashes (
+            Row_ID INTEGER PRIMARY KEY,
+            Row_Hash INTEGER NOT NULL
+        )
+    """ % table)
+    dbConn.execute("CREATE INDEX %s_RowHashes_Hash ON %s_RowHashes (Row_Hash)" % (table, table))
+    for event in ("UPDATE", "DELETE"):
+      dbConn.execute("""
+          CREATE TRIGGER %s_RowHashes_%s AFTER %s ON %s
+          BEGIN
+              DELETE FROM %s_RowHashes WHERE Row_ID = OLD.rowid;
+          END
+      """ % (table, event.capitalize(), event, table, table))
+
+
+##################################################################
+#
+# _replace_rollup_triggers:
+#
+# Replaces the rollup triggers of databases upgraded before version
+# 8, whose bucket refresh tested every one of a lobbyist's filings,
+# with the current ones (see _REFRESH_BUCKET). The rollup itself is
+# unchanged.
+#
+def _replace_rollup_triggers(dbConn):
+  for event in ("Insert", "Delete", "Update"):
+    dbConn.execute("DROP TRIGGER IF EXISTS Compensation_Rollup_%s" % event)
+  _create_rollup_triggers(dbConn)
+
+
+#
+# upgrade steps in the order they are applied; the number is the
+# schema version the database is at once the step has run
+#
+MIGRATIONS = [
+  (1, "Compensation start/end year columns", _add_compensation_years),
+  (2, "per-lobbyist-per-year compensation rollup", _add_compensation_rollup),
+  (3, "lobbyist year and employer lookup indexes", _add_lobbyist_lookup_indexes),
+  (4, "FTS5 trigram index over lobbyist names", _add_lobbyist_name_index),
+  (5, "trigger-maintained table counts and per-year statistics", _add_stats_tables),
+  (6, "client and employer covering indexes, ANALYZE", _add_remaining_indexes),
+  (7, "row hash tables for delta sync", _add_row_hashes),
+  (8, "rollup triggers that refresh a year from its own filings", _replace_rollup_triggers),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+##################################################################
+#
+# schema_version:
+#
+# Returns: the schema version recorded in the database (0 for a
+#          database that has never been upgraded).
+#
+def schema_version(dbConn):
+  return dbConn.execute("PRAGMA user_version").fetchone()[0]
+
+
+##################################################################
+#
+# upgrade:
+#
+# Applies every upgrade step the database has not seen yet. It is
+# safe to call on every start-up; an up-to-date database is left
+# untouched. Any pending transaction on dbConn is committed first.
+#
+# Returns: the schema version the database is at afterwards. If a
+#          step fails it is rolled back, a msg is output, and the
+#          version reached before that step is returned.
+#
+def upgrade(dbConn):
+  current = schema_version(dbConn)
+  if current >= LATEST_VERSION:
+    return current
+
+  dbConn.commit()
+  for version, description, step in MIGRATIONS:
+    if version <= current:
+      continue
+    try:
+      dbConn.execute("BEGIN")
+      step(dbConn)
+      dbConn.execute("PRAGMA user_version = %d" % version)
+      dbConn.commit()
+    except Exception as err:
+      dbConn.rollback()
+      logger.error("schema upgrade to version %d (%s) failed: %s", version, description, err)
+      return current
+    current = version
+
+  return current
+
+
+#
+# tables too big to scan on every query; a plan step "SCAN <table>"
+# for one of these (with or without a covering index) fails
+# verify_plans
+#
+BIG_TABLES = ["LobbyistInfo", "EmployerInfo", "ClientInfo", "LobbyistAndEmployer",
+              "LobbyistYears", "Compensation", "LobbyistYearTotals"]
+
+_SCAN = re.compile(r"^SCAN (\w+)")
+
+
+##################################################################
+#
+# _plan_cases:
+#
+# One call of every objecttier function with representative
+# arguments (taken from the database itself), each with the big
+# tables its statements may scan: the legacy COUNT(*) functions, and
+# name patterns with no run of 3 literal characters, which no index
+# can answer.
+#
+def _plan_cases(dbConn):
+  lobbyist_id, year = dbConn.execute(
+    "SELECT Lobbyist_ID, Year FROM LobbyistYears WHERE Year IS NOT NULL LIMIT 1").fetchone() or (1, 2020)
+  last_name = dbConn.execute("SELECT Last_Name FROM LobbyistInfo WHERE Lobbyist_ID = ?",
+                             (lobbyist_id,)).fetchone()
+  pattern = "%" + (last_name[0] if last_name and last_name[0] else "Smith")[:4] + "%"
+
+  return [
+    ("num_lobbyists", lambda: objecttier.num_lobbyists(dbConn, use_cache=False), {"LobbyistInfo"}),
+    ("num_employers", lambda: objecttier.num_employers(dbConn), {"EmployerInfo"}),
+    ("num_clients", lambda: objecttier.num_clients(dbConn), {"ClientInfo"}),
+    ("get_stats", lambda: objecttier.get_stats(dbConn), set()),
+    ("get_lobbyists %r" % pattern, lambda: objecttier.get_lobbyists(dbConn, pattern, use_cache=False), set()),
+    ("get_lobbyists '%a%'", lambda: objecttier.get_lobbyists(dbConn, "%a%", use_cache=False), {"LobbyistInfo"}),
+    ("get_lobbyists_page", lambda: objecttier.get_lobbyists_page(dbConn, pattern, 0, 50), set()),
+    ("count_lobbyists", lambda: objecttier.count_lobbyists(dbConn, pattern, 1000), set()),
+    ("get_lobbyist_details", lambda: objecttier.get_lobbyist_details(dbConn, lobbyist_id, use_cache=False), set()),
+    ("get_top_N_lobbyists", lambda: objecttier.get_top_N_lobbyists(dbConn, 10, year, use_cache=False), set()),
+    ("get_top_N_lobbyists_for_years", lambda: objecttier.get_top_N_lobbyists_for_years(dbConn, 10, [year]), set()),
+    # no such lobbyist, so only the existence check runs (and the
+    # bulk writer's commit finds nothing to commit)
+    ("add_lobbyist_years", lambda: objecttier.add_lobbyist_years(dbConn, [(-1, year)]), set()),
+    ("add_lobbyist_year", lambda: objecttier.add_lobbyist_year(dbConn, lobbyist_id, year), set()),
+    ("set_salutation", lambda: objecttier.set_salutation(dbConn, lobbyist_id, "Dr."), set()),
+  ]
+
+
+##################################################################
+#
+# verify_plans:
+#
+# Runs every objecttier function once with datatier instrumentation
+# capturing the plan of every statement, and checks that no plan
+# scans a big table (other than the scans _plan_cases expects). The
+# writes are rolled back, so the database is left as it was; any
+# pending transaction on dbConn is committed first.
+#
+# Returns: a list of (function, statement, plan step) for every
+#          unexpected scan; empty if every plan passes.
+#
+def verify_plans(dbConn):
+  dbConn.commit()
+  query_stats = datatier.QueryStats(slow_ms=0.0, explain=True, max_slow=1, log_slow=False)
+  previous = datatier.install_query_stats(query_stats)
+  problems = []
+  try:
+    for label, call, allowed in _plan_cases(dbConn):
+      query_stats.reset()
+      call()
+      for statement, stats in query_stats.snapshot()["statements"].items():
+        for step in stats["plan"] or []:
+          scanned = _SCAN.match(step)
+          if scanned and scanned.group(1) in BIG_TABLES and scanned.group(1) not in allowed:
+            problems.append((label, statement, step))
+  finally:
+    dbConn.rollback()
+    datatier.install_query_stats(previous)
+  return problems
+
+
+#
+# a reference for the clients of a lobbyist in a year, read without
+# the object tier's joins
+#
+_REFERENCE_CLIENTS = """
+    SELECT DISTINCT ClientInfo.Client_ID, ClientInfo.Client_Name
+    FROM Compensation JOIN ClientInfo ON ClientInfo.Client_ID = Compensation.Client_ID
+    WHERE Compensation.Lobbyist_ID = ? AND Compensation.Start_Year = ? AND Compensation.End_Year = ?
+    ORDER BY ClientInfo.Client_Name
+"""
+
+
+##################################################################
+#
+# verify_results:
+#
+# Runs the Top-N functions for the latest year that has filings and
+# checks their results rather than their plans: each lobbyist's
+# clients must match a plain per-lobbyist query, and
+# get_top_N_lobbyists_for_years must agree with get_top_N_lobbyists.
+# This catches planner bugs that give a good-looking plan but wrong
+# rows, such as the Bloom filter one SQLite 3.40 has once the tables
+# are ANALYZEd.
+#
+# Returns: a list of (function, problem) strings; empty if every
+#          result matches.
+#
+def verify_results(dbConn, N=10):
+  row = dbConn.execute("SELECT MAX(Year) FROM LobbyistYearTotals WHERE Year > 0").fetchone()
+  if row is None or row[0] is None:
+    return []
+  year = row[0]
+
+  problems = []
+  top = objecttier.get_top_N_lobbyists(dbConn, N, year, use_cache=False)
+  for lobbyist in top:
+    expected = [name for _, name in dbConn.execute(_REFERENCE_CLIENTS, (lobbyist.Lobbyist_ID, year, year))]
+    if lobbyist.Clients != expected:
+      problems.append(("get_top_N_lobbyists", "lobbyist %d in %d has %d clients, expected %d" %
+                       (lobbyist.Lobbyist_ID, year, len(lobbyist.Clients), len(expected))))
+
+  if objecttier.get_top_N_lobbyists_for_years(dbConn, N, [year])[year] != top:
+    problems.append(("get_top_N_lobbyists_for_years", "differs from get_top_N_lobbyists for %d" % year))
+  return problems
+
+
+##################################################################
+#
+# sample_db:
+#
+# Returns: a small in-memory database at the latest schema version,
+#          ANALYZEd as upgrade() leaves it, with a few years of
+#          lobbyists, clients and filings, for verify_results.
+#
+def sample_db(num_lobbyists=200):
+  dbConn = sqlite3.connect(":memory:")
+  dbConn.executescript(BASE_SCHEMA)
+  for i in range(1, num_lobbyists + 1):
+    dbConn.execute("INSERT INTO LobbyistInfo (Lobbyist_ID, First_Name, Last_Name) VALUES (?, ?, ?)",
+                   (i, "First", "Last%d" % (i % 37)))
+    dbConn.execute("INSERT INTO ClientInfo (Client_ID, Client_Name) VALUES (?, ?)", (i, "Client %d" % i))
+    for year in (2019, 2020):
+      dbConn.execute("INSERT INTO LobbyistYears (Lobbyist_ID, Year) VALUES (?, ?)", (i, year))
+      for client_id in {i, i % 7 + 1}:
+        dbConn.execute("""
+            INSERT INTO Compensation (Lobbyist_ID, Compensation_Amount, Period_Start, Period_End, Client_ID)
+            VALUES (?, ?, ?, ?, ?)
+        """, (i, 1000.0 + (i * 7919) % 500, "%d-01-01" % year, "%d-12-31" % year, client_id))
+  dbConn.commit()
+  upgrade(dbConn)
+  return dbConn
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Upgrade a lobbyist database to the latest schema.")
+  parser.add_argument("db", nargs="?", default="Chicago_Lobbyists.db", help="database to upgrade")
+  parser.add_argument("--rebuild-rollups", action="store_true", help="recompute the rollup tables from scratch")
+  parser.add_argument("--rebuild-name-index", action="store_true", help="repopulate the lobbyist name search index")
+  parser.add_argument("--rebuild-stats", action="store_true", help="recompute the table counts and per-year statistics")
+  parser.add_argument("--analyze", action="store_true", help="refresh the query planner's statistics")
+  parser.add_argument("--verify", action="store_true",
+                      help="check that no objecttier query plan scans a big table, and spot-check Top-N results")
+  args = parser.parse_args()
+
+  dbConn = sqlite3.connect(args.db)
+  try:
+    version = upgrade(dbConn)
+    print("%s: schema version %d" % (args.db, version))
+    if args.rebuild_rollups:
+      with dbConn:
+        rebuild_rollups(dbConn)
+      print("%s: rollups rebuilt" % args.db)
+    if args.rebuild_name_index:
+      with dbConn:
+        rebuild_name_index(dbConn)
+      print("%s: name index rebuilt" % args.db)
+    if args.rebuild_stats:
+      with dbConn:
+        rebuild_stats(dbConn)
+      print("%s: statistics rebuilt" % args.db)
+    if args.analyze:
+      with dbConn:
+        dbConn.execute("ANALYZE")
+      print("%s: analyzed" % args.db)
+    if args.verify:
+      problems = verify_plans(dbConn)
+      for label, statement, step in problems:
+        print("%s: %s\n  in %s" % (label, step, statement[:200]))
+      print("%s: %s" % (args.db, "%d query plans scan big tables" % len(problems) if problems else "query plans verified"))
+
+      sample = sample_db()
+      try:
+        wrong = [(args.db, label, problem) for label, problem in verify_results(dbConn)]
+        wrong += [("sample database", label, problem) for label, problem in verify_results(sample)]
+      finally:
+        sample.close()
+      for source, label, problem in wrong:
+        print("%s: %s: %s" % (source, label, problem))
+      print("%s: %s" % (args.db, "%d wrong query results" % len(wrong) if wrong else "query results verified"))
+      if problems or wrong:
+        sys.exit(1)
+  finally:
+    dbConn.close()
+
+
+if __name__ == '__main__':
+  main()
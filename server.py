@@ -0,0 +1,485 @@
+#
+# server.py
+#
+# A headless HTTP/JSON query service over the object tier, for
+# callers that aren't Python or don't share the machine. Requests
+# are served by a fixed pool of worker threads, each with its own
+# read-only connection; writes are handed to a single writer thread
+# that owns the only read-write connection, so they are applied one
+# at a time and never contend with each other for the lock. Lists
+# (searches, Top-N, many details) are streamed to the client in
+# chunks as they are read from the cursor, never built in full.
+#
+# Endpoints (every response is JSON; records are objects keyed by
+# field name, and add ?format=jsonl to a list endpoint for one
+# object per line instead of an array):
+#
+#   GET  /stats                       General Stats
+#   GET  /lobbyists?pattern=P         lobbyists matching a name pattern
+#   GET  /lobbyists/ID                one lobbyist's details
+#   GET  /details?ids=ID,ID,...       the details of many lobbyists,
+#                                     in ascending order by ID
+#   GET  /top?n=N&year=YEAR           the top N lobbyists of a year
+#   POST /lobbyists/ID/years          {"year": YEAR}
+#   POST /lobbyists/ID/salutation     {"salutation": "..."}
+#   POST /years                       [[ID, YEAR], ...]
+#   POST /salutations                 [[ID, "..."], ...]
+#
+# IDs and years in request bodies are JSON integers and salutations
+# JSON strings; a body of any other shape or type answers 400 and is
+# never written. Writes answer {"updated": n} (per pair, a list of
+# 0 / 1 for the bulk endpoints); a write that can't get the database
+# lock within the busy timeout answers 503 with a Retry-After header.
+#
+# Usage: python server.py [--host h] [--port n] [--threads n]
+#                         [--busy-timeout s] [--log-requests] [database]
+#
+import argparse
+import concurrent.futures
+import http.server
+import json
+import logging
+import re
+import sqlite3
+import urllib.parse
+
+import datatier
+import objecttier
+import schema
+
+logger = logging.getLogger(__name__)
+
+
+#
+# bytes of a streamed response sent per chunk
+#
+CHUNK_BYTES = 64 * 1024
+
+#
+# seconds an idle keep-alive connection may hold a worker thread
+#
+KEEPALIVE_SECONDS = 15
+
+#
+# largest request body accepted, in bytes
+#
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class HTTPError(Exception):
+  def __init__(self, status, message, headers=None):
+    super().__init__(message)
+    self.status = status
+    self.headers = headers or {}
+
+
+##################################################################
+#
+# to_json:
+#
+# Returns: value with every object tier record (anything with
+#          _fields) turned into a dict keyed by field name, so it
+#          can be passed to json.dumps.
+#
+def to_json(value):
+  fields = getattr(value, "_fields", None)
+  if fields is not None:
+    return {field: to_json(item) for field, item in zip(fields, value)}
+  if isinstance(value, list):
+    return [to_json(item) for item in value]
+  return value
+
+
+#
+# names of the JSON types a request body field is checked against
+#
+_JSON_TYPES = {int: "integer", str: "string"}
+
+
+def _is_json(value, kind):
+  # bool is a subclass of int, but true / false are not integers
+  return isinstance(value, kind) and not isinstance(value, bool)
+
+
+def _dumps(value):
+  return json.dumps(to_json(value), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+##################################################################
+#
+# Writer:
+#
+# Runs every write on one thread that owns the only read-write
+# connection, one write at a time, each in its own transaction. The
+# transaction is started with BEGIN IMMEDIATE, so the write lock is
+# taken (waiting up to busy_timeout seconds for other processes to
+# release it) before the object tier function runs; if it can't be
+# had, the write fails with a 503 HTTPError instead of failing
+# half-way. Commits go through objecttier.commit(), so cached results
+# the write made stale are dropped once it is visible to the readers.
+# The connection upgrades the database schema when opened.
+#
+# Constructor(path, busy_timeout=5.0)
+# Methods:
+#   write(fn, *args): runs fn(dbConn, *args) on the writer thread,
+#                     commits if it succeeds, and returns its result
+#   close(): waits for queued writes, then closes the connection
+#
+class Writer:
+  def __init__(self, path, busy_timeout=5.0):
+    self._db = datatier.ConnectionManager(path, timeout=busy_timeout)
+    self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="writer")
+    self._executor.submit(self._open).result()
+
+  def _open(self):
+    schema.upgrade(self._db.connection())
+
+  def _run(self, fn, args):
+    dbConn = self._db.connection()
+    try:
+      dbConn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError as err:
+      logger.error("write lock not acquired: %s", err)
+      raise HTTPError(503, "database is busy, try again", {"Retry-After": "1"})
+
+    try:
+      result = fn(dbConn, *args)
+      objecttier.commit(dbConn)
+      return result
+    except BaseException:
+      objecttier.rollback(dbConn)
+      raise
+
+  def write(self, fn, *args):
+    return self._executor.submit(self._run, fn, args).result()
+
+  def close(self):
+    self._executor.shutdown()
+    self._db.close_all()
+
+
+##################################################################
+#
+# QueryServer:
+#
+# A ThreadingHTTPServer that hands each client connection to one of
+# a fixed pool of worker threads instead of starting a thread per
+# connection, so each worker opens its read-only connection (and
+# prepares its statements) once and reuses it. A keep-alive client
+# holds its worker until it disconnects or idles for
+# KEEPALIVE_SECONDS, so give at least as many threads as concurrent
+# clients. Use as a context manager, or call server_close() when
+# done.
+#
+# Constructor(address, path="Chicago_Lobbyists.db", threads=8,
+#             busy_timeout=5.0)
+#   address: (host, port) to listen on; port 0 picks a free port
+#   threads: number of worker threads
+#   busy_timeout: seconds a read or write waits on a locked database
+# Properties:
+#   readers: datatier.ConnectionManager of the workers' connections
+#   writer: Writer
+#
+class QueryServer(http.server.ThreadingHTTPServer):
+  def __init__(self, address, path="Chicago_Lobbyists.db", threads=8, busy_timeout=5.0):
+    # the writer opens (and upgrades) the database first; the readers
+    # need it in WAL mode before they can open it read-only
+    self.writer = Writer(path, busy_timeout)
+    self.readers = datatier.ConnectionManager(path, read_only=True, timeout=busy_timeout)
+    self._workers = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="query")
+    try:
+      super().__init__(address, QueryHandler)
+    except BaseException:
+      self._close_pools()
+      raise
+
+  def process_request(self, request, client_address):
+    self._workers.submit(self.process_request_thread, request, client_address)
+
+  def _close_pools(self):
+    self._workers.shutdown()
+    self.writer.close()
+    self.readers.close_all()
+
+  def server_close(self):
+    super().server_close()
+    self._close_pools()
+
+
+##################################################################
+#
+# QueryHandler:
+#
+# Serves the endpoints listed at the top of this file. Routes are
+# (method, path regex, handler method name); a handler gets the
+# groups of the path match and either returns a value to be sent as
+# JSON or streams the response itself.
+#
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  timeout = KEEPALIVE_SECONDS
+  # headers and body go out as separate writes; with Nagle's algorithm
+  # on, the body then waits for the client's delayed ACK (~40 ms)
+  disable_nagle_algorithm = True
+
+  ROUTES = [
+    ("GET", r"/stats", "get_stats"),
+    ("GET", r"/lobbyists", "get_lobbyists"),
+    ("GET", r"/lobbyists/(-?\d+)", "get_details"),
+    ("GET", r"/details", "get_details_many"),
+    ("GET", r"/top", "get_top"),
+    ("POST", r"/lobbyists/(-?\d+)/years", "post_year"),
+    ("POST", r"/lobbyists/(-?\d+)/salutation", "post_salutation"),
+    ("POST", r"/years", "post_years"),
+    ("POST", r"/salutations", "post_salutations"),
+  ]
+
+  def do_GET(self):
+    self._dispatch("GET")
+
+  def do_POST(self):
+    self._dispatch("POST")
+
+  def log_message(self, format, *args):
+    logger.info("%s %s", self.address_string(), format % args)
+
+  #
+  # routing and responses
+  #
+
+  def _dispatch(self, method):
+    url = urllib.parse.urlsplit(self.path)
+    self._streaming = False
+    self.query = urllib.parse.parse_qs(url.query)
+    try:
+      # read the body whatever the outcome, so the next request on a
+      # keep-alive connection starts where it should
+      self._request_body = self._read_body()
+      allowed = []
+      for route_method, pattern, name in self.ROUTES:
+        match = re.fullmatch(pattern, url.path.rstrip("/") or "/")
+        if match is None:
+          continue
+        if route_method != method:
+          allowed.append(route_method)
+          continue
+        result = getattr(self, name)(*match.groups())
+        if result is not None:
+          self._send_json(200, result)
+        return
+      if allowed:
+        raise HTTPError(405, "%s not allowed here" % method, {"Allow": ", ".join(allowed)})
+      raise HTTPError(404, "no such endpoint: %s" % url.path)
+    except (BrokenPipeError, ConnectionResetError):
+      self.close_connection = True
+    except Exception as err:
+      if self._streaming:
+        # the status line is already sent, so an error can't be
+        # reported; end the response early by closing the connection,
+        # which the client sees as a truncated body
+        logger.exception("%s %s failed while streaming", method, self.path)
+        self.close_connection = True
+      elif isinstance(err, HTTPError):
+        self._send_json(err.status, {"error": str(err)}, err.headers)
+      elif isinstance(err, (ValueError, TypeError)):
+        self._send_json(400, {"error": str(err)})
+      else:
+        logger.exception("%s %s failed", method, self.path)
+        self._send_json(500, {"error": "internal error"})
+
+  def _send_json(self, status, value, headers=None):
+    body = _dumps(value)
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    for name, header in (headers or {}).items():
+      self.send_header(name, header)
+    if self.close_connection:
+      self.send_header("Connection", "close")
+    self.end_headers()
+    self.wfile.write(body)
+
+  def _write_chunk(self, data):
+    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+  #
+  # Streams rows as a JSON array (or JSON Lines, with ?format=jsonl)
+  # using chunked transfer encoding, CHUNK_BYTES at a time. If the
+  # client goes away the rows are closed, which releases the cursor.
+  #
+  def _stream(self, rows):
+    jsonl = self._param("format", "json") == "jsonl"
+    self._streaming = True
+    self.send_response(200)
+    self.send_header("Content-Type", "application/x-ndjson" if jsonl else "application/json")
+    self.send_header("Transfer-Encoding", "chunked")
+    self.end_headers()
+
+    separator = b"\n" if jsonl else b","
+    buffer = bytearray() if jsonl else bytearray(b"[")
+    first = True
+    try:
+      for row in rows:
+        if not first and not jsonl:
+          buffer += separator
+        buffer += _dumps(row)
+        if jsonl:
+          buffer += separator
+        first = False
+        if len(buffer) >= CHUNK_BYTES:
+          self._write_chunk(bytes(buffer))
+          buffer.clear()
+      if not jsonl:
+        buffer += b"]"
+      if buffer:
+        self._write_chunk(bytes(buffer))
+      self.wfile.write(b"0\r\n\r\n")
+    finally:
+      close = getattr(rows, "close", None)
+      if close is not None:
+        close()
+
+  #
+  # parameters
+  #
+
+  def _param(self, name, default=None):
+    values = self.query.get(name)
+    if not values:
+      if default is None:
+        raise HTTPError(400, "missing parameter: %s" % name)
+      return default
+    return values[-1]
+
+  def _int_param(self, name, default=None):
+    value = self._param(name, default)
+    try:
+      return int(value)
+    except ValueError:
+      raise HTTPError(400, "%s must be an integer" % name)
+
+  #
+  # Reads the request body (Content-Length bytes). A body that can't be
+  # read in full, or is too large to accept, fails the request and
+  # closes the connection, since the next request can't be found.
+  #
+  def _read_body(self):
+    if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+      self.close_connection = True
+      raise HTTPError(411, "chunked request bodies are not supported, send Content-Length")
+    try:
+      length = int(self.headers.get("Content-Length") or 0)
+    except ValueError:
+      length = -1
+    if length < 0:
+      self.close_connection = True
+      raise HTTPError(400, "bad Content-Length")
+    if length > MAX_BODY_BYTES:
+      self.close_connection = True
+      raise HTTPError(413, "request body over %d bytes" % MAX_BODY_BYTES)
+    return self.rfile.read(length) if length else b""
+
+  def _body(self):
+    try:
+      return json.loads(self._request_body or b"null")
+    except ValueError:
+      raise HTTPError(400, "request body is not valid JSON")
+
+  #
+  # The request body's fields, checked against the JSON type (int or
+  # str) each must have before a write is queued for them
+  #
+  def _body_field(self, name, kind):
+    body = self._body()
+    if not isinstance(body, dict) or name not in body:
+      raise HTTPError(400, 'request body must be {"%s": ...}' % name)
+    if not _is_json(body[name], kind):
+      raise HTTPError(400, '"%s" must be a JSON %s' % (name, _JSON_TYPES[kind]))
+    return body[name]
+
+  def _body_pairs(self, kind):
+    body = self._body()
+    if not isinstance(body, list) or not all(isinstance(pair, list) and len(pair) == 2 and
+                                             _is_json(pair[0], int) and _is_json(pair[1], kind)
+                                             for pair in body):
+      raise HTTPError(400, "request body must be a list of [id, value] pairs, each id an integer "
+                           "and each value a %s" % _JSON_TYPES[kind])
+    return [tuple(pair) for pair in body]
+
+  @property
+  def dbConn(self):
+    return self.server.readers.connection()
+
+  #
+  # endpoints
+  #
+
+  def get_stats(self):
+    stats = objecttier.get_stats(self.dbConn)
+    if stats is None:
+      raise HTTPError(500, "internal error")
+    return stats
+
+  def get_lobbyists(self):
+    self._stream(objecttier.iter_lobbyists(self.dbConn, self._param("pattern", "%")))
+
+  def get_details(self, lobbyist_id):
+    details = objecttier.get_lobbyist_details(self.dbConn, int(lobbyist_id))
+    if details is None:
+      raise HTTPError(404, "no lobbyist with ID %s" % lobbyist_id)
+    return details
+
+  def get_details_many(self):
+    try:
+      lobbyist_ids = [int(value) for value in self._param("ids").split(",") if value.strip()]
+    except ValueError:
+      raise HTTPError(400, "ids must be a comma-separated list of integers")
+    # sorted and without repeats, the chunks come back in ascending
+    # order by ID and no lobbyist is sent twice
+    self._stream(objecttier.iter_lobbyist_details_many(self.dbConn, sorted(set(lobbyist_ids))))
+
+  def get_top(self):
+    N = self._int_param("n", "10")
+    if N < 0:
+      raise HTTPError(400, "n must not be negative")
+    self._stream(objecttier.iter_top_N_lobbyists(self.dbConn, N, self._param("year")))
+
+  def post_year(self, lobbyist_id):
+    year = self._body_field("year", int)
+    return {"updated": self.server.writer.write(objecttier.add_lobbyist_year, int(lobbyist_id), year)}
+
+  def post_salutation(self, lobbyist_id):
+    salutation = self._body_field("salutation", str)
+    return {"updated": self.server.writer.write(objecttier.set_salutation, int(lobbyist_id), salutation)}
+
+  def post_years(self):
+    return {"updated": self.server.writer.write(objecttier.add_lobbyist_years, self._body_pairs(int))}
+
+  def post_salutations(self):
+    return {"updated": self.server.writer.write(objecttier.set_salutations, self._body_pairs(str))}
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Serve lobbyist queries as JSON over HTTP.")
+  parser.add_argument("db", nargs="?", default="Chicago_Lobbyists.db", help="database to serve")
+  parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+  parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+  parser.add_argument("--threads", type=int, default=8, help="worker threads (at most this many clients at once)")
+  parser.add_argument("--busy-timeout", type=float, default=5.0, help="seconds to wait on a locked database")
+  parser.add_argument("--log-requests", action="store_true", help="log every request")
+  args = parser.parse_args()
+
+  logging.basicConfig(format="%(levelname)s: %(message)s",
+                      level=logging.INFO if args.log_requests else logging.WARNING)
+
+  with QueryServer((args.host, args.port), args.db, args.threads, args.busy_timeout) as server:
+    host, port = server.server_address[:2]
+    print("serving %s on http://%s:%d/ with %d threads (Ctrl+C to stop)" % (args.db, host, port, args.threads))
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,155 @@
+#
+# synthdb.py
+#
+# Builds a synthetic database with the Chicago_Lobbyists.db schema
+# (LobbyistInfo, EmployerInfo, ClientInfo, LobbyistAndEmployer,
+# LobbyistYears and Compensation), for benchmarking without the real
+# data. The same seed and scale always produce the same database.
+# Rows are generated and inserted in batches, so even the 100x scale
+# builds in bounded memory.
+#
+# Usage: python synthdb.py [--scale 1x|10x|100x] [--seed n] database
+#
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+import schema
+
+
+#
+# number of lobbyists at each scale; 1x is about the size of the
+# real database
+#
+SCALES = {
+  "1x": 5000,
+  "10x": 50000,
+  "100x": 500000,
+}
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer",
+               "Michael", "Linda", "David", "Elizabeth", "William", "Barbara"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia",
+              "Miller", "Davis", "Rodriguez", "Martinez", "Hernandez", "Lopez"]
+
+#
+# generated rows are inserted once this many have accumulated
+#
+BATCH_ROWS = 100000
+
+
+##################################################################
+#
+# build_synthetic_db:
+#
+# Creates a database at the given path with num_lobbyists lobbyists
+# registered over the given years, each with a handful of employers
+# and several compensation filings per registered year; roughly 1 in
+# 50 filings spans two years. The first `heavy` lobbyists are
+# long-tenured: registered every year, with many employers and
+# hundreds of filings a year. The database is upgraded with
+# schema.upgrade() once the data is in, so the rollups and indexes
+# are built in one pass rather than row by row.
+#
+# Returns: an open connection to the new database.
+#
+def build_synthetic_db(path, num_lobbyists, years=range(2015, 2025), seed=341, heavy=10):
+  rng = random.Random(seed)
+  years = list(years)
+  num_clients = max(10, num_lobbyists // 2)
+  num_employers = max(5, num_lobbyists // 4)
+
+  dbConn = sqlite3.connect(path)
+  dbConn.executescript(schema.BASE_SCHEMA)
+
+  dbConn.executemany(
+    "INSERT INTO LobbyistInfo VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    ((i, "", rng.choice(FIRST_NAMES), "", rng.choice(LAST_NAMES) + str(i), "",
+      "%d W Madison St" % i, "", "Chicago", "IL", "60602", "USA",
+      "lobbyist%d@example.com" % i, "(312) 555-%04d" % (i % 10000), "")
+     for i in range(1, num_lobbyists + 1)))
+  dbConn.executemany(
+    "INSERT INTO EmployerInfo (Employer_ID, Employer_Name) VALUES (?, ?)",
+    ((i, "Employer %d" % i) for i in range(1, num_employers + 1)))
+  dbConn.executemany(
+    "INSERT INTO ClientInfo (Client_ID, Client_Name) VALUES (?, ?)",
+    ((i, "Client %d" % i) for i in range(1, num_clients + 1)))
+
+  lobbyist_years = []
+  lobbyist_employers = []
+  compensation = []
+
+  def flush():
+    dbConn.executemany("INSERT INTO LobbyistYears VALUES (?, ?)", lobbyist_years)
+    dbConn.executemany("INSERT INTO LobbyistAndEmployer VALUES (?, ?, ?)", lobbyist_employers)
+    dbConn.executemany(
+      "INSERT INTO Compensation (Lobbyist_ID, Compensation_Amount, Period_Start, Period_End, Client_ID) VALUES (?, ?, ?, ?, ?)",
+      compensation)
+    del lobbyist_years[:], lobbyist_employers[:], compensation[:]
+
+  for lobbyist_id in range(1, num_lobbyists + 1):
+    if lobbyist_id <= heavy:
+      registered = years
+      employers = rng.sample(range(1, num_employers + 1), min(num_employers, 20))
+      filings = 300
+    else:
+      first = rng.randrange(len(years))
+      registered = years[first:first + rng.randint(1, len(years) - first)]
+      employers = rng.sample(range(1, num_employers + 1), rng.randint(1, 3))
+      filings = rng.randint(1, 6)
+    for year in registered:
+      lobbyist_years.append((lobbyist_id, year))
+      for employer_id in employers:
+        lobbyist_employers.append((lobbyist_id, employer_id, year))
+      for _ in range(filings):
+        month = rng.randint(1, 12)
+        end_year = year + 1 if rng.random() < 0.02 else year
+        compensation.append((lobbyist_id, round(rng.uniform(100, 50000), 2),
+                             "%d-%02d-01" % (year, month),
+                             "%d-%02d-28" % (end_year, month),
+                             rng.randint(1, num_clients)))
+    if len(compensation) >= BATCH_ROWS:
+      flush()
+
+  flush()
+  dbConn.commit()
+  schema.upgrade(dbConn)
+  return dbConn
+
+
+##################################################################
+#
+# build_scale:
+#
+# build_synthetic_db at one of the named SCALES.
+#
+def build_scale(path, scale, seed=341):
+  return build_synthetic_db(path, SCALES[scale], seed=seed)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Build a synthetic lobbyist database.")
+  parser.add_argument("db", help="database file to create (must not exist)")
+  parser.add_argument("--scale", choices=sorted(SCALES), default="1x", help="size of the database")
+  parser.add_argument("--seed", type=int, default=341, help="random seed")
+  args = parser.parse_args()
+
+  if os.path.exists(args.db):
+    parser.error("%s already exists" % args.db)
+
+  start = time.perf_counter()
+  dbConn = build_scale(args.db, args.scale, args.seed)
+  counts = {table: dbConn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+            for table in ("LobbyistInfo", "EmployerInfo", "ClientInfo",
+                          "LobbyistAndEmployer", "LobbyistYears", "Compensation")}
+  dbConn.close()
+
+  print("%s: %s scale, seed %d, built in %.1f s" % (args.db, args.scale, args.seed, time.perf_counter() - start))
+  for table, count in counts.items():
+    print("  %-20s %12s rows" % (table, "{:,}".format(count)))
+
+
+if __name__ == '__main__':
+  main()
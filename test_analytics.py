@@ -0,0 +1,68 @@
+#
+# test_analytics.py
+#
+# Checks the analytics on databases with no single-year filings,
+# where every per-year result must be empty rather than an error,
+# and on a small one against np.percentile. Run with
+# python -m unittest test_analytics (skipped without numpy).
+#
+import sqlite3
+import unittest
+
+import analytics
+import schema
+
+np = analytics.np
+
+
+def _database(filings=()):
+  dbConn = sqlite3.connect(":memory:")
+  dbConn.executescript(schema.BASE_SCHEMA)
+  dbConn.executemany("""
+      INSERT INTO Compensation (Lobbyist_ID, Compensation_Amount, Period_Start, Period_End, Client_ID)
+      VALUES (?, ?, ?, ?, ?)
+  """, filings)
+  dbConn.executemany("INSERT INTO LobbyistYears (Lobbyist_ID, Year) VALUES (?, ?)",
+                     {(filing[0], int(filing[2][:4])) for filing in filings})
+  dbConn.commit()
+  schema.upgrade(dbConn)
+  return dbConn
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class EmptyYearsTest(unittest.TestCase):
+  def check_empty(self, comp):
+    self.assertEqual(analytics.top_n_by_year(comp, 5), {})
+    years, values = analytics.percentiles_by_year(comp, (50, 90))
+    self.assertEqual(len(years), 0)
+    self.assertEqual(values.shape, (0, 2))
+    self.assertEqual(len(analytics.year_over_year(comp)[0]), 0)
+    self.assertEqual(len(analytics.yearly_totals(comp)[0]), 0)
+
+  def test_empty_database(self):
+    comp = analytics.load_compensation(_database())
+    self.assertEqual(len(comp.Amount), 0)
+    self.check_empty(comp)
+    self.assertEqual(len(analytics.client_totals(comp)[0]), 0)
+
+  def test_only_filings_spanning_years(self):
+    comp = analytics.load_compensation(_database([(1, 100.0, "2019-06-01", "2020-05-31", 1)]))
+    self.check_empty(comp)
+    clients, totals = analytics.client_totals(comp)
+    self.assertEqual((clients.tolist(), totals.tolist()), ([1], [100.0]))
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class SmallDatabaseTest(unittest.TestCase):
+  def test_top_n_and_percentiles(self):
+    filings = [(lobbyist_id, 10.0 * lobbyist_id, "2020-01-01", "2020-12-31", 1) for lobbyist_id in range(1, 8)]
+    comp = analytics.load_compensation(_database(filings))
+
+    self.assertEqual(analytics.top_n_by_year(comp, 2), {2020: [(7, 70.0), (6, 60.0)]})
+    years, values = analytics.percentiles_by_year(comp, (50, 90))
+    self.assertEqual(years.tolist(), [2020])
+    np.testing.assert_allclose(values[0], np.percentile([10.0 * i for i in range(1, 8)], [50, 90]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,172 @@
+#
+# test_ingest.py
+#
+# Checks the delta sync (ingest.py --sync): a database built from one
+# snapshot of the exports and then synced with a newer one, with rows
+# added, changed and deleted, must end up with the same rollups and
+# statistics (LobbyistYearTotals, TableCounts, YearStats) as a
+# database built from the newer snapshot, and the object tier's
+# cached results must not outlive the sync. Run with
+# python -m unittest test_ingest.
+#
+import csv
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+import datatier
+import ingest
+import objecttier
+
+HEADERS = {
+  "lobbyists": ["LOBBYIST_ID", "SALUTATION", "FIRST_NAME", "LAST_NAME", "PHONE"],
+  "employers": ["EMPLOYER_ID", "EMPLOYER_NAME"],
+  "clients": ["CLIENT_ID", "CLIENT_NAME"],
+  "lobbyist_employers": ["LOBBYIST_ID", "EMPLOYER_ID", "YEAR"],
+  "lobbyist_years": ["LOBBYIST_ID", "YEAR"],
+  "compensation": ["COMPENSATION_ID", "LOBBYIST_ID", "COMPENSATION_AMOUNT", "PERIOD_START", "PERIOD_END", "CLIENT_ID"],
+}
+
+#
+# filing periods: single-year ones count towards their year in the
+# rollup, the spanning and undated ones towards year 0
+#
+PERIODS = [("1/1/2019", "12/31/2019"), ("2/1/2020", "11/30/2020"),
+           ("6/1/2019", "5/31/2020"), ("", "")]
+
+
+def _snapshot(rng):
+  rows = {
+    "lobbyists": {i: [i, "", "First%d" % i, "Last%d" % (i % 7), "(312) 555-%04d" % i] for i in range(1, 31)},
+    "employers": [[i, "Employer %d" % i] for i in range(1, 6)],
+    "clients": [[i, "Client %d" % i] for i in range(1, 11)],
+    "lobbyist_employers": [[i, i % 5 + 1, 2019 + i % 2] for i in range(1, 31)],
+    "lobbyist_years": [[i, year] for i in range(1, 31) for year in (2019, 2020) if (i + year) % 3],
+    "compensation": {},
+  }
+  for filing_id in range(1, 121):
+    start, end = rng.choice(PERIODS)
+    rows["compensation"][filing_id] = [filing_id, rng.randint(1, 30), "$%s.00" % "{:,}".format(rng.randint(100, 5000)),
+                                       start, end, rng.randint(1, 10)]
+  return rows
+
+
+# the newer snapshot: rows added, changed and deleted in the tables
+# matched by ID and in one matched by content
+def _changed(rows):
+  rows = {source: (dict((key, list(row)) for key, row in value.items()) if isinstance(value, dict)
+                   else [list(row) for row in value])
+          for source, value in rows.items()}
+  lobbyists = rows["lobbyists"]
+  del lobbyists[30]
+  lobbyists[5][2] = "Renamed"
+  lobbyists[31] = [31, "Dr.", "New", "Lobbyist", ""]
+
+  years = rows["lobbyist_years"]
+  del years[:3]
+  years += [[31, 2020], [5, 2021], [5, 2021]]
+
+  filings = rows["compensation"]
+  for filing_id in range(1, 6):
+    del filings[filing_id]
+  for filing_id in range(10, 15):
+    filings[filing_id][2] = "$9,999.00"
+  filings[20][3:5] = ["6/1/2019", "5/31/2020"]
+  filings[21][3:5] = ["1/1/2020", "12/31/2020"]
+  filings[25][1] = 31
+  filings[121] = [121, 31, "$250.00", "1/1/2021", "12/31/2021", 3]
+  filings[122] = [122, 5, "$100.00", "", "", 3]
+  return rows
+
+
+def _write(directory, rows):
+  files = {}
+  for source, header in HEADERS.items():
+    path = files[source] = os.path.join(directory, source + ".csv")
+    values = rows[source].values() if isinstance(rows[source], dict) else rows[source]
+    with open(path, "w", newline="", encoding="utf-8") as out:
+      writer = csv.writer(out)
+      writer.writerow(header)
+      writer.writerows(values)
+  return files
+
+
+def _derived(path):
+  dbConn = sqlite3.connect(path)
+  try:
+    return {
+      "LobbyistYearTotals": dbConn.execute("""
+          SELECT Lobbyist_ID, Year, ROUND(Total_Compensation, 6), Num_Clients
+          FROM LobbyistYearTotals ORDER BY Lobbyist_ID, Year""").fetchall(),
+      "TableCounts": dbConn.execute("SELECT * FROM TableCounts ORDER BY Table_Name").fetchall(),
+      # a year whose last registration and filing went away keeps a row
+      # of zeros, which a fresh build never has
+      "YearStats": dbConn.execute("""
+          SELECT Year, Num_Lobbyists, ROUND(Total_Compensation, 6) FROM YearStats
+          WHERE Num_Lobbyists <> 0 OR ROUND(Total_Compensation, 6) <> 0 ORDER BY Year""").fetchall(),
+    }
+  finally:
+    dbConn.close()
+
+
+class SyncTest(unittest.TestCase):
+  def setUp(self):
+    # the snapshots leave out most columns, which ingest warns about
+    level = ingest.logger.level
+    ingest.logger.setLevel(logging.ERROR)
+    self.addCleanup(ingest.logger.setLevel, level)
+
+    self.tmp = tempfile.TemporaryDirectory()
+    rng = random.Random(7)
+    self.before = _snapshot(rng)
+    self.after = _changed(self.before)
+    os.mkdir(os.path.join(self.tmp.name, "before"))
+    os.mkdir(os.path.join(self.tmp.name, "after"))
+    self.before_files = _write(os.path.join(self.tmp.name, "before"), self.before)
+    self.after_files = _write(os.path.join(self.tmp.name, "after"), self.after)
+
+    self.synced = os.path.join(self.tmp.name, "synced.db")
+    ingest.ingest(self.synced, self.before_files)
+    objecttier.cache.clear()
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_sync_matches_a_full_rebuild(self):
+    report = {entry[0]: entry[1:4] for entry in ingest.sync(self.synced, self.after_files)}
+    self.assertEqual(report["LobbyistInfo"], (1, 1, 1))
+    self.assertEqual(report["EmployerInfo"], (0, 0, 0))
+    self.assertEqual(report["LobbyistYears"], (3, 0, 3))
+    self.assertEqual(report["Compensation"], (2, 8, 5))
+
+    rebuilt = os.path.join(self.tmp.name, "rebuilt.db")
+    ingest.ingest(rebuilt, self.after_files)
+    self.assertEqual(_derived(self.synced), _derived(rebuilt))
+
+    # a second sync of the same snapshot has nothing to do
+    report = ingest.sync(self.synced, self.after_files)
+    self.assertEqual([entry[1:4] for entry in report], [(0, 0, 0)] * len(report))
+    self.assertEqual(_derived(self.synced), _derived(rebuilt))
+
+  def test_sync_drops_cached_results(self):
+    db = datatier.ConnectionManager(self.synced)
+    try:
+      dbConn = db.connection()
+      self.assertEqual(objecttier.get_lobbyist_details(dbConn, 5).First_Name, "First5")
+      top_before = objecttier.get_top_N_lobbyists(dbConn, 30, 2020)
+
+      ingest.sync(self.synced, self.after_files)
+
+      self.assertEqual(objecttier.get_lobbyist_details(dbConn, 5).First_Name, "Renamed")
+      top_after = objecttier.get_top_N_lobbyists(dbConn, 30, 2020)
+      self.assertNotEqual(top_after, top_before)
+      self.assertEqual(top_after, objecttier.get_top_N_lobbyists(dbConn, 30, 2020, use_cache=False))
+    finally:
+      db.close_all()
+
+
+if __name__ == '__main__':
+  unittest.main()
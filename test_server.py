@@ -0,0 +1,151 @@
+#
+# test_server.py
+#
+# Runs server.py on a small sample database and checks that many
+# details are streamed, that write bodies of the wrong type are
+# rejected, and how it behaves when things go wrong: a database error
+# in the middle of a streamed response must close the connection, so
+# the client sees a truncated body rather than a complete-looking
+# one. Run with python -m unittest test_server.
+#
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import objecttier
+import schema
+import server
+
+
+# the body of a complete chunked response, with the chunking removed
+def _unchunk(body):
+  data = b""
+  while True:
+    size, _, body = body.partition(b"\r\n")
+    size = int(size, 16)
+    if size == 0:
+      return data
+    data += body[:size]
+    body = body[size + 2:]
+
+
+class ServerTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(self.tmp.name, "sample.db")
+    sample = schema.sample_db()
+    target = sqlite3.connect(path)
+    sample.backup(target)
+    target.close()
+    sample.close()
+
+    objecttier.cache.clear()
+    self.server = server.QueryServer(("127.0.0.1", 0), path, threads=2)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.thread.join()
+    self.server.server_close()
+    self.tmp.cleanup()
+
+  # sends one request and reads until the server closes the connection
+  # (a connection still open after timeout seconds fails the test);
+  # close=True asks the server to close it once the response is sent
+  def request_until_closed(self, path, close=False, timeout=5.0):
+    sock = socket.create_connection(self.server.server_address[:2], timeout=timeout)
+    try:
+      headers = b"Host: test\r\nConnection: close\r\n" if close else b"Host: test\r\n"
+      sock.sendall(b"GET %s HTTP/1.1\r\n%s\r\n" % (path.encode("ascii"), headers))
+      data = b""
+      while True:
+        try:
+          received = sock.recv(65536)
+        except socket.timeout:
+          self.fail("the connection was left open")
+        if not received:
+          return data
+        data += received
+    finally:
+      sock.close()
+
+
+class DetailsManyTest(ServerTest):
+  def test_details_are_streamed_in_order_by_id(self):
+    ids = [150, 3, 999, 42, 3, 77]
+    with mock.patch.object(objecttier, "iter_lobbyist_details_many",
+                           wraps=objecttier.iter_lobbyist_details_many) as details:
+      data = self.request_until_closed("/details?ids=%s" % ",".join(map(str, ids)), close=True)
+    details.assert_called_once()
+
+    head, _, body = data.partition(b"\r\n\r\n")
+    self.assertTrue(head.startswith(b"HTTP/1.1 200"))
+    self.assertIn(b"Transfer-Encoding: chunked", head)
+    records = json.loads(_unchunk(body))
+    self.assertEqual([record["Lobbyist_ID"] for record in records], [3, 42, 77, 150])
+
+
+class WriteBodyTest(ServerTest):
+  def post(self, path, body):
+    conn = http.client.HTTPConnection(*self.server.server_address[:2], timeout=5)
+    try:
+      conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+      response = conn.getresponse()
+      return response.status, json.loads(response.read())
+    finally:
+      conn.close()
+
+  def test_wrong_types_are_rejected(self):
+    with mock.patch.object(self.server.writer, "write") as write:
+      for path, body in [("/lobbyists/1/years", {"year": [1]}),
+                         ("/lobbyists/1/years", {"year": "2020"}),
+                         ("/lobbyists/1/years", {"year": True}),
+                         ("/lobbyists/1/salutation", {"salutation": 1}),
+                         ("/years", [[1, 2020], [2, None]]),
+                         ("/years", [["1", 2020]]),
+                         ("/salutations", [[1, ["Mr."]]])]:
+        status, response = self.post(path, body)
+        self.assertEqual(status, 400, (path, body))
+        self.assertIn("error", response)
+    write.assert_not_called()
+
+  def test_right_types_are_written(self):
+    self.assertEqual(self.post("/lobbyists/1/years", {"year": 2021}), (200, {"updated": 1}))
+    self.assertEqual(self.post("/salutations", [[1, "Dr."], [9999, "Mr."]]), (200, {"updated": [1, 0]}))
+
+
+class MidStreamErrorTest(ServerTest):
+  def test_error_while_streaming_closes_the_connection(self):
+    iter_lobbyists = objecttier.iter_lobbyists
+
+    # reads 10 rows per fetch and interrupts the query after 50 rows,
+    # so the next fetch fails in select_iter
+    def interrupted(dbConn, pattern):
+      for count, lobbyist in enumerate(iter_lobbyists(dbConn, pattern, 10)):
+        if count == 50:
+          dbConn.interrupt()
+        yield lobbyist
+
+    with mock.patch.object(server.objecttier, "iter_lobbyists", interrupted), \
+         mock.patch.object(server, "CHUNK_BYTES", 256), \
+         self.assertLogs(level="ERROR") as logs:
+      data = self.request_until_closed("/lobbyists?pattern=%25")
+    self.assertIn("ERROR:datatier:select_iter failed: interrupted", logs.output)
+
+    head, _, body = data.partition(b"\r\n\r\n")
+    self.assertTrue(head.startswith(b"HTTP/1.1 200"))
+    self.assertIn(b"Transfer-Encoding: chunked", head)
+    self.assertIn(b'"Lobbyist_ID":1,', body)
+    self.assertFalse(body.endswith(b"0\r\n\r\n"), "the response was terminated as if complete")
+    self.assertNotIn(b"]", body)
+
+
+if __name__ == '__main__':
+  unittest.main()